@@ -0,0 +1,11 @@
+########################################################################
+#                            benchmark suite                           #
+########################################################################
+
+# Local benchmarks of the load, crawl, diff-parse and reconcile paths, without the live GitHub API
+# or a MongoDB server:
+#   mock_github    a local HTTP server replaying GitHub REST/GraphQL fixtures with configurable
+#                  latency and rate-limit headers
+#   mongo_standin  an in-process stand-in of the pymongo collection API used by the package
+#   datasets       synthetic versions datasets scaled from data/versions.json
+#   run            the runner: python -m benchmarks.run --sizes 1000 10000 100000
@@ -0,0 +1,66 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "db_versions", "data")
+VERSIONS_PATH = os.path.join(DATA_DIR, "versions.json")
+
+
+########################################################################
+#                        synthetic versions datasets                   #
+########################################################################
+
+# The real export has ~800 datamodels. The synthetic datasets keep its shape (fields, subjects with
+# a few hundred datamodels at most, semantic versions, commit links) and scale it to any size by
+# cloning the subjects: dataModel.Environment, dataModel.Environment2, ...
+
+def load_templates(path: str = VERSIONS_PATH) -> List[dict]:
+    """
+    Read the documents of the real export, without their `_id`.
+    """
+    with open(path, "r") as file:
+        return [{key: value for key, value in document.items() if key != "_id"} for document in json.load(file)]
+
+
+def synthetic_versions(count: int, seed: int = 0, templates: List[dict] = None) -> Iterator[dict]:
+    """
+    Yield `count` versions documents with unique (subject, dataModel) pairs.
+
+    Args:
+    count (int): The number of documents (e.g. 1_000 to 1_000_000).
+    seed (int): The seed of the random versions and dates, so that the datasets are reproducible.
+    templates (list): The documents to scale. The real export if None.
+    """
+    templates = templates or load_templates()
+    generator = random.Random(seed)
+    start = datetime(2021, 1, 1)
+    for index in range(count):
+        template = templates[index % len(templates)]
+        copy = index // len(templates)
+        subject = template["subject"] + (str(copy + 1) if copy else "")
+        sha = f"{generator.getrandbits(160):040x}"
+        date = start + timedelta(seconds=generator.randrange(3 * 365 * 24 * 3600))
+        yield {
+            "subject": subject,
+            "dataModel": template["dataModel"],
+            "version": f"{generator.randrange(3)}.{generator.randrange(12)}.{generator.randrange(20)}",
+            "link": f"https://api.github.com/repos/smart-data-models/{subject}/git/commits/{sha}",
+            "date": date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "publicLink": f"https://github.com/smart-data-models/{subject}/commit/{sha}",
+        }
+
+
+def write_dataset(path: str, count: int, seed: int = 0) -> str:
+    """
+    Write a synthetic dataset as a JSON array (streamed, so 1M documents do not need to fit in a list).
+    """
+    with open(path, "w") as file:
+        file.write("[\n")
+        for index, document in enumerate(synthetic_versions(count, seed)):
+            if index:
+                file.write(",\n")
+            file.write(json.dumps(document))
+        file.write("\n]\n")
+    return path
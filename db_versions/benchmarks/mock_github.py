@@ -0,0 +1,243 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "db_versions", "utils", "github_commit_data.json")
+
+
+########################################################################
+#                          mock GitHub API server                      #
+########################################################################
+
+# A local server that answers the GitHub calls of the package from the commit fixture
+# (utils/github_commit_data.json), whose patch changes "$schemaVersion" from 0.0.3 to 0.0.4:
+#   GET  /repos/{owner}/{repo}                         the repository
+#   GET  /repos/{owner}/{repo}/commits?path=...        `commits_per_file` commits of the file, the
+#                                                      oldest one changing the version (the newer
+#                                                      ones only show it as a context line)
+#   GET  /repos/{owner}/{repo}/commits/{sha}           the fixture, for the file of the commit
+#   GET  /repos/{owner}/{repo}/git/trees/{ref}         the schema.json files of the repository
+#   POST /graphql                                      history(path:, first: 1) and blob aliases
+# The commits of the files listed in `errors` are answered with a 500, as a failing crawl.
+# Every response waits `latency` seconds, carries an ETag (If-None-Match gets a 304) and the
+# X-RateLimit-* headers of a budget of `rate_limit` requests per window of `reset_window` seconds.
+# The real budget is 5,000 requests per hour, which the governor spreads over the hour: the default
+# window is short so that the benchmarks measure the code, not the pacing.
+
+
+class MockGithub:
+    """
+    The mock server, run in a background thread. Use it as a context manager or call start/stop.
+    """
+
+    def __init__(self, datamodels: Dict[str, List[str]] = None, latency: float = 0.0, rate_limit: int = 5000,
+                 reset_window: float = 1.0, commits_per_file: int = 2, fixture_path: str = FIXTURE_PATH,
+                 errors: Iterable[str] = ()):
+        """
+        Args:
+        datamodels (dict): The datamodels of each subject, for the trees. Every path is answered anyway.
+        latency (float): The delay of every response, in seconds.
+        rate_limit (int): The budget announced in the rate-limit headers (it is not enforced).
+        reset_window (float): The duration of a rate-limit window, in seconds (3600 on GitHub).
+        commits_per_file (int): The number of commits listed for each file.
+        fixture_path (str): The commit replayed for every file.
+        errors (iterable): The paths (e.g. "Garden/schema.json") whose commits are answered with a 500.
+        """
+        with open(fixture_path, "r") as file:
+            self.fixture = json.load(file)
+        self.datamodels = datamodels or {}
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.commits_per_file = commits_per_file
+        self.errors = set(errors)
+        self.reset_window = reset_window
+        self.remaining = rate_limit
+        self.reset = time.time() + reset_window
+        self.requests = 0
+        self.not_modified = 0
+        self._commits: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    # server
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "MockGithub":
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # the headers and the body go out in separate writes: without this, Nagle's algorithm
+                # holds the body until the client's delayed ACK, some 40 ms per request
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if mock._fails(self.path):
+                    mock._respond(self, {"message": "Server Error"}, 500)
+                else:
+                    mock._respond(self, mock._get(self.path))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                mock._respond(self, mock._graphql(json.loads(body)["query"]))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "MockGithub":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _respond(self, handler, payload, status: int = 200):
+        if self.latency:
+            time.sleep(self.latency)
+        status, body = (404, {"message": "Not Found"}) if payload is None else (status, payload)
+        data = json.dumps(body).encode()
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        with self._lock:
+            self.requests += 1
+            if time.time() >= self.reset:
+                self.remaining, self.reset = self.rate_limit, time.time() + self.reset_window
+            self.remaining = max(0, self.remaining - 1)
+            remaining, reset = self.remaining, self.reset
+        if status == 200 and handler.headers.get("If-None-Match") == etag:
+            with self._lock:
+                self.not_modified += 1
+            status, data = 304, b""
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.send_header("ETag", etag)
+        handler.send_header("X-RateLimit-Limit", str(self.rate_limit))
+        handler.send_header("X-RateLimit-Remaining", str(remaining))
+        handler.send_header("X-RateLimit-Reset", f"{reset:.3f}")
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    # REST
+
+    def _fails(self, target: str) -> bool:
+        parts = urlsplit(target)
+        return parts.path.endswith("/commits") and parse_qs(parts.query).get("path", [""])[0] in self.errors
+
+    def _sha(self, repo: str, path: str, index: int) -> str:
+        sha = hashlib.sha1(f"{repo}/{path}/{index}".encode()).hexdigest()
+        with self._lock:
+            self._commits[sha] = (repo, path)
+        return sha
+
+    def _commit(self, repo: str, path: str, sha: str) -> dict:
+        commit = copy.deepcopy(self.fixture)
+        commit["sha"] = sha
+        commit["url"] = f"{self.url}/repos/{repo}/commits/{sha}"
+        commit["html_url"] = f"https://github.com/{repo}/commit/{sha}"
+        commit["files"][0]["filename"] = path
+        return commit
+
+    def _get(self, target: str):
+        parts = urlsplit(target)
+        segments = parts.path.strip("/").split("/")
+        query = parse_qs(parts.query)
+        if len(segments) < 3 or segments[0] != "repos":
+            return None
+        repo = f"{segments[1]}/{segments[2]}"
+        rest = segments[3:]
+
+        if not rest:
+            return {"full_name": repo, "name": segments[2], "url": f"{self.url}/repos/{repo}", "default_branch": "master"}
+        if rest == ["commits"]:
+            path = query.get("path", [""])[0]
+            if "page" in query and query["page"][0] != "1":
+                return []
+            # the newest commits do not touch the version, the oldest one does
+            return [
+                {"sha": sha, "url": f"{self.url}/repos/{repo}/commits/{sha}", "commit": self.fixture["commit"]}
+                for sha in (self._sha(repo, path, index) for index in range(self.commits_per_file))
+            ]
+        if len(rest) == 2 and rest[0] == "commits":
+            repo_path = self._commits.get(rest[1])
+            if repo_path is None:
+                return None
+            commit = self._commit(repo, repo_path[1], rest[1])
+            if rest[1] != self._sha(repo, repo_path[1], self.commits_per_file - 1):
+                # the version shows up as a context line of the newer commits
+                commit["files"][0]["patch"] = '@@ -1,2 +1,2 @@\n   "$schemaVersion": "0.0.4",\n-  "title": "a"\n+  "title": "b"'
+            return commit
+        if rest[:2] == ["git", "trees"]:
+            subject = segments[2]
+            return {
+                "sha": hashlib.sha1(subject.encode()).hexdigest(),
+                "tree": [
+                    {"path": f"{datamodel}/schema.json", "type": "blob", "sha": hashlib.sha1(f"{subject}/{datamodel}".encode()).hexdigest()}
+                    for datamodel in self.datamodels.get(subject, [])
+                ],
+                "truncated": False,
+            }
+        return None
+
+    # GraphQL
+
+    _REPOSITORY = re.compile(r'^\s*(r\d+): repository\(owner: "([^"]+)", name: "([^"]+)"\)')
+    _HISTORY = re.compile(r'^\s*(h\d+): history\(path: "([^"]+)"')
+    _BLOB = re.compile(r'^\s*(b\d+): object\(expression: "HEAD:([^"]+)"\)')
+
+    def _graphql(self, query: str) -> dict:
+        data = {}
+        repository = None
+        for line in query.splitlines():
+            match = self._REPOSITORY.match(line)
+            if match:
+                repository = data[match.group(1)] = {"head": {}}
+                repo = f"{match.group(2)}/{match.group(3)}"
+                continue
+            match = self._HISTORY.match(line)
+            if match:
+                sha = self._sha(repo, match.group(2), self.commits_per_file - 1)
+                repository["head"][match.group(1)] = {"nodes": [{
+                    "oid": sha,
+                    "authoredDate": self.fixture["commit"]["author"]["date"],
+                    "url": f"https://github.com/{repo}/commit/{sha}",
+                    "message": self.fixture["commit"]["message"],
+                }]}
+                continue
+            match = self._BLOB.match(line)
+            if match:
+                repository[match.group(1)] = {"text": '{\n  "$schemaVersion": "0.0.4",\n  "title": "Benchmark"\n}'}
+        return {"data": data}
+
+
+def targets_by_subject(targets: Iterable[Tuple[str, str]]) -> Dict[str, List[str]]:
+    """
+    Group (subject, datamodel) pairs by subject, e.g. for MockGithub(datamodels=...).
+    """
+    grouped = {}
+    for subject, datamodel in targets:
+        grouped.setdefault(subject, []).append(datamodel)
+    return grouped
@@ -0,0 +1,266 @@
+import copy
+import itertools
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Iterable, List
+
+from db_versions.utils.mongodb import register_mongo_client
+
+
+########################################################################
+#                     in-process MongoDB stand-in                      #
+########################################################################
+
+# The subset of the pymongo collection API used by the package, over dicts in memory: find (with
+# equality, $or, $in, range, $type and $exists filters, projection, sort and limit), find_one,
+# distinct, bulk_write of UpdateOne operations ($set, $setOnInsert, $unset, upsert), update_one,
+# update_many, delete_many and create_index. Unique indexes are kept as hash maps, so that the
+# lookups the package makes by (subject, dataModel) are not a scan and the benchmarks measure the
+# package, not the stand-in.
+
+_TYPES = {"string": str, "date": datetime}
+
+
+def _compare(value, condition) -> bool:
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == "$in":
+            if value not in operand:
+                return False
+        elif operator == "$exists":
+            if (value is not None) != bool(operand):
+                return False
+        elif operator == "$type":
+            if not isinstance(value, _TYPES[operand]):
+                return False
+        elif operator in ("$gte", "$gt", "$lte", "$lt"):
+            if value is None or type(value) is not type(operand):
+                return False
+            if operator == "$gte" and not value >= operand or operator == "$gt" and not value > operand:
+                return False
+            if operator == "$lte" and not value <= operand or operator == "$lt" and not value < operand:
+                return False
+        else:
+            raise NotImplementedError(f"Operator {operator} is not supported by the stand-in")
+    return True
+
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif not _compare(document.get(key), condition):
+            return False
+    return True
+
+
+class MemoryCursor:
+    def __init__(self, documents: List[dict]):
+        self._documents = documents
+
+    def sort(self, key_or_list, direction: int = 1) -> "MemoryCursor":
+        keys = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        for key, key_direction in reversed(keys):
+            self._documents.sort(key=lambda document: (document.get(key) is not None, document.get(key)), reverse=key_direction < 0)
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        if count:
+            self._documents = self._documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self._documents)
+
+
+class MemoryCollection:
+    def __init__(self, name: str = "collection", database=None):
+        self.name = name
+        self.database = database
+        self._documents = {}
+        self._ids = itertools.count(1)
+        self._unique = {}  # keys -> {values: _id}
+        self._lock = threading.RLock()
+
+    # indexes
+
+    def create_index(self, keys, name: str = None, unique: bool = False, **options) -> str:
+        fields = tuple(key for key, _ in keys)
+        if unique:
+            with self._lock:
+                if fields not in self._unique:
+                    self._unique[fields] = {
+                        tuple(document.get(field) for field in fields): _id for _id, document in self._documents.items()
+                    }
+        return name or "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    def _lookup(self, query: dict):
+        # the _ids matching an equality query on the fields of a unique index, or None to scan
+        for fields, index in self._unique.items():
+            if set(query) == set(fields) and all(not isinstance(query[field], dict) for field in fields):
+                _id = index.get(tuple(query[field] for field in fields))
+                return [] if _id is None else [_id]
+        if set(query) == {"$or"}:
+            ids = []
+            for branch in query["$or"]:
+                branch_ids = self._lookup(branch)
+                if branch_ids is None:
+                    return None
+                ids.extend(branch_ids)
+            return list(dict.fromkeys(ids))
+        return None
+
+    def _matching(self, query: dict) -> List[dict]:
+        ids = self._lookup(query or {})
+        if ids is None:
+            return [document for document in self._documents.values() if matches(document, query or {})]
+        return [self._documents[_id] for _id in ids if matches(self._documents[_id], query)]
+
+    def _index(self, document: dict, add: bool = True):
+        for fields, index in self._unique.items():
+            key = tuple(document.get(field) for field in fields)
+            if add:
+                index[key] = document["_id"]
+            elif index.get(key) == document["_id"]:
+                del index[key]
+
+    # reads
+
+    @staticmethod
+    def _project(document: dict, projection: dict) -> dict:
+        if not projection:
+            return copy.copy(document)
+        included = [key for key, value in projection.items() if value and key != "_id"]
+        if included:
+            result = {key: document[key] for key in included if key in document}
+            if projection.get("_id", 1) and "_id" in document:
+                result["_id"] = document["_id"]
+            return result
+        return {key: value for key, value in document.items() if projection.get(key, 1)}
+
+    def find(self, query: dict = None, projection: dict = None) -> MemoryCursor:
+        with self._lock:
+            return MemoryCursor([self._project(document, projection) for document in self._matching(query)])
+
+    def find_one(self, query: dict = None, projection: dict = None, sort=None):
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        return next(iter(cursor.limit(1)), None)
+
+    def distinct(self, key: str, query: dict = None) -> list:
+        with self._lock:
+            return list(dict.fromkeys(document[key] for document in self._matching(query) if key in document))
+
+    def count_documents(self, query: dict) -> int:
+        with self._lock:
+            return len(self._matching(query))
+
+    # writes
+
+    def _apply(self, document: dict, update: dict, inserted: bool) -> bool:
+        before = dict(document)
+        for key, value in update.get("$set", {}).items():
+            document[key] = value
+        if inserted:
+            for key, value in update.get("$setOnInsert", {}).items():
+                document[key] = value
+        for key in update.get("$unset", {}):
+            document.pop(key, None)
+        return document != before
+
+    def _update(self, query: dict, update: dict, upsert: bool = False, many: bool = False):
+        matched = modified = 0
+        upserted_id = None
+        with self._lock:
+            found = self._matching(query)
+            for document in found if many else found[:1]:
+                matched += 1
+                self._index(document, add=False)
+                modified += self._apply(document, update, inserted=False)
+                self._index(document)
+            if not found and upsert:
+                document = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+                self._apply(document, update, inserted=True)
+                document.setdefault("_id", next(self._ids))
+                for fields, index in self._unique.items():
+                    if tuple(document.get(field) for field in fields) in index:
+                        raise KeyError(f"Duplicate key on {fields}")
+                self._documents[document["_id"]] = document
+                self._index(document)
+                upserted_id = document["_id"]
+        return SimpleNamespace(matched_count=matched, modified_count=modified, upserted_id=upserted_id)
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        return self._update(query, update, upsert)
+
+    def update_many(self, query: dict, update: dict, upsert: bool = False):
+        return self._update(query, update, upsert, many=True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True):
+        with self._lock:
+            ids = []
+            for document in documents:
+                document = dict(document)
+                document.setdefault("_id", next(self._ids))
+                self._documents[document["_id"]] = document
+                self._index(document)
+                ids.append(document["_id"])
+        return SimpleNamespace(inserted_ids=ids)
+
+    def delete_many(self, query: dict):
+        with self._lock:
+            found = self._matching(query)
+            for document in found:
+                self._index(document, add=False)
+                del self._documents[document["_id"]]
+        return SimpleNamespace(deleted_count=len(found))
+
+    def bulk_write(self, operations, ordered: bool = True):
+        matched = modified = upserted = 0
+        for operation in operations:
+            result = self._update(operation._filter, operation._doc, operation._upsert)
+            matched += result.matched_count
+            modified += result.modified_count
+            upserted += result.upserted_id is not None
+        return SimpleNamespace(matched_count=matched, modified_count=modified, upserted_count=upserted)
+
+    def __len__(self):
+        return len(self._documents)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name, self)
+        return self._collections[name]
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def close(self):
+        pass
+
+
+def install(mongo_host: str = "benchmark", mongo_port: int = 27017) -> MemoryClient:
+    """
+    Register a new stand-in client for a host and port, so that connect_to_mongodb(mongo_host,
+    mongo_port, ...) returns its collections.
+    """
+    client = MemoryClient()
+    register_mongo_client(mongo_host, mongo_port, client)
+    return client
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+from benchmarks import mongo_standin
+from benchmarks.datasets import synthetic_versions, write_dataset
+from benchmarks.mock_github import MockGithub, targets_by_subject
+
+
+########################################################################
+#                            benchmark runner                          #
+########################################################################
+
+# Usage: python -m benchmarks.run [--sizes 1000 10000 100000] [--only load crawl ...] [--latency 0.02]
+# (from the db_versions directory). Each benchmark prints its throughput and the latency
+# percentiles of its unit of work (a bulk chunk, a crawled file, a GraphQL query, a diff batch, a reconcile batch).
+
+BENCHMARKS = ("load", "crawl", "graphql", "diff", "reconcile")
+
+MONGO_HOST, MONGO_PORT, DB_NAME, COLLECTION_NAME = "benchmark", 27017, "benchmark", "versions"
+
+
+class Measure:
+    """
+    The duration of each unit of work of a benchmark and the total number of items processed.
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.items = 0
+        self.latencies: List[float] = []
+        self.elapsed = 0.0
+
+    def time(self, function: Callable, *args, items: int = 1):
+        start = time.perf_counter()
+        result = function(*args)
+        self.latencies.append(time.perf_counter() - start)
+        self.items += items
+        return result
+
+    def report(self) -> str:
+        latencies = sorted(self.latencies) or [0.0]
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+        throughput = self.items / self.elapsed if self.elapsed else 0.0
+        return (
+            f"{self.name:<10} {self.size:>9} {self.items:>9} {self.elapsed:>9.3f} {throughput:>12.1f}"
+            f" {percentile(0.5):>9.2f} {percentile(0.95):>9.2f} {percentile(0.99):>9.2f} {statistics.fmean(latencies) * 1000:>9.2f}"
+        )
+
+
+HEADER = (
+    f"{'benchmark':<10} {'size':>9} {'items':>9} {'seconds':>9} {'items/s':>12}"
+    f" {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}"
+)
+
+
+def _collection():
+    from db_versions.utils.mongodb import connect_to_mongodb
+
+    return connect_to_mongodb(MONGO_HOST, MONGO_PORT, DB_NAME, COLLECTION_NAME)
+
+
+def _fresh_collection():
+    mongo_standin.install(MONGO_HOST, MONGO_PORT)
+    from db_versions.utils.mongodb import create_versions_indexes
+
+    collection = _collection()
+    create_versions_indexes(collection)
+    return collection
+
+
+########################################################################
+#                               benchmarks                             #
+########################################################################
+
+def bench_load(size: int, args) -> Measure:
+    """
+    load_versions of a synthetic export into an empty collection, timed per bulk chunk.
+    """
+    from db_versions.utils import mongodb
+
+    collection = _fresh_collection()
+    measure = Measure("load", size)
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_dataset(os.path.join(directory, "versions.json"), size)
+
+        original = collection.bulk_write
+
+        def timed_bulk_write(operations, ordered=True):
+            return measure.time(original, operations, ordered, items=len(operations))
+
+        collection.bulk_write = timed_bulk_write
+        start = time.perf_counter()
+        mongodb.load_versions(path, collection, chunk_size=args.chunk_size)
+        measure.elapsed = time.perf_counter() - start
+    # the chunk timings only cover the writes: the whole run is the throughput
+    return measure
+
+
+def _targets(size: int):
+    return [(document["subject"], document["dataModel"]) for document in synthetic_versions(size)]
+
+
+def bench_crawl(size: int, args) -> Measure:
+    """
+    GithubCrawler.last_commit of `size` files (at most --max-files) against the mock server.
+    """
+    from db_versions.utils.crawler import CrawlTarget, GithubCrawler
+    from db_versions.utils.github_client import github_session
+    from db_versions.utils.ratelimit import RateLimitGovernor
+
+    targets = [CrawlTarget(*target) for target in _targets(min(size, args.max_files))]
+    measure = Measure("crawl", size)
+    with MockGithub(targets_by_subject(targets), latency=args.latency) as mock:
+        session = github_session(None, governor=RateLimitGovernor(burst=args.concurrency), pool_size=args.concurrency, cache=None)
+        crawler = GithubCrawler(None, max_per_host=args.concurrency, api_url=mock.url, session=session)
+
+        async def timed(target):
+            start = time.perf_counter()
+            await crawler.last_commit(target, "$schemaVersion")
+            measure.latencies.append(time.perf_counter() - start)
+            measure.items += 1
+
+        async def run():
+            await asyncio.gather(*(timed(target) for target in targets))
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        measure.elapsed = time.perf_counter() - start
+    return measure
+
+
+def bench_graphql(size: int, args) -> Measure:
+    """
+    GraphqlBackend.last_commits of `size` files (at most --max-files), timed per query.
+    """
+    from db_versions.utils.crawler import CrawlTarget
+    from db_versions.utils.github_client import github_session
+    from db_versions.utils.graphql import GraphqlBackend, batch_targets, build_query, parse_response
+
+    targets = [CrawlTarget(*target) for target in _targets(min(size, args.max_files))]
+    measure = Measure("graphql", size)
+    with MockGithub(targets_by_subject(targets), latency=args.latency) as mock:
+        backend = GraphqlBackend(None, url=f"{mock.url}/graphql", session=github_session(None, cache=None))
+        start = time.perf_counter()
+        for batch in batch_targets(targets, backend.max_paths):
+            data = measure.time(backend.query, build_query(batch), items=sum(len(paths) for _, paths in batch))
+            parse_response(batch, data, "$schemaVersion")
+        measure.elapsed = time.perf_counter() - start
+    return measure
+
+
+def bench_diff(size: int, args) -> Measure:
+    """
+    analyze_commits over `size` copies of the fixture commit, in one call (on --workers processes
+    from PROCESS_POOL_THRESHOLD commits on), timed per call.
+    """
+    import json
+    from benchmarks.mock_github import FIXTURE_PATH
+    from db_versions.utils.diff import analyze_commits
+
+    with open(FIXTURE_PATH, "r") as file:
+        commits = [json.load(file)] * size
+    measure = Measure("diff", size)
+    start = time.perf_counter()
+    measure.time(lambda: list(analyze_commits(commits, workers=args.workers)), items=size)
+    measure.elapsed = time.perf_counter() - start
+    return measure
+
+
+def bench_reconcile(size: int, args) -> Measure:
+    """
+    reconcile_versions of one newer record per datamodel of a loaded collection, timed per batch.
+    """
+    from datetime import datetime
+    from db_versions.main import reconcile_versions
+    from db_versions.utils.mongodb import load_versions
+
+    collection = _fresh_collection()
+    with tempfile.TemporaryDirectory() as directory:
+        load_versions(write_dataset(os.path.join(directory, "versions.json"), size), collection)
+
+    records = [
+        (document["subject"], document["dataModel"], document["version"], datetime(2025, 1, 1))
+        for document in synthetic_versions(size)
+    ]
+    measure = Measure("reconcile", size)
+    start = time.perf_counter()
+    for index in range(0, len(records), args.batch_size):
+        batch = records[index:index + args.batch_size]
+        measure.time(reconcile_versions, MONGO_HOST, MONGO_PORT, DB_NAME, COLLECTION_NAME, batch, items=len(batch))
+    measure.elapsed = time.perf_counter() - start
+    return measure
+
+
+########################################################################
+#                                 main                                 #
+########################################################################
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Local benchmarks of db-versions")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="dataset sizes, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--latency", type=float, default=0.0, help="delay of every mock GitHub response, in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests of the crawler")
+    parser.add_argument("--max-files", type=int, default=2000, help="maximum number of files crawled per size")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="documents per bulk write of the load")
+    parser.add_argument("--batch-size", type=int, default=100, help="records per reconcile batch")
+    parser.add_argument("--workers", type=int, help="processes of the diff analysis (default: the number of CPUs)")
+    parser.add_argument("--metrics", help="run with the instrumentation on and write its metrics to this file")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    functions = {
+        "load": bench_load, "crawl": bench_crawl, "graphql": bench_graphql, "diff": bench_diff, "reconcile": bench_reconcile,
+    }
+    # the benchmarks must not touch the user's GitHub cache or rate-limit state
+    os.environ["GITHUB_HTTP_CACHE"] = "off"
+    os.environ.pop("GITHUB_RATE_STATE", None)
+
+    if args.metrics:
+        from db_versions.utils import metrics
+
+        # compare with a run without --metrics to see the overhead of the instrumentation
+        metrics.enable()
+
+    print(HEADER)
+    for name in args.only:
+        for size in args.sizes:
+            print(functions[name](size, args).report(), flush=True)
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import sys
+
+from db_versions.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,461 @@
+########################################################################
+#                       Command line entry point                       #
+########################################################################
+
+# Usage: db-versions <command> [options]   (or: python -m db_versions <command> [options])
+#
+# Commands:
+#   load       insert a versions export (e.g. data/versions_db.json) into MongoDB
+#   indexes    create the indexes of the versions collection
+#   reconcile  compare versions and commit dates to the database and update it
+#   crawl      find the last commit that changed the version of a schema.json
+#   history    extract the old and new version from a commit
+#   sweep      crawl every datamodel of the collection concurrently and reconcile the results
+#   full-sweep crawl and reconcile every datamodel as checkpointed tasks on a pool, resumable with --resume
+#   migrate    convert the string dates into BSON datetimes and fill the sortable version keys
+#   mirror     read the version history from local git mirrors (no API calls), optionally record or reconcile it
+#   as-of      the version of a datamodel at a date, or its whole history, from the history collection
+#   webhook    receive GitHub push events and reconcile only the datamodels they touched
+#   export     write the versions (and history) collections to a memory-mapped columnar file
+#   query      filter a columnar export by subject, datamodel, date or version, without MongoDB
+#
+# Global options (before the command): --metrics-file / --metrics-port to record the timings and
+# counters of the run (see utils/metrics.py), --profile to run it under cProfile.
+# MongoDB and GitHub settings default to the env variables described in the README (.env is loaded).
+# PyGithub and pymongo are only imported by the command that needs them, so `--help` does no I/O.
+
+import argparse
+import json
+import os
+import sys
+
+from db_versions.utils import cache_path
+
+
+DEFAULT_SEARCH_STRING = "$schemaVersion"
+
+
+########################################################################
+#                               commands                               #
+########################################################################
+
+def _collection(args, create_indexes=False):
+    from db_versions.utils.mongodb import connect_to_mongodb
+
+    return connect_to_mongodb(args.mongo_host, args.mongo_port, args.db_name, args.collection_name, create_indexes=create_indexes)
+
+
+def cmd_load(args):
+    from db_versions.utils.mongodb import create_versions_indexes, load_versions
+
+    collection = _collection(args)
+    # the unique index is created first, so the upserts on (subject, dataModel) are indexed lookups
+    create_versions_indexes(collection)
+    counts = load_versions(args.path, collection, chunk_size=args.chunk_size, keep_ids=args.keep_ids)
+    print(", ".join(f"{name}: {count}" for name, count in counts.items()))
+
+
+def cmd_indexes(args):
+    from db_versions.utils.mongodb import create_versions_indexes
+
+    if not create_versions_indexes(_collection(args)):
+        return 1
+
+
+def cmd_migrate(args):
+    from db_versions.utils.mongodb import migrate_dates, migrate_version_keys
+
+    collection = _collection(args, create_indexes=True)
+    print(f"Dates converted: {migrate_dates(collection)}")
+    print(f"Version keys updated: {migrate_version_keys(collection)}")
+
+
+def cmd_reconcile(args):
+    from db_versions.main import reconcile_versions
+
+    if args.records:
+        # JSON list of {"subject", "dataModel", "version", "date"} objects
+        with open(args.records, "r") as file:
+            records = [(item["subject"], item["dataModel"], item["version"], item["date"]) for item in json.load(file)]
+    elif args.subject and args.datamodel and args.version and args.date:
+        records = [(args.subject, args.datamodel, args.version, args.date)]
+    else:
+        print("reconcile needs either --records or --subject, --datamodel, --version and --date")
+        return 2
+
+    results = reconcile_versions(args.mongo_host, args.mongo_port, args.db_name, args.collection_name, records)
+    for subject, datamodel, status in results:
+        print(f"{subject} / {datamodel}: {status}")
+
+
+def cmd_crawl(args):
+    from db_versions.utils.utils import last_commit_date_url
+
+    result = last_commit_date_url(args.path, args.repo, args.token, args.search_string)
+    if result:
+        commit_date, commit_url, sha = result
+        print(f"Last Commit Date: {commit_date}")
+        print(f"Commit URL: {commit_url}")
+        print(f"Last commit sha: {sha}")
+    else:
+        print("No commit data found in schema.json")
+
+
+def cmd_history(args):
+    from db_versions.utils.utils import extract_commit_data
+
+    result = extract_commit_data(args.repo, args.sha, args.token, args.search_string, args.path)
+    if result is None:
+        print("No version change found in the commit")
+    elif args.record:
+        from db_versions.utils.history import history_collection, record_commit
+
+        collection = history_collection(args.mongo_host, args.mongo_port, args.db_name, args.history_collection_name)
+        print(f"Transitions recorded: {record_commit(collection, args.repo, args.sha, args.token, args.search_string)}")
+
+
+def cmd_as_of(args):
+    from db_versions.utils.history import as_of, history_collection, version_history
+
+    collection = history_collection(args.mongo_host, args.mongo_port, args.db_name, args.history_collection_name)
+    if args.date is None:
+        for transition in version_history(collection, args.subject, args.datamodel):
+            print(f"{transition['date'].isoformat()}Z {transition.get('previousVersion')} -> {transition['version']} {transition['url']}")
+        return
+    transition = as_of(collection, args.subject, args.datamodel, args.date)
+    if transition is None:
+        print(f"{args.subject} / {args.datamodel} had no version at {args.date}")
+    else:
+        print(f"{args.subject} / {args.datamodel} was at version {transition['version']} since {transition['date'].isoformat()}Z")
+
+
+def cmd_sweep(args):
+    from db_versions.main import crawl_and_reconcile
+
+    targets = None
+    if args.subject and not args.datamodel:
+        print("sweep --subject needs at least one --datamodel")
+        return 2
+    if args.subject:
+        targets = [(args.subject, datamodel) for datamodel in args.datamodel]
+
+    results = crawl_and_reconcile(
+        args.mongo_host, args.mongo_port, args.db_name, args.collection_name, args.token, args.search_string,
+        targets=targets, batch_size=args.batch_size, max_per_host=args.concurrency, incremental=args.incremental,
+        changed_only=args.changed_only, backend=args.backend, history_collection_name=args.history_collection_name,
+    )
+    for subject, datamodel, status in results:
+        print(f"{subject} / {datamodel}: {status}")
+
+
+def cmd_full_sweep(args):
+    import functools
+    from db_versions.utils.scheduler import (
+        SUBJECT_TASK, MongoTaskStore, SqliteTaskStore, SweepScheduler, default_state_path, sweep_datamodel, sweep_subject,
+    )
+
+    collection = _collection(args, create_indexes=True)
+    if args.granularity == "subject":
+        keys = [(subject, SUBJECT_TASK) for subject in sorted(collection.distinct("subject"))]
+        task = sweep_subject
+    else:
+        keys = sorted(
+            (doc["subject"], doc["dataModel"]) for doc in collection.find({}, {"_id": 0, "subject": 1, "dataModel": 1})
+        )
+        task = sweep_datamodel
+
+    if args.state_collection:
+        store = MongoTaskStore(collection.database[args.state_collection])
+    else:
+        store = SqliteTaskStore(args.state or default_state_path())
+
+    work = functools.partial(
+        task, args.mongo_host, args.mongo_port, args.db_name, args.collection_name, args.token, args.search_string,
+        history_collection_name=args.history_collection_name,
+    )
+    scheduler = SweepScheduler(
+        store, work, workers=args.workers, executor=args.executor, max_attempts=args.max_attempts, backoff=args.backoff
+    )
+    counts = scheduler.run(
+        keys, run=args.run, resume=args.resume,
+        report=lambda subject, datamodel, status: print(f"{subject} / {datamodel}: {status}"),
+    )
+    print(f"Tasks done: {counts['done']}, failed: {counts['failed']}, pending: {counts['pending']}")
+    store.close()
+    return 1 if counts["failed"] else 0
+
+
+def cmd_mirror(args):
+    from db_versions.utils.git_mirror import latest_versions, rebuild_history, update_mirrors
+
+    subjects = args.subject
+    if not subjects:
+        collection = _collection(args)
+        subjects = sorted(collection.distinct("subject"))
+
+    if not args.no_fetch:
+        update_mirrors(subjects, args.mirror_dir, workers=args.workers)
+
+    changes = rebuild_history(args.mirror_dir, subjects, args.search_string, workers=args.workers)
+    # the reconciled versions come from these transitions, which are recorded with them
+    if args.history or args.reconcile:
+        from db_versions.utils.history import history_collection, record_changes
+
+        changes = list(changes)
+        collection = history_collection(args.mongo_host, args.mongo_port, args.db_name, args.history_collection_name)
+        print(f"Transitions recorded: {record_changes(collection, changes)}")
+        if not args.reconcile:
+            return
+    if not args.reconcile:
+        for change in changes:
+            print(json.dumps(dict(change._asdict(), date=change.date.strftime('%Y-%m-%dT%H:%M:%SZ'))))
+        return
+
+    from db_versions.main import reconcile_versions
+
+    records = [
+        (change.subject, change.datamodel, change.new_version, change.date)
+        for change in latest_versions(changes) if change.new_version is not None
+    ]
+    for subject, datamodel, status in reconcile_versions(args.mongo_host, args.mongo_port, args.db_name, args.collection_name, records):
+        print(f"{subject} / {datamodel}: {status}")
+
+
+def cmd_webhook(args):
+    import functools
+    from db_versions.main import reconcile_commits
+    from db_versions.utils.webhook import serve_webhooks
+
+    if not args.secret:
+        print("webhook needs the secret of the GitHub webhook (--secret or GITHUB_WEBHOOK_SECRET)")
+        return 2
+
+    process = functools.partial(
+        reconcile_commits, args.mongo_host, args.mongo_port, args.db_name, args.collection_name, args.token, args.search_string,
+        max_per_host=args.concurrency, history_collection_name=args.history_collection_name,
+    )
+    serve_webhooks(args.secret, process, args.host, args.port, args.path, debounce=args.debounce, max_delay=args.max_delay)
+
+
+def cmd_export(args):
+    from db_versions.utils.columnar import export_columnar, export_documents
+
+    if args.from_json:
+        from db_versions.utils.mongodb import clean_document, iter_json_documents
+
+        documents = (clean_document(document) for document in iter_json_documents(args.from_json))
+        summary = export_documents(args.path, documents)
+    else:
+        collection = _collection(args)
+        history = collection.database[args.history_collection_name]
+        if args.no_history or history.count_documents({}) == 0:
+            history = None
+        summary = export_columnar(args.path, collection, history, incremental=not args.full)
+    for table, (rows, mode) in summary.items():
+        print(f"{table}: {rows} rows ({mode})")
+
+
+def cmd_query(args):
+    from db_versions.utils.columnar import ColumnarSnapshot
+
+    with ColumnarSnapshot(args.path) as snapshot:
+        if args.table not in snapshot:
+            print(f"{args.path} has no {args.table} table")
+            return 1
+        documents = snapshot[args.table].find(
+            subject=args.subject, datamodel=args.datamodel, since=args.since, until=args.until,
+            version=args.version, min_version=args.min_version, max_version=args.max_version,
+        )
+        for document in documents:
+            print(json.dumps(document, default=lambda date: date.strftime("%Y-%m-%dT%H:%M:%SZ")))
+
+
+########################################################################
+#                                parser                                #
+########################################################################
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser of the db-versions command.
+    """
+    mongo = argparse.ArgumentParser(add_help=False)
+    mongo.add_argument("--mongo-host", default=os.getenv("MONGO_HOST", "127.0.0.1"))
+    mongo.add_argument("--mongo-port", type=int, default=int(os.getenv("MONGO_PORT", "27017")))
+    mongo.add_argument("--db-name", default=os.getenv("MONGO_DB_NAME", "smartdatamodels"))
+    mongo.add_argument("--collection-name", default=os.getenv("MONGO_COLLECTION_NAME", "versions"))
+
+    github = argparse.ArgumentParser(add_help=False)
+    github.add_argument("--token", default=os.getenv("PAT") or os.getenv("TOKEN"), help="GitHub access token")
+    github.add_argument("--search-string", default=DEFAULT_SEARCH_STRING)
+
+    parser = argparse.ArgumentParser(prog="db-versions", description="Database of Smart Data Models versions")
+    parser.add_argument(
+        "--metrics-file", default=os.getenv("DB_VERSIONS_METRICS_FILE"),
+        help="write the metrics of the run to this Prometheus text file (DB_VERSIONS_METRICS_FILE)",
+    )
+    parser.add_argument("--metrics-port", type=int, help="serve the metrics on http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--profile", help="run the command under cProfile and dump the statistics to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", parents=[mongo], help="insert a versions export into MongoDB")
+    load.add_argument("path", help="JSON file to insert (e.g. db_versions/data/versions.json)")
+    load.add_argument("--chunk-size", type=int, default=1000, help="documents per bulk write")
+    load.add_argument("--keep-ids", action="store_true", help="keep the exported _id of new documents")
+    load.set_defaults(func=cmd_load)
+
+    indexes = commands.add_parser("indexes", parents=[mongo], help="create the versions collection indexes")
+    indexes.set_defaults(func=cmd_indexes)
+
+    migrate = commands.add_parser("migrate", parents=[mongo], help="convert string dates and fill the version keys")
+    migrate.set_defaults(func=cmd_migrate)
+
+    reconcile = commands.add_parser("reconcile", parents=[mongo], help="compare versions to the database and update it")
+    reconcile.add_argument("--records", help="JSON file with a list of {subject, dataModel, version, date}")
+    reconcile.add_argument("--subject", help="e.g. dataModel.Environment")
+    reconcile.add_argument("--datamodel", help="e.g. AirQualityObserved")
+    reconcile.add_argument("--version", help="e.g. 0.1.3")
+    reconcile.add_argument("--date", help="last commit date, e.g. 2023-10-15T08:30:00Z")
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    crawl = commands.add_parser("crawl", parents=[github], help="find the last commit that changed a schema.json version")
+    crawl.add_argument("--repo", required=True, help="e.g. smart-data-models/dataModel.Environment")
+    crawl.add_argument("--path", required=True, help="e.g. AirQualityObserved/schema.json")
+    crawl.set_defaults(func=cmd_crawl)
+
+    history_collection = argparse.ArgumentParser(add_help=False)
+    history_collection.add_argument(
+        "--history-collection-name", default=os.getenv("MONGO_HISTORY_COLLECTION_NAME", "versions_history")
+    )
+
+    history = commands.add_parser("history", parents=[mongo, github, history_collection], help="extract the version change of a commit")
+    history.add_argument("--repo", required=True, help="e.g. smart-data-models/dataModel.Environment")
+    history.add_argument("--sha", required=True, help="commit sha")
+    history.add_argument("--path", help="only look at this file (e.g. AirQualityObserved/schema.json)")
+    history.add_argument("--record", action="store_true", help="record the transitions in the history collection")
+    history.set_defaults(func=cmd_history)
+
+    as_of = commands.add_parser("as-of", parents=[mongo, history_collection], help="the version of a datamodel at a date")
+    as_of.add_argument("--subject", required=True, help="e.g. dataModel.Environment")
+    as_of.add_argument("--datamodel", required=True, help="e.g. AirQualityObserved")
+    as_of.add_argument("--date", help="e.g. 2023-10-15T08:30:00Z (default: the whole history)")
+    as_of.set_defaults(func=cmd_as_of)
+
+    sweep = commands.add_parser("sweep", parents=[mongo, github, history_collection], help="crawl many datamodels concurrently and reconcile them")
+    sweep.add_argument("--subject", help="only crawl this subject (e.g. dataModel.Environment)")
+    sweep.add_argument("--datamodel", action="append", default=[], help="datamodel of --subject, can be repeated")
+    sweep.add_argument("--concurrency", type=int, default=8, help="maximum concurrent requests to GitHub")
+    sweep.add_argument("--batch-size", type=int, default=100, help="crawl results reconciled per database round trip")
+    sweep.add_argument("--incremental", action="store_true", help="only look at the commits since the last sync watermarks")
+    sweep.add_argument(
+        "--backend", choices=("rest", "graphql"), default="rest",
+        help="rest: walk the commits of each file, graphql: last commit of many files per query",
+    )
+    sweep.add_argument(
+        "--changed-only", action="store_true", help="only crawl the schema.json files whose blob changed since the last run"
+    )
+    sweep.set_defaults(func=cmd_sweep)
+
+    full_sweep = commands.add_parser(
+        "full-sweep", parents=[mongo, github, history_collection], help="sweep every datamodel as checkpointed, retried tasks on a pool"
+    )
+    full_sweep.add_argument("--workers", type=int, default=4, help="size of the pool")
+    full_sweep.add_argument("--executor", choices=("thread", "process"), default="thread")
+    full_sweep.add_argument("--granularity", choices=("model", "subject"), default="model", help="one task per datamodel or per subject")
+    full_sweep.add_argument("--max-attempts", type=int, default=3, help="attempts of a task before it is marked failed")
+    full_sweep.add_argument("--backoff", type=float, default=2.0, help="delay before the first retry, in seconds (doubled at each retry)")
+    full_sweep.add_argument("--run", default="sweep", help="name of the run in the task state")
+    full_sweep.add_argument("--resume", action="store_true", help="skip the tasks done by the previous run of the same name")
+    full_sweep.add_argument("--state", help="SQLite file of the task states (default: SWEEP_STATE or sweep.sqlite in the cache directory)")
+    full_sweep.add_argument("--state-collection", help="keep the task states in this MongoDB collection instead")
+    full_sweep.set_defaults(func=cmd_full_sweep)
+
+    mirror = commands.add_parser("mirror", parents=[mongo, history_collection], help="read the version history from local git mirrors")
+    mirror.add_argument(
+        "--mirror-dir", default=os.getenv("GIT_MIRROR_DIR") or cache_path("mirrors"), help="directory of the bare mirrors (GIT_MIRROR_DIR)"
+    )
+    mirror.add_argument("--subject", action="append", default=[], help="subject to read, can be repeated (default: every subject of the collection)")
+    mirror.add_argument("--search-string", default=DEFAULT_SEARCH_STRING)
+    mirror.add_argument("--no-fetch", action="store_true", help="do not clone or fetch the mirrors first")
+    mirror.add_argument("--workers", type=int, default=None, help="number of parallel processes")
+    mirror.add_argument(
+        "--reconcile", action="store_true",
+        help="reconcile the latest version of each datamodel with the database (and record every transition)",
+    )
+    mirror.add_argument("--history", action="store_true", help="record every transition in the history collection")
+    mirror.set_defaults(func=cmd_mirror)
+
+    webhook = commands.add_parser("webhook", parents=[mongo, github, history_collection], help="reconcile the datamodels touched by GitHub push events")
+    webhook.add_argument("--host", default=os.getenv("WEBHOOK_HOST", "127.0.0.1"), help="address to listen on (WEBHOOK_HOST)")
+    webhook.add_argument("--port", type=int, default=int(os.getenv("WEBHOOK_PORT", "8080")), help="port to listen on (WEBHOOK_PORT)")
+    webhook.add_argument("--path", default="/webhook", help="path the deliveries are posted to")
+    webhook.add_argument("--secret", default=os.getenv("GITHUB_WEBHOOK_SECRET"), help="secret of the webhook (GITHUB_WEBHOOK_SECRET)")
+    webhook.add_argument("--debounce", type=float, default=5.0, help="seconds without push before the queued datamodels are processed")
+    webhook.add_argument("--max-delay", type=float, default=60.0, help="maximum seconds a datamodel waits in the queue")
+    webhook.add_argument("--concurrency", type=int, default=8, help="maximum concurrent requests to GitHub")
+    webhook.set_defaults(func=cmd_webhook)
+
+    export = commands.add_parser("export", parents=[mongo, history_collection], help="write the collections to a columnar file")
+    export.add_argument("path", help="columnar file to write (e.g. versions.cols)")
+    export.add_argument("--full", action="store_true", help="read every document instead of updating the previous file")
+    export.add_argument("--no-history", action="store_true", help="do not export the history collection")
+    export.add_argument("--from-json", help="export a versions JSON file (e.g. db_versions/data/versions.json) instead of MongoDB")
+    export.set_defaults(func=cmd_export)
+
+    query = commands.add_parser("query", help="filter a columnar export without MongoDB")
+    query.add_argument("path", help="columnar file written by export")
+    query.add_argument("--table", choices=("versions", "history"), default="versions")
+    query.add_argument("--subject", help="e.g. dataModel.Environment")
+    query.add_argument("--datamodel", help="e.g. AirQualityObserved")
+    query.add_argument("--since", help="first date, e.g. 2023-01-01T00:00:00Z")
+    query.add_argument("--until", help="last date, e.g. 2023-12-31T23:59:59Z")
+    query.add_argument("--version", help="exact version, e.g. 0.1.3")
+    query.add_argument("--min-version", help="lowest version, e.g. 0.1.0")
+    query.add_argument("--max-version", help="highest version, e.g. 1.0.0")
+    query.set_defaults(func=cmd_query)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    """
+    Run the db-versions command line.
+    """
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file before the defaults are read
+    load_dotenv()
+
+    args = build_parser().parse_args(argv)
+    return _run(args) or 0
+
+
+def _run(args):
+    """
+    Run a command, with the instrumentation asked for by --metrics-file, --metrics-port and --profile.
+    """
+    if not (args.metrics_file or args.metrics_port or args.profile):
+        return args.func(args)
+
+    from contextlib import ExitStack
+    from db_versions.utils import metrics
+
+    server = None
+    if args.metrics_file or args.metrics_port:
+        # before the command connects to MongoDB, so that its client reports the commands
+        metrics.enable()
+    if args.metrics_port:
+        server = metrics.serve(args.metrics_port)
+    try:
+        with ExitStack() as stack:
+            if args.profile:
+                stack.enter_context(metrics.profile(args.profile))
+            return args.func(args)
+    finally:
+        if args.metrics_file:
+            metrics.write_prometheus(args.metrics_file)
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,29 @@
 import json
 
+from db_versions.utils.mongodb import iter_json_documents
+
 
 def remove_id_from_json_file(file_path, new_file_path):
     """
     Remove the "_id" field from a JSON file.
+
+    The documents are streamed from one file to the other, so the file is never held in memory.
+    Note that db_versions.utils.mongodb.load_versions strips "_id" itself, so this step is optional.
+
     Args:
     - file_path: The path to the JSON file.
+    - new_file_path: The path of the JSON file to write.
     """
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-
-    # Remove the "_id" field from each dictionary in the JSON data
-    for item in data:
-        item.pop('_id', None)
-
-    # Write the modified data back to the file
     with open(new_file_path, 'w') as file:
-        json.dump(data, file, indent=2)
+        file.write("[")
+        for index, item in enumerate(iter_json_documents(file_path)):
+            # Remove the "_id" field from each dictionary in the JSON data
+            item.pop('_id', None)
+            file.write(",\n" if index else "\n")
+            file.write(json.dumps(item, indent=2))
+        file.write("\n]\n")
 
 
 # Example usage
-remove_id_from_json_file('versions.json', 'versions_db.json')
\ No newline at end of file
+if __name__ == "__main__":
+    remove_id_from_json_file('versions.json', 'versions_db.json')
@@ -3,7 +3,7 @@
 ########################################################################
 
 # This code assumes that the monogodb databese is hosted locally.
-# First, run the module "mongodb.py" to insert data in it. 
+# First, run "db-versions load" to insert data in it (see db_versions/cli.py for all the commands).
 # Insert the https://smartdatamodels.org/extra/versions.json into the mongodb that you create locally.
 # Before insertion, run the module under "data/update_version_json.py" to make the data ready for insertion. 
 
@@ -19,23 +19,51 @@
 ########################################################################
 import os 
 
-from dotenv import load_dotenv
-from datetime import datetime
-
+from db_versions.utils import metrics
 from db_versions.utils.utils import last_commit_date_url
-from db_versions.utils.mongodb import connect_to_mongodb
-
-
-# Load environment variables from .env file
-load_dotenv()
+from db_versions.utils.mongodb import connect_to_mongodb, to_datetime, version_fields
 
 
 ########################################################################
 #                     MongoDB version fetch and update                 #
 ########################################################################
 
+def _compare_version(existing_datamodel, version, last_commit_date, update_dates=True):
+    """
+    Compares a stored datamodel document to the version and last commit date given as input.
+
+    Args:
+    existing_datamodel (dict): The document stored in the database, or None if it does not exist.
+    version (str): The version to compare.
+    last_commit_date (str or datetime): The date of the last commit, as a datetime or in ISO format 
+        (e.g., '2023-10-15T08:30:00Z').
+    update_dates (bool): Move the stored date to a newer commit date. False when the commit is not
+        the one that set the version (see crawl_and_reconcile with the GraphQL backend).
+
+    Returns:
+    tuple: The status message and the `$set` update to apply, or None if nothing has to be written.
+    """
+    if existing_datamodel:
+        # Compare the actual version to the version given as input with the date of the last update
+        if existing_datamodel['version'] == version:
+            # Dates are BSON datetimes in the database (older documents may still hold ISO strings)
+            last_update_date = to_datetime(existing_datamodel['date'])
+            last_commit_date = to_datetime(last_commit_date)
+
+            if update_dates and (last_update_date is None or last_commit_date > last_update_date):
+                # Perform the update if the last commit date is newer (and keep the version keys filled)
+                return "Database updated with the latest commit date", {"date": last_commit_date, **version_fields(version)}
+            else:
+                return "Database is already up to date", None
+        else:
+            return "Input version does not match the actual version in the database", None
+    else:
+        return "Datamodel not found in the database", None
+
+
+@metrics.timed_stage("reconcile")
 def check_version_and_update(
-    mongo_host, mongo_port, db_name, collection_name, subject, datamodel, version, last_commit_date
+    mongo_host, mongo_port, db_name, collection_name, subject, datamodel, version, last_commit_date, snapshot=None
 ) -> str:
     """
     Checks the existence of a datamodel in the MongoDB database and compares the actual version to the 
@@ -50,39 +78,315 @@ def check_version_and_update(
     subject (str): The subject of the datamodel.
     datamodel (str): The name of the datamodel.
     version (str): The version to compare.
-    last_commit_date (str): The date of the last commit in ISO format (e.g., '2023-10-15T08:30:00Z').
+    last_commit_date (str or datetime): The date of the last commit, as a datetime or in ISO format 
+        (e.g., '2023-10-15T08:30:00Z').
+    snapshot (VersionsSnapshot): Read the stored datamodel from this in-memory snapshot instead of the database.
 
     Returns:
     str: A message indicating the result of the operation.
     """
     # Connect to the MongoDB instance and get the collection
-    collection = connect_to_mongodb(mongo_host, mongo_port, db_name, collection_name)
+    collection = connect_to_mongodb(mongo_host, mongo_port, db_name, collection_name, create_indexes=True)
     
-    # Query the database to fetch the datamodel by its name and subject
-    existing_datamodel = collection.find_one({"subject": subject, "dataModel": datamodel})
-    
-    if existing_datamodel:
-        # Compare the actual version to the version given as input with the date of the last update
-        if existing_datamodel['version'] == version:
-            last_update_date = datetime.strptime(existing_datamodel['date'], '%Y-%m-%dT%H:%M:%SZ')
-            last_commit_date = datetime.strptime(last_commit_date, '%Y-%m-%dT%H:%M:%SZ')
-            
-            if last_commit_date > last_update_date:
-                # Perform the update if the last commit date is newer
-                collection.update_one({"subject": subject, "dataModel": datamodel}, {"$set": {"date": last_commit_date.isoformat()}})
-                return "Database updated with the latest commit date"
-            else:
-                return "Database is already up to date"
+    # Query the database (or the snapshot) to fetch the datamodel by its name and subject
+    if snapshot is not None:
+        record = snapshot.get(subject, datamodel)
+        existing_datamodel = record.as_document() if record else None
+    else:
+        existing_datamodel = collection.find_one({"subject": subject, "dataModel": datamodel})
+
+    status, update = _compare_version(existing_datamodel, version, last_commit_date)
+    if update:
+        collection.update_one({"subject": subject, "dataModel": datamodel}, {"$set": update})
+        if snapshot is not None:
+            snapshot.invalidate([(subject, datamodel)])
+    return status
+
+
+@metrics.timed_stage("reconcile")
+def reconcile_versions(mongo_host, mongo_port, db_name, collection_name, records, snapshot=None, update_dates=True) -> list:
+    """
+    Bulk version of check_version_and_update for many datamodels at once.
+
+    All the stored documents are fetched with a single `$or` query, the comparison is done in memory
+    and every needed change is sent as one unordered bulk_write.
+
+    Args:
+    mongo_host (str): The host address of the MongoDB instance.
+    mongo_port (int): The port number of the MongoDB instance.
+    db_name (str): The name of the database.
+    collection_name (str): The name of the collection.
+    records (iterable): Tuples of (subject, datamodel, version, last_commit_date), with the date as a
+        datetime or in the same ISO format as check_version_and_update, optionally followed by the
+        commit message, which is stored as `commitMessage` with the new date.
+    snapshot (VersionsSnapshot): Read the stored documents from this in-memory snapshot instead of
+        the database. The written datamodels are invalidated in it.
+    update_dates (bool): Move the stored dates to the newer commit dates. False when the commits
+        are not the ones that set the versions: the versions are then only compared.
+
+    Returns:
+    list: One (subject, datamodel, status) tuple per input record, in input order, where status is
+    one of the messages returned by check_version_and_update.
+    """
+    from pymongo import UpdateOne
+
+    records = list(records)
+    if not records:
+        return []
+
+    collection = connect_to_mongodb(mongo_host, mongo_port, db_name, collection_name, create_indexes=True)
+
+    # Fetch every stored document in one round trip (or none with a snapshot)
+    keys = {(subject, datamodel) for subject, datamodel, *_ in records}
+    if snapshot is not None:
+        existing = {key: record.as_document() for key, record in snapshot.documents(keys).items()}
+    else:
+        query = {"$or": [{"subject": subject, "dataModel": datamodel} for subject, datamodel in keys]}
+        projection = {"_id": 0, "subject": 1, "dataModel": 1, "version": 1, "date": 1}
+        existing = {(doc["subject"], doc["dataModel"]): doc for doc in collection.find(query, projection)}
+
+    results = []
+    updates = {}
+    for subject, datamodel, version, last_commit_date, *message in records:
+        status, update = _compare_version(existing.get((subject, datamodel)), version, last_commit_date, update_dates)
+        if update and message and message[0]:
+            update["commitMessage"] = message[0]
+        if update:
+            # keep later records of the same datamodel consistent with the pending update
+            existing[(subject, datamodel)] = dict(existing[(subject, datamodel)], date=update["date"])
+            updates[(subject, datamodel)] = update
+        results.append((subject, datamodel, status))
+
+    # Send all the changes at once
+    if updates:
+        collection.bulk_write(
+            [UpdateOne({"subject": subject, "dataModel": datamodel}, {"$set": update})
+             for (subject, datamodel), update in updates.items()],
+            ordered=False,
+        )
+        if snapshot is not None:
+            snapshot.invalidate(updates)
+
+    return results
+
+
+def _record_history(mongo_host, mongo_port, db_name, changes, history_collection_name=None) -> int:
+    """
+    Records the version transitions found while reconciling in the history collection (see utils.history).
+    """
+    from db_versions.utils.history import history_collection, record_changes
+
+    changes = list(changes)
+    if not changes:
+        return 0
+    collection = history_collection(mongo_host, mongo_port, db_name, history_collection_name)
+    return record_changes(collection, changes)
+
+
+########################################################################
+#                     Concurrent crawl and reconcile                   #
+########################################################################
+
+def crawl_and_reconcile(
+    mongo_host, mongo_port, db_name, collection_name, access_token, search_string, targets=None, batch_size=100, max_per_host=8,
+    incremental=False, sync_collection_name=None, changed_only=False, backend="rest", history_collection_name=None
+) -> list:
+    """
+    Crawls the last version commit of many schema.json files concurrently and reconciles the results
+    with the database as they stream in, in batches of `batch_size` records. The version commits
+    are also recorded as transitions in the history collection.
+
+    Args:
+    mongo_host (str): The host address of the MongoDB instance.
+    mongo_port (int): The port number of the MongoDB instance.
+    db_name (str): The name of the database.
+    collection_name (str): The name of the collection.
+    access_token (str): The GitHub personal access token for authentication.
+    search_string (str): The string to serach for in the commit file (e.g "$schemaVersion").
+    targets (iterable): (subject, datamodel) pairs to crawl. Every datamodel of the collection if None.
+    batch_size (int): The number of crawl results sent to reconcile_versions at once.
+    max_per_host (int): The maximum number of concurrent requests to GitHub.
+    incremental (bool): Only look at the commits after the watermark stored for each schema.json in the
+        sync-state collection, and move the watermarks forward afterwards.
+    sync_collection_name (str): The name of the sync-state collection (see utils.sync_state).
+    changed_only (bool): Only crawl the schema.json files whose blob SHA changed since the last run,
+        found with one git-tree request per subject (see utils.tree_diff). Every changed schema.json
+        of the subjects is crawled when targets is None.
+    backend (str): "rest" to walk the commits of each file (GithubCrawler), or "graphql" to get the
+        last commit of many files per query (utils.graphql.GraphqlBackend, not incremental). That commit
+        may not be the one that set the version, so the GraphQL backend only compares the versions
+        and leaves the dates (and the history) unchanged.
+    history_collection_name (str): The name of the history collection (see utils.history).
+
+    Returns:
+    list: The (subject, datamodel, status) tuples returned by reconcile_versions.
+    """
+    import asyncio
+    from db_versions.utils.crawler import GithubCrawler
+    from db_versions.utils.history import change_from_result
+    from db_versions.utils.snapshot import VersionsSnapshot
+    from db_versions.utils.sync_state import get_blobs, get_watermarks, set_blobs, set_watermarks, sync_state_collection
+    from db_versions.utils.tree_diff import changed_datamodels
+
+    if backend not in ("rest", "graphql"):
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "graphql" and incremental:
+        raise ValueError("The GraphQL backend only reads the last commit of each file, it has no incremental sync")
+
+    snapshot = None
+    if targets is None:
+        # a full sweep reads every stored datamodel once, the reconcile batches are then compared in memory
+        collection = connect_to_mongodb(mongo_host, mongo_port, db_name, collection_name, create_indexes=True)
+        snapshot = VersionsSnapshot(collection).load()
+        if changed_only:
+            subjects = sorted({record.subject for record in snapshot.records()})
         else:
-            return "Input version does not match the actual version in the database"
+            targets = [(record.subject, record.dataModel) for record in snapshot.records()]
     else:
-        return "Datamodel not found in the database"
+        targets = list(targets)
+
+    # the datamodels of each subject that may be crawled, None for all of them
+    wanted = None
+    if changed_only and targets is not None:
+        wanted = {}
+        for subject, datamodel in targets:
+            wanted.setdefault(subject, set()).add(datamodel)
+        subjects = sorted(wanted)
+
+    watermarks = blobs = None
+    if incremental or changed_only:
+        sync_collection = sync_state_collection(mongo_host, mongo_port, db_name, sync_collection_name)
+    if incremental:
+        watermarks = get_watermarks(sync_collection)
+    if changed_only:
+        blobs = get_blobs(sync_collection)
+
+    def reconcile(crawl_results):
+        records = [
+            (result.target.subject, result.target.datamodel, result.version, result.date, result.message)
+            for result in crawl_results
+        ]
+        results = reconcile_versions(
+            mongo_host, mongo_port, db_name, collection_name, records, snapshot=snapshot, update_dates=backend == "rest"
+        )
+        if backend == "rest":
+            changes = [change_from_result(result) for result in crawl_results]
+            _record_history(mongo_host, mongo_port, db_name, changes, history_collection_name)
+        return results
+
+    async def run():
+        crawler = GithubCrawler(access_token, max_per_host=max_per_host)
+        results, batch, heads = [], [], []
+
+        crawl_targets = targets
+        if changed_only:
+            changes = await crawler.tree_changes(subjects, blobs)
+            crawl_targets = [
+                (subject, datamodel)
+                for subject, subject_changes in changes.items()
+                for datamodel in sorted(changed_datamodels(subject_changes, wanted and wanted[subject]))
+            ]
+
+        source = crawler
+        if incremental:
+            crawled = crawler.sync(crawl_targets, search_string, watermarks)
+        elif backend == "graphql":
+            from db_versions.utils.graphql import GraphqlBackend
+
+            source = GraphqlBackend(access_token)
+            crawled = (pair + (None,) async for pair in source.crawl(crawl_targets, search_string))
+        else:
+            crawled = (pair + (None,) async for pair in crawler.crawl(crawl_targets, search_string))
+
+        async for target, result, head in crawled:
+            if head is not None:
+                heads.append((target.subject, target.file_path, head))
+            if result is None or result.version is None:
+                continue
+            batch.append(result)
+            if len(batch) >= batch_size:
+                # the database round trip runs in a thread so the crawl keeps going
+                results.extend(await asyncio.to_thread(reconcile, batch))
+                batch = []
+        if batch:
+            results.extend(await asyncio.to_thread(reconcile, batch))
+
+        # the watermarks only move once the results they cover are in the database
+        if heads:
+            await asyncio.to_thread(set_watermarks, sync_collection, heads)
+        if changed_only:
+            for subject, subject_changes in changes.items():
+                # only the blobs of the datamodels crawled without error are marked as seen, the
+                # others keep their old blob SHA and are crawled again on the next run
+                seen = {
+                    path: blob for path, blob in subject_changes.blobs.items()
+                    if (wanted is None or path.split("/")[0] in wanted[subject]) and (subject, path) not in source.failed
+                }
+                await asyncio.to_thread(set_blobs, sync_collection, subject, seen, subject_changes.removed)
+        return results
+
+    return asyncio.run(run())
+
+
+def reconcile_commits(
+    mongo_host, mongo_port, db_name, collection_name, access_token, search_string, commits, max_per_host=8, history_collection_name=None
+) -> list:
+    """
+    Reconciles the datamodels touched by known commits (e.g. the commits of push events, see
+    utils.webhook), fetching only these commits instead of walking the history of each file.
+    The version commits are also recorded as transitions in the history collection.
+
+    Args:
+    mongo_host (str): The host address of the MongoDB instance.
+    mongo_port (int): The port number of the MongoDB instance.
+    db_name (str): The name of the database.
+    collection_name (str): The name of the collection.
+    access_token (str): The GitHub personal access token for authentication.
+    search_string (str): The string to serach for in the commit file (e.g "$schemaVersion").
+    commits (dict): The SHAs of the commits that touched each (subject, datamodel), newest first.
+    max_per_host (int): The maximum number of concurrent requests to GitHub.
+    history_collection_name (str): The name of the history collection (see utils.history).
+
+    Returns:
+    list: The (subject, datamodel, status) tuples returned by reconcile_versions, for the datamodels
+    whose version was changed by one of the commits.
+    """
+    import asyncio
+    import requests
+    from db_versions.utils.crawler import CrawlTarget, GithubCrawler
+    from db_versions.utils.history import change_from_result
+
+    async def run():
+        crawler = GithubCrawler(access_token, max_per_host=max_per_host)
+
+        async def version_commit(target, shas):
+            try:
+                return await crawler.version_commit(target, search_string, shas)
+            except requests.exceptions.RequestException as e:
+                print(f"Error: {target.repo_name} {target.file_path}: {e}")
+                return None
+
+        return await asyncio.gather(*(version_commit(CrawlTarget(*key), shas) for key, shas in commits.items()))
+
+    crawl_results = [result for result in asyncio.run(run()) if result is not None and result.version is not None]
+    records = [
+        (result.target.subject, result.target.datamodel, result.version, result.date, result.message)
+        for result in crawl_results
+    ]
+    results = reconcile_versions(mongo_host, mongo_port, db_name, collection_name, records)
+    _record_history(mongo_host, mongo_port, db_name, [change_from_result(result) for result in crawl_results], history_collection_name)
+    return results
 
 
 ########################################################################
 #                                 Run code                             #
 ######################################################################## 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file
+    load_dotenv()
+
     # Example usage of the check_version_and_update function
 
     # MongoDB connection parameters - env variables 
@@ -0,0 +1,19 @@
+import os
+
+
+########################################################################
+#                              utils package                           #
+########################################################################
+
+# pymongo, PyGithub and requests are imported inside the functions that use them, never at module
+# level, so that importing any module of the package (e.g. for `db-versions --help`) stays cheap and
+# free of side effects.
+
+
+def cache_path(*parts: str) -> str:
+    """
+    Return a path in the cache directory of the package: db-versions in $XDG_CACHE_HOME (~/.cache
+    if unset), e.g. cache_path("sweep.sqlite") -> ~/.cache/db-versions/sweep.sqlite
+    """
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "db-versions", *parts)
@@ -0,0 +1,485 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+from db_versions.utils import metrics
+from db_versions.utils.mongodb import VERSION_KEY_PARTS, to_datetime, version_key
+
+
+########################################################################
+#                      columnar export of the versions                 #
+########################################################################
+
+# The versions (and history) collections written to one file for offline analytics, without
+# MongoDB or any JSON parsing at read time. The file is memory-mapped by the loader, so opening it
+# costs nothing and only the columns a query touches are paged in:
+#
+#   b"DBVCOLS1"  uint64 length of the header  header (JSON)  padding  column blocks
+#
+# Each string column is dictionary-encoded: an int32 code per row (-1 for a missing value) and the
+# sorted dictionary of the distinct strings (int64 offsets into a UTF-8 blob). Dates are int64
+# milliseconds since the epoch (UTC). Rows are sorted by (subject, dataModel, ...) and the
+# dictionaries are sorted, so a subject is a contiguous range of rows found by binary search and a
+# version range is a range of versionKey codes. Arrays are little-endian and aligned on 8 bytes.
+#
+# The history is exported incrementally: only the documents inserted after the last `_id` of the
+# previous file are read from MongoDB and appended to its rows. It is read again in full when its
+# row count does not match the collection anymore (deletions), or when the file was written with
+# another versionKey format. The versions are always read in full: their documents are updated in
+# place and no field changes on every write (a load of an older export or migrate_dates keeps or
+# moves back the date), so no watermark tells which ones changed. There is one document per
+# datamodel, the history is the table that grows.
+
+MAGIC = b"DBVCOLS1"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+
+NULL_CODE = -1
+NULL_DATE = -(1 << 63)
+
+STRING, DATE = "string", "date"
+
+# (field, kind) of each table, the first fields being the sort key of its rows
+TABLES = {
+    "versions": (
+        ("subject", STRING), ("dataModel", STRING), ("version", STRING), ("versionKey", STRING), ("date", DATE),
+        ("link", STRING), ("publicLink", STRING), ("commitMessage", STRING),
+    ),
+    "history": (
+        ("subject", STRING), ("dataModel", STRING), ("date", DATE), ("sha", STRING), ("version", STRING),
+        ("previousVersion", STRING), ("versionKey", STRING), ("path", STRING), ("url", STRING),
+    ),
+}
+SORT_KEYS = {"versions": ("subject", "dataModel"), "history": ("subject", "dataModel", "date", "sha")}
+
+_EPOCH = datetime(1970, 1, 1)
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _to_millis(value) -> int:
+    date = to_datetime(value) if value is not None else None
+    if date is None:
+        return NULL_DATE
+    return (date - _EPOCH) // timedelta(milliseconds=1)
+
+
+def _from_millis(value: int) -> Union[datetime, None]:
+    return None if value == NULL_DATE else _EPOCH + timedelta(milliseconds=value)
+
+
+def _row(document: dict, fields: Sequence[Tuple[str, str]]) -> tuple:
+    """
+    The values of a document in the order of the fields of its table (dates as milliseconds).
+    """
+    values = []
+    for field, kind in fields:
+        value = document.get(field)
+        if kind == DATE:
+            values.append(_to_millis(value))
+        elif field == "versionKey" and value is None:
+            values.append(version_key(document.get("version")))
+        else:
+            values.append(None if value is None else str(value))
+    return tuple(values)
+
+
+########################################################################
+#                                writing                               #
+########################################################################
+
+def _little_endian(values: array) -> bytes:
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _encode_table(fields, rows: List[tuple]) -> Tuple[dict, List[bytes]]:
+    """
+    Encode the rows of a table into column blocks. Returns the column descriptions (offsets relative
+    to the first block of the table) and the blocks.
+    """
+    columns, blocks, offset = {}, [], 0
+
+    def add(data: bytes) -> list:
+        nonlocal offset
+        padding = -len(data) % ALIGNMENT
+        blocks.append(data + b"\0" * padding)
+        start, offset = offset, offset + len(data) + padding
+        return [start, len(data)]
+
+    for index, (field, kind) in enumerate(fields):
+        values = [row[index] for row in rows]
+        if kind == DATE:
+            columns[field] = {"kind": DATE, "values": add(_little_endian(array("q", values)))}
+            continue
+        dictionary = sorted({value for value in values if value is not None})
+        codes = {value: code for code, value in enumerate(dictionary)}
+        encoded = [value.encode("utf-8") for value in dictionary]
+        offsets = array("q", [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        columns[field] = {
+            "kind": STRING,
+            "codes": add(_little_endian(array("i", [NULL_CODE if value is None else codes[value] for value in values]))),
+            "offsets": add(_little_endian(offsets)),
+            "strings": add(b"".join(encoded)),
+            "distinct": len(dictionary),
+        }
+    return columns, blocks
+
+
+def write_columnar(path: str, tables: Dict[str, Tuple[List[tuple], dict]]) -> str:
+    """
+    Write tables of rows (as returned by _row) to a columnar file, replaced atomically.
+
+    Args:
+    path (str): The file to write.
+    tables (dict): (rows, watermark) by table name (see TABLES), the watermark being kept in the
+        header for the next incremental export.
+    """
+    header = {"format": FORMAT_VERSION, "tables": {}}
+    all_blocks, offset = [], 0
+    for name, (rows, watermark) in tables.items():
+        fields = TABLES[name]
+        sort_indexes = [index for index, (field, _) in enumerate(fields) if field in SORT_KEYS[name]]
+        rows = sorted(rows, key=lambda row: tuple("" if row[index] is None else row[index] for index in sort_indexes))
+        columns, blocks = _encode_table(fields, rows)
+        for column in columns.values():
+            for part in ("values", "codes", "offsets", "strings"):
+                if part in column:
+                    column[part][0] += offset
+        offset += sum(len(block) for block in blocks)
+        all_blocks.extend(blocks)
+        header["tables"][name] = {"rows": len(rows), "columns": columns, "watermark": watermark}
+
+    encoded_header = json.dumps(header).encode("utf-8")
+    encoded_header += b" " * (-(len(MAGIC) + 8 + len(encoded_header)) % ALIGNMENT)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(encoded_header)))
+        file.write(encoded_header)
+        for block in all_blocks:
+            file.write(block)
+    os.replace(temporary, path)
+    return path
+
+
+########################################################################
+#                                reading                               #
+########################################################################
+
+class _Dictionary(Sequence):
+    """
+    The sorted strings of a dictionary-encoded column, decoded on access (so bisect works on it).
+    """
+
+    def __init__(self, offsets, strings):
+        self._offsets = offsets
+        self._strings = strings
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, code: int) -> str:
+        if not 0 <= code < len(self):
+            raise IndexError(code)
+        return bytes(self._strings[self._offsets[code]:self._offsets[code + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        strings = bytes(self._strings)
+        offsets = self._offsets
+        for code in range(len(self)):
+            yield strings[offsets[code]:offsets[code + 1]].decode("utf-8")
+
+
+def _version_key(version: str) -> str:
+    key = version_key(version)
+    if key is None:
+        raise ValueError(f"{version!r} is not a version")
+    return key
+
+
+class ColumnarTable:
+    """
+    One table of a columnar file: typed views over the memory-mapped columns and row filters.
+    """
+
+    def __init__(self, name: str, description: dict, data: memoryview):
+        self.name = name
+        self.fields = tuple(field for field, _ in TABLES[name])
+        self.watermark = description.get("watermark") or {}
+        self._rows = description["rows"]
+        self._columns = {}
+        self._dictionaries = {}
+        for field, column in description["columns"].items():
+            if column["kind"] == DATE:
+                self._columns[field] = self._view(data, column["values"], "q")
+            else:
+                self._columns[field] = self._view(data, column["codes"], "i")
+                self._dictionaries[field] = _Dictionary(
+                    self._view(data, column["offsets"], "q"), data[column["strings"][0]:sum(column["strings"])]
+                )
+
+    @staticmethod
+    def _view(data: memoryview, block: list, typecode: str):
+        view = data[block[0]:block[0] + block[1]]
+        if _LITTLE_ENDIAN:
+            return view.cast(typecode)
+        values = array(typecode, view.tobytes())
+        values.byteswap()
+        return values
+
+    def __len__(self):
+        return self._rows
+
+    def column(self, field: str):
+        """
+        The raw values of a column: dictionary codes for strings, milliseconds since the epoch for dates.
+        """
+        return self._columns[field]
+
+    def dictionary(self, field: str) -> Sequence[str]:
+        """
+        The sorted distinct values of a string column, indexed by code.
+        """
+        return self._dictionaries[field]
+
+    def code(self, field: str, value: str) -> int:
+        """
+        The code of a string in a column, or NULL_CODE if it does not occur.
+        """
+        dictionary = self._dictionaries[field]
+        code = bisect.bisect_left(dictionary, value)
+        return code if code < len(dictionary) and dictionary[code] == value else NULL_CODE
+
+    def value(self, field: str, row: int):
+        raw = self._columns[field][row]
+        if field not in self._dictionaries:
+            return _from_millis(raw)
+        return None if raw == NULL_CODE else self._dictionaries[field][raw]
+
+    def document(self, row: int) -> dict:
+        """
+        A row as the document MongoDB would return (without `_id`, missing values left out).
+        """
+        document = {}
+        for field in self.fields:
+            value = self.value(field, row)
+            if value is not None:
+                document[field] = value
+        return document
+
+    def rows(self, subject: str = None, datamodel: str = None, since=None, until=None, version: str = None,
+             min_version: str = None, max_version: str = None) -> List[int]:
+        """
+        Return the rows matching every given filter, in file order.
+
+        Args:
+        subject (str): e.g. "dataModel.Environment" (a binary search, the rows are sorted by subject).
+        datamodel (str): e.g. "AirQualityObserved".
+        since, until (str or datetime): The date range, both bounds included.
+        version (str): The exact version, e.g. "0.1.3".
+        min_version, max_version (str): The version range, both bounds included, compared as versions
+            ("0.10.0" > "0.9.0") through the sorted versionKey dictionary.
+        """
+        start, stop = 0, self._rows
+        if subject is not None:
+            code = self.code("subject", subject)
+            if code == NULL_CODE:
+                return []
+            codes = self._columns["subject"]
+            start, stop = bisect.bisect_left(codes, code), bisect.bisect_right(codes, code)
+        rows = range(start, stop)
+
+        for field, value in (("dataModel", datamodel), ("version", version)):
+            if value is not None:
+                code, codes = self.code(field, value), self._columns[field]
+                if code == NULL_CODE:
+                    return []
+                rows = [row for row in rows if codes[row] == code]
+
+        if min_version is not None or max_version is not None:
+            keys = self._dictionaries["versionKey"]
+            lowest = bisect.bisect_left(keys, _version_key(min_version)) if min_version is not None else 0
+            highest = bisect.bisect_right(keys, _version_key(max_version)) if max_version is not None else len(keys)
+            codes = self._columns["versionKey"]
+            rows = [row for row in rows if lowest <= codes[row] < highest]
+
+        if since is not None or until is not None:
+            lowest = _to_millis(since) if since is not None else NULL_DATE + 1
+            highest = _to_millis(until) if until is not None else (1 << 63) - 1
+            dates = self._columns["date"]
+            rows = [row for row in rows if lowest <= dates[row] <= highest]
+
+        return list(rows)
+
+    def find(self, **filters) -> List[dict]:
+        """
+        Return the documents of the rows matching the filters of rows().
+        """
+        return [self.document(row) for row in self.rows(**filters)]
+
+    def iter_rows(self) -> Iterable[tuple]:
+        """
+        Yield every row as the tuple written by write_columnar (dates as milliseconds).
+        """
+        columns = [(self._columns[field], self._dictionaries.get(field)) for field in self.fields]
+        decoded = [list(dictionary) if dictionary is not None else None for _, dictionary in columns]
+        for row in range(self._rows):
+            yield tuple(
+                values[row] if strings is None else (None if values[row] == NULL_CODE else strings[values[row]])
+                for (values, _), strings in zip(columns, decoded)
+            )
+
+
+class ColumnarSnapshot:
+    """
+    A memory-mapped columnar file. Use it as a context manager, or call close().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self._mmap)
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a columnar versions file")
+        (length,) = struct.unpack("<Q", data[len(MAGIC):len(MAGIC) + 8])
+        start = len(MAGIC) + 8
+        self.header = json.loads(bytes(data[start:start + length]))
+        if self.header.get("format") != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} has format {self.header.get('format')}, expected {FORMAT_VERSION}")
+        blocks = data[start + length:]
+        self.tables = {name: ColumnarTable(name, description, blocks) for name, description in self.header["tables"].items()}
+
+    def __getitem__(self, name: str) -> ColumnarTable:
+        return self.tables[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tables
+
+    def close(self):
+        # the views over the map must be released before it can be closed
+        self.tables = {}
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self) -> "ColumnarSnapshot":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+########################################################################
+#                           export from MongoDB                        #
+########################################################################
+
+def _encode_id(value):
+    if type(value).__name__ == "ObjectId":
+        return {"$oid": str(value)}
+    return value
+
+
+def _decode_id(value):
+    if isinstance(value, dict) and "$oid" in value:
+        from bson import ObjectId
+
+        return ObjectId(value["$oid"])
+    return value
+
+
+def _export_versions(collection) -> Tuple[List[tuple], dict, str]:
+    fields = TABLES["versions"]
+    projection = {field: 1 for field, _ in fields}
+    return [_row(document, fields) for document in collection.find({}, projection)], {}, "full"
+
+
+def _export_history(collection, previous: Union[ColumnarTable, None]) -> Tuple[List[tuple], dict, str]:
+    fields = TABLES["history"]
+    projection = {field: 1 for field, _ in fields}
+    count = collection.count_documents({})
+    last_id = previous.watermark.get("lastId") if previous is not None else None
+    # the rows of a file written with another versionKey format cannot be merged with new ones
+    same_keys = previous is not None and previous.watermark.get("versionKeyParts") == VERSION_KEY_PARTS
+
+    if same_keys and last_id is not None:
+        documents = list(collection.find({"_id": {"$gt": _decode_id(last_id)}}, projection))
+        if len(previous) + len(documents) == count:
+            rows = list(previous.iter_rows()) + [_row(document, fields) for document in documents]
+            if documents:
+                last_id = _encode_id(max(document["_id"] for document in documents))
+            return rows, {"lastId": last_id, "versionKeyParts": VERSION_KEY_PARTS}, "incremental"
+
+    documents = list(collection.find({}, projection))
+    last_id = _encode_id(max(document["_id"] for document in documents)) if documents else None
+    watermark = {"lastId": last_id, "versionKeyParts": VERSION_KEY_PARTS}
+    return [_row(document, fields) for document in documents], watermark, "full"
+
+
+@metrics.timed_stage("export")
+def export_columnar(path: str, collection, history=None, incremental: bool = True) -> Dict[str, Tuple[int, str]]:
+    """
+    Export the versions collection, and the history collection if given, to a columnar file.
+
+    Args:
+    path (str): The file to write (e.g. versions.cols).
+    collection (pymongo.collection.Collection): The versions collection.
+    history (pymongo.collection.Collection): The history collection (see utils.history), or None.
+    incremental (bool): Start from the history of the previous file at `path` and only read the new
+        history documents.
+
+    Returns:
+    dict: (number of rows, "full" or "incremental") by table name.
+    """
+    previous = None
+    if incremental and history is not None and os.path.exists(path):
+        try:
+            previous = ColumnarSnapshot(path)
+        except ValueError as e:
+            print(f"Error: {e}, exporting everything")
+
+    try:
+        tables, summary = {}, {}
+        exports = [("versions", _export_versions(collection))]
+        if history is not None:
+            previous_history = previous["history"] if previous is not None and "history" in previous else None
+            exports.append(("history", _export_history(history, previous_history)))
+        for name, (rows, watermark, mode) in exports:
+            tables[name] = (rows, watermark)
+            summary[name] = (len(rows), mode)
+    finally:
+        if previous is not None:
+            previous.close()
+
+    write_columnar(path, tables)
+    return summary
+
+
+def export_documents(path: str, documents: Iterable[dict], history: Iterable[dict] = None) -> Dict[str, Tuple[int, str]]:
+    """
+    Export documents that are not in MongoDB (e.g. the documents of data/versions.json) to a columnar file.
+    """
+    tables = {"versions": ([_row(document, TABLES["versions"]) for document in documents], {})}
+    if history is not None:
+        tables["history"] = ([_row(document, TABLES["history"]) for document in history], {})
+    write_columnar(path, tables)
+    return {name: (len(rows), "full") for name, (rows, _) in tables.items()}
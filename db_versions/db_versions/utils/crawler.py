@@ -0,0 +1,296 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+from db_versions.utils import metrics
+from db_versions.utils.github_client import GITHUB_API_URL, github_session
+from db_versions.utils.sync_state import Watermark, new_commits
+from db_versions.utils.tree_diff import TreeChanges, compare_blobs, schema_blobs
+from db_versions.utils.utils import _version_change
+
+
+GITHUB_ORG = "smart-data-models"
+
+########################################################################
+#                            crawl results                             #
+########################################################################
+
+class CrawlTarget(NamedTuple):
+    """
+    A schema.json file to crawl: the subject is the repository (e.g. "dataModel.Environment")
+    and the datamodel is the folder of the schema.json (e.g. "AirQualityObserved").
+    """
+    subject: str
+    datamodel: str
+
+    @property
+    def repo_name(self) -> str:
+        return f"{GITHUB_ORG}/{self.subject}"
+
+    @property
+    def file_path(self) -> str:
+        return f"{self.datamodel}/schema.json"
+
+
+class CrawlResult(NamedTuple):
+    """
+    The last commit that changed the search string in a schema.json.
+
+    date, url and sha are the values returned by last_commit_date_url; version is the new value
+    of the search string in that commit (None if the key was removed), message
+    is the commit message and previous_version the value before the commit (None if the key was added).
+    """
+    target: CrawlTarget
+    date: datetime
+    url: str
+    sha: str
+    version: Union[str, None]
+    message: Union[str, None] = None
+    previous_version: Union[str, None] = None
+
+
+def _parse_github_date(value: str) -> datetime:
+    """
+    Parse a GitHub API timestamp (e.g. '2023-10-15T08:30:00Z') into an aware datetime, like PyGithub does.
+    """
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+########################################################################
+#                           async GitHub crawler                       #
+########################################################################
+
+class GithubCrawler:
+    """
+    Concurrent version of last_commit_date_url over many (repository, schema.json) pairs.
+
+    The blocking HTTP calls run in worker threads over one shared requests session, and each
+    host gets its own semaphore so that no more than `max_per_host` requests are in flight to it.
+    The session paces its requests with the shared rate-limit governor.
+    """
+
+    def __init__(self, access_token: str, max_per_host: int = 8, api_url: str = GITHUB_API_URL, session=None, governor=None):
+        """
+        Args:
+        access_token (str): The GitHub personal access token for authentication (None for anonymous calls).
+        max_per_host (int): The maximum number of concurrent requests to a single host.
+        api_url (str): The base URL of the GitHub REST API.
+        session (requests.Session): The session to use. A github_session is created if None.
+        governor (RateLimitGovernor): The rate-limit governor of the created session. The process-wide one if None.
+        """
+        if session is None:
+            session = github_session(access_token, governor=governor, pool_size=max_per_host)
+
+        self.session = session
+        self.api_url = api_url.rstrip("/")
+        self.max_per_host = max_per_host
+        # (subject, schema.json path) of the targets whose requests failed, as opposed to the
+        # targets without any matching commit (both crawl to a None result)
+        self.failed: Set[Tuple[str, str]] = set()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._semaphores[host]
+
+    async def _get(self, url: str, params: dict = None):
+        """
+        GET a URL in a worker thread, bounded by the semaphore of its host. Returns the response.
+        """
+        async with self._semaphore(url):
+            response = await asyncio.to_thread(self.session.get, url, params=params)
+        response.raise_for_status()
+        return response
+
+    async def _commits_for_path(self, repo_name: str, file_path: str, since: datetime = None) -> AsyncIterator[dict]:
+        """
+        Yield the commits that touched a file, newest first, one page at a time.
+        Only the commits made since the given date are listed if `since` is set.
+        """
+        url = f"{self.api_url}/repos/{repo_name}/commits"
+        params = {"path": file_path, "per_page": 100}
+        if since is not None:
+            params["since"] = since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        while url:
+            response = await self._get(url, params)
+            for commit in response.json():
+                yield commit
+            url = response.links.get("next", {}).get("url")
+            params = None
+
+    async def _first_version_commit(self, target: CrawlTarget, search_string: str, commits) -> Union[CrawlResult, None]:
+        """
+        Walk commits from the newest one and return the first one that changes the value of the search string in the file.
+        """
+        async for commit in commits:
+            commit_data = (await self._get(commit["url"])).json()
+            change = _version_change(commit_data, target.file_path, search_string)
+            if change is not None:
+                return CrawlResult(
+                    target,
+                    _parse_github_date(commit_data["commit"]["author"]["date"]),
+                    commit_data["html_url"],
+                    commit_data["sha"],
+                    change.new,
+                    commit_data["commit"].get("message"),
+                    change.old,
+                )
+        return None
+
+    @metrics.timed_stage("crawl")
+    async def last_commit(self, target: CrawlTarget, search_string: str) -> Union[CrawlResult, None]:
+        """
+        Find the last commit that changed the search string in the schema.json of a target.
+
+        Same logic as last_commit_date_url: the commits of the file are walked from the newest one
+        and the first commit that changes the value of the search string in the file is returned.
+        """
+        return await self._first_version_commit(
+            target, search_string, self._commits_for_path(target.repo_name, target.file_path)
+        )
+
+    @metrics.timed_stage("crawl")
+    async def version_commit(self, target: CrawlTarget, search_string: str, shas: Iterable[str]) -> Union[CrawlResult, None]:
+        """
+        Targeted version of last_commit when the commits that touched the file are already known
+        (e.g. from a push event): only these commits are fetched, newest first, one request each.
+
+        Args:
+        target (CrawlTarget): The schema.json to look at.
+        search_string (str): The string to serach for in the commit file (e.g "$schemaVersion").
+        shas (iterable): The SHAs of the commits that touched the file, newest first.
+        """
+        commits = [{"url": f"{self.api_url}/repos/{target.repo_name}/commits/{sha}"} for sha in shas]
+        return await self._first_version_commit(target, search_string, _async_iter(commits))
+
+    @metrics.timed_stage("crawl")
+    async def sync_commit(self, target: CrawlTarget, search_string: str, watermark: Watermark = None) -> Tuple[Union[CrawlResult, None], Union[Watermark, None]]:
+        """
+        Incremental version of last_commit: only the commits after the watermark are looked at.
+
+        Returns:
+        tuple: The CrawlResult of the newest version change after the watermark (or None), and the
+        new watermark, i.e. the newest commit of the file (None if there is no new commit).
+        """
+        listed = self._commits_for_path(target.repo_name, target.file_path, since=watermark.date if watermark else None)
+        commits = list(new_commits([commit async for commit in listed], watermark))
+        if not commits:
+            return None, None
+
+        head = Watermark(commits[0]["sha"], _parse_github_date(commits[0]["commit"]["committer"]["date"]))
+        return await self._first_version_commit(target, search_string, _async_iter(commits)), head
+
+    async def schema_tree(self, subject: str, ref: str = "HEAD") -> dict:
+        """
+        Get the recursive tree of the repository of a subject (every path and blob SHA) in one request.
+        """
+        response = await self._get(f"{self.api_url}/repos/{GITHUB_ORG}/{subject}/git/trees/{ref}", {"recursive": "1"})
+        return response.json()
+
+    @metrics.timed_stage("tree")
+    async def tree_changes(self, subjects: Iterable[str], blobs: Dict[Tuple[str, str], str], ref: str = "HEAD") -> Dict[str, TreeChanges]:
+        """
+        Compare the schema.json blobs of many repositories with the ones of the previous run, one
+        tree request per repository, concurrently.
+
+        Args:
+        subjects (iterable): The subjects, i.e. the repository names (e.g. "dataModel.Environment").
+        blobs (dict): The stored blob SHA by (subject, path), as returned by sync_state.get_blobs.
+        ref (str): The branch, tag or commit whose tree is read.
+
+        Returns:
+        dict: TreeChanges by subject. Subjects whose tree could not be read are left out.
+        """
+        import requests
+
+        previous = {}
+        for (subject, path), blob in blobs.items():
+            previous.setdefault(subject, {})[path] = blob
+
+        async def changes(subject):
+            try:
+                tree = await self.schema_tree(subject, ref)
+            except requests.exceptions.RequestException as e:
+                print(f"Error: {GITHUB_ORG}/{subject} tree: {e}")
+                return subject, None
+            current, truncated = schema_blobs(tree)
+            return subject, compare_blobs(previous.get(subject, {}), current, truncated)
+
+        results = await asyncio.gather(*(changes(subject) for subject in subjects))
+        return {subject: result for subject, result in results if result is not None}
+
+    async def _sync_or_none(self, target: CrawlTarget, search_string: str, watermark: Union[Watermark, None], incremental: bool):
+        import requests
+
+        try:
+            if incremental:
+                return (target, *await self.sync_commit(target, search_string, watermark))
+            return target, await self.last_commit(target, search_string), None
+        except requests.exceptions.RequestException as e:
+            print(f"Error: {target.repo_name} {target.file_path}: {e}")
+            self.failed.add((target.subject, target.file_path))
+            return target, None, None
+
+    async def crawl(self, targets: Iterable[CrawlTarget], search_string: str) -> AsyncIterator[Tuple[CrawlTarget, Union[CrawlResult, None]]]:
+        """
+        Crawl every target concurrently and yield (target, result) pairs as soon as they complete.
+        The result is None if no matching commit was found or the requests failed (see `failed`).
+        """
+        async for target, result, _ in self._run(targets, search_string, None, incremental=False):
+            yield target, result
+
+    async def sync(self, targets: Iterable[CrawlTarget], search_string: str, watermarks: Dict[Tuple[str, str], Watermark]) -> AsyncIterator[Tuple[CrawlTarget, Union[CrawlResult, None], Union[Watermark, None]]]:
+        """
+        Incremental crawl: yield (target, result, new watermark) triples as soon as they complete,
+        looking only at the commits after the watermark of each target (see sync_commit).
+
+        Args:
+        targets (iterable): (subject, datamodel) pairs.
+        search_string (str): The string to serach for in the commit file (e.g "$schemaVersion").
+        watermarks (dict): Watermark by (subject, schema.json path), as returned by sync_state.get_watermarks.
+        """
+        async for triple in self._run(targets, search_string, watermarks, incremental=True):
+            yield triple
+
+    async def _run(self, targets, search_string, watermarks, incremental):
+        targets = [CrawlTarget(*target) for target in targets]
+        tasks = [
+            asyncio.ensure_future(self._sync_or_none(
+                target, search_string, (watermarks or {}).get((target.subject, target.file_path)), incremental
+            ))
+            for target in targets
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def _async_iter(items):
+    for item in items:
+        yield item
+
+
+def crawl_last_commits(targets: Iterable[CrawlTarget], access_token: str, search_string: str, max_per_host: int = 8) -> List[CrawlResult]:
+    """
+    Blocking helper: crawl every target and return the results that were found.
+
+    Args:
+    targets (iterable): (subject, datamodel) pairs, e.g. ("dataModel.Environment", "AirQualityObserved").
+    access_token (str): The GitHub personal access token for authentication.
+    search_string (str): The string to serach for in the commit file (e.g "$schemaVersion").
+    max_per_host (int): The maximum number of concurrent requests to GitHub.
+
+    Returns:
+    list: The CrawlResult of every target that has a matching commit, in completion order.
+    """
+    async def run():
+        crawler = GithubCrawler(access_token, max_per_host=max_per_host)
+        return [result async for _, result in crawler.crawl(targets, search_string) if result is not None]
+
+    return asyncio.run(run())
@@ -0,0 +1,168 @@
+import functools
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Pattern, Sequence, Tuple, Union
+
+from db_versions.utils import metrics
+
+
+########################################################################
+#                        unified diff analysis                         #
+########################################################################
+
+# In the context of a GitHub commit, the "patch" of a file is the unified diff of the changes made to
+# it: hunk headers (@@ -1,92 +1,95 @@) followed by context lines (" "), removed lines ("-") and added
+# lines ("+"). The functions below walk a patch line by line and read the value of a set of keys
+# (e.g. "$schemaVersion") on the removed side (old value) and on the added side (new value).
+
+DEFAULT_KEYS = ("$schemaVersion", "version", "$id")
+
+# Below this number of commits, a process pool costs more than it saves
+PROCESS_POOL_THRESHOLD = 2000
+
+
+class KeyChange(NamedTuple):
+    """
+    The value of a key before and after a change (None on the side where it does not appear).
+    """
+    old: Union[str, None]
+    new: Union[str, None]
+
+
+@functools.lru_cache(maxsize=None)
+def key_pattern(key: str) -> Pattern:
+    """
+    Return the precompiled pattern of a JSON string member, e.g. "$schemaVersion": "0.1.3"
+    """
+    return re.compile(r'"' + re.escape(key) + r'"\s*:\s*"([^"]*)"')
+
+
+def iter_changed_lines(lines: Union[str, Iterable[str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the ("-", text) and ("+", text) lines of a unified diff.
+
+    The input is either the patch of one file as returned by the GitHub API (starting at the first
+    hunk) or the lines of a `git diff`/`git log -p` output, whose file headers (diff --git, index,
+    ---, +++) are skipped: a header is only expected before the first hunk of a file, so a removed
+    line starting with "--" is not mistaken for one.
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
+    in_header = True
+    for line in lines:
+        if line.startswith("@@"):
+            in_header = False
+        elif line.startswith("diff --git "):
+            in_header = True
+        elif in_header:
+            continue
+        elif line.startswith("-") or line.startswith("+"):
+            yield line[0], line[1:].rstrip("\n")
+
+
+def analyze_lines(lines: Union[str, Iterable[str]], keys: Sequence[str] = DEFAULT_KEYS) -> Dict[str, KeyChange]:
+    """
+    Read the old and new value of each key in a unified diff.
+
+    Only the first occurrence of a key on each side is used. Keys that appear on neither side, or
+    with the same value on both sides, are left out.
+
+    Args:
+    lines (str or iterable): The patch, as one string or as lines.
+    keys (sequence): The keys to look for (e.g. ("$schemaVersion",)).
+
+    Returns:
+    dict: KeyChange by key.
+    """
+    patterns = [(key, key_pattern(key)) for key in keys]
+    found = {"-": {}, "+": {}}
+    for side, text in iter_changed_lines(lines):
+        values = found[side]
+        for key, pattern in patterns:
+            if key not in values and key in text:
+                match = pattern.search(text)
+                if match:
+                    values[key] = match.group(1)
+
+    changes = {}
+    for key in keys:
+        change = KeyChange(found["-"].get(key), found["+"].get(key))
+        if change.old != change.new:
+            changes[key] = change
+    return changes
+
+
+########################################################################
+#                          commits and batches                         #
+########################################################################
+
+@metrics.timed_stage("diff_parse")
+def analyze_commit(commit_data: dict, keys: Sequence[str] = DEFAULT_KEYS, file_path: str = None) -> List[Tuple[str, Dict[str, KeyChange]]]:
+    """
+    Analyze every file of a commit (raw data of the GitHub commits API) and keep those where a key changed.
+
+    Args:
+    commit_data (dict): The commit, with its "files" and their "patch".
+    keys (sequence): The keys to look for.
+    file_path (str): Only analyze this file if set.
+
+    Returns:
+    list: (filename, changes by key) for every file with at least one changed key.
+    """
+    results = []
+    for file_changed in commit_data.get("files", []):
+        filename = file_changed.get("filename")
+        if file_path is not None and filename != file_path:
+            continue
+        patch = file_changed.get("patch")
+        if not patch:
+            # binary files and very large diffs come without a patch
+            continue
+        changes = analyze_lines(patch, keys)
+        if changes:
+            results.append((filename, changes))
+    return results
+
+
+def _file_patches(commit_data: dict, file_path: str = None) -> list:
+    # only the filenames and patches are sent to the worker processes, not the whole commit
+    return [
+        {"filename": file_changed.get("filename"), "patch": file_changed.get("patch")}
+        for file_changed in commit_data.get("files", [])
+        if file_path is None or file_changed.get("filename") == file_path
+    ]
+
+
+def _analyze_commit_batch(arguments) -> list:
+    batch, keys = arguments
+    return [analyze_commit({"files": files}, keys) for files in batch]
+
+
+def analyze_commits(commits: Iterable[dict], keys: Sequence[str] = DEFAULT_KEYS, file_path: str = None, workers: int = None, chunksize: int = 256) -> Iterator[List[Tuple[str, Dict[str, KeyChange]]]]:
+    """
+    Analyze many commits, in the input order, spreading large batches over a process pool.
+
+    Args:
+    commits (iterable): Raw commit data, as for analyze_commit.
+    keys (sequence): The keys to look for.
+    file_path (str): Only analyze this file if set.
+    workers (int): The number of processes (1 to stay in this process, None for the number of CPUs).
+    chunksize (int): The number of commits sent to a process at once.
+
+    Returns:
+    iterator: The result of analyze_commit for each commit.
+    """
+    commits = list(commits)
+    keys = tuple(keys)
+    if (workers or os.cpu_count() or 1) == 1 or len(commits) < PROCESS_POOL_THRESHOLD:
+        for commit_data in commits:
+            yield analyze_commit(commit_data, keys, file_path)
+        return
+
+    files = [_file_patches(commit_data, file_path) for commit_data in commits]
+    chunks = [(files[start:start + chunksize], keys) for start in range(0, len(files), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(_analyze_commit_batch, chunks):
+            yield from results
@@ -0,0 +1,230 @@
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, NamedTuple, Union
+
+from db_versions.utils.crawler import GITHUB_ORG
+from db_versions.utils.diff import analyze_lines
+
+
+########################################################################
+#                      offline history over git mirrors                #
+########################################################################
+
+# The whole version history of a subject is in its smart-data-models/dataModel.* git repository.
+# Instead of asking the REST API for it commit by commit, this module keeps bare mirror clones in a
+# local directory, refreshes them with `git fetch` and reads every $schemaVersion transition of
+# every */schema.json from one `git log -p` per repository. No API call is made, so rebuilding the
+# whole database is only bound by disk and CPU and can run one process per repository.
+
+GITHUB_URL = "https://github.com"
+SCHEMA_PATHSPEC = "*/schema.json"
+
+# Separates the commits in the `git log` output
+_COMMIT_MARKER = "\x1e"
+
+
+class VersionChange(NamedTuple):
+    """
+    A change of the search string (e.g. "$schemaVersion") in a schema.json, as found in one commit.
+
+    The versions are the values of the search string before and after the commit (old_version is
+    None when the file or the key was added).
+    """
+    subject: str
+    datamodel: str
+    path: str
+    sha: str
+    date: datetime
+    url: str
+    old_version: Union[str, None]
+    new_version: Union[str, None]
+
+
+def _git(*args, git_dir: str = None) -> str:
+    """
+    Run a git command and return its output.
+    """
+    command = ["git"] + (["--git-dir", git_dir] if git_dir else []) + list(args)
+    return subprocess.run(command, check=True, capture_output=True, text=True).stdout
+
+
+########################################################################
+#                             git mirrors                              #
+########################################################################
+
+def mirror_path(mirror_dir: str, subject: str) -> str:
+    """
+    Return the path of the bare mirror of a subject, e.g. <mirror_dir>/dataModel.Environment.git
+    """
+    return os.path.join(mirror_dir, f"{subject}.git")
+
+
+def update_mirror(subject: str, mirror_dir: str, remote_url: str = None) -> str:
+    """
+    Clone the repository of a subject as a bare mirror, or fetch the new commits if the mirror exists.
+
+    Args:
+    subject (str): The subject, i.e. the repository name (e.g. "dataModel.Environment").
+    mirror_dir (str): The directory of the mirrors.
+    remote_url (str): The URL to clone. https://github.com/smart-data-models/<subject>.git if None.
+
+    Returns:
+    str: The path of the mirror.
+    """
+    path = mirror_path(mirror_dir, subject)
+    if os.path.isdir(path):
+        _git("fetch", "--prune", "--quiet", git_dir=path)
+    else:
+        os.makedirs(mirror_dir, exist_ok=True)
+        _git("clone", "--mirror", "--quiet", remote_url or f"{GITHUB_URL}/{GITHUB_ORG}/{subject}.git", path)
+    return path
+
+
+def update_mirrors(subjects: Iterable[str], mirror_dir: str, workers: int = 8) -> List[str]:
+    """
+    Clone or fetch the mirrors of many subjects in parallel (the work is network bound, so threads are used).
+
+    Returns:
+    list: The paths of the mirrors that were updated. Failures are printed and skipped.
+    """
+    def update(subject):
+        try:
+            return update_mirror(subject, mirror_dir)
+        except subprocess.CalledProcessError as e:
+            print(f"Error: could not update the mirror of {subject}: {e.stderr.strip()}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [path for path in executor.map(update, subjects) if path]
+
+
+########################################################################
+#                        version history from git                      #
+########################################################################
+
+def _basic_regex(search_string: str) -> str:
+    """
+    Escape a string for the POSIX basic regular expression of `git log -G`.
+    """
+    return "".join("\\" + char if char in ".^$*[]\\" else char for char in search_string)
+
+
+def _log_lines(git_dir: str, search_string: str, ref: str) -> Iterator[str]:
+    """
+    Stream the `git log -p` output of the commits that added or removed a line containing the search string
+    in a schema.json, newest first, with only the changed lines of each hunk.
+    """
+    command = [
+        "git", "--git-dir", git_dir, "log", ref, f"--format={_COMMIT_MARKER}%H %at",
+        "-p", "--unified=0", "--no-color", "--no-ext-diff", "--no-renames",
+        "-G", '"' + _basic_regex(search_string) + '"', "--", SCHEMA_PATHSPEC,
+    ]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, text=True, errors="replace") as process:
+        yield from process.stdout
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def schema_version_history(git_dir: str, subject: str = None, search_string: str = "$schemaVersion", ref: str = "HEAD") -> Iterator[VersionChange]:
+    """
+    Yield every change of the search string in every */schema.json of a repository, newest first.
+
+    Args:
+    git_dir (str): The path of the git repository (a bare mirror or the .git directory of a clone).
+    subject (str): The subject of the repository, used for the records and the commit URLs.
+        The name of the mirror without ".git" if None.
+    search_string (str): The key whose value is tracked (e.g. "$schemaVersion").
+    ref (str): The branch or commit whose history is read.
+
+    Returns:
+    iterator: VersionChange records, with the same commit date (author date, UTC), URL and versions
+    as the GitHub API path (last_commit_date_url / extract_commit_data).
+    """
+    if subject is None:
+        subject = os.path.basename(os.path.normpath(git_dir))
+        subject = subject[:-len(".git")] if subject.endswith(".git") else subject
+
+    sha = date = path = None
+    lines = []
+
+    def changes():
+        # the change of the search string in the file whose lines were collected, if any
+        change = analyze_lines(lines, (search_string,)).get(search_string) if path is not None else None
+        if change is None:
+            return
+        parts = path.split("/")
+        datamodel = parts[-2] if len(parts) > 1 else subject
+        yield VersionChange(
+            subject, datamodel, path, sha, date, f"{GITHUB_URL}/{GITHUB_ORG}/{subject}/commit/{sha}", change.old, change.new
+        )
+
+    for line in _log_lines(git_dir, search_string, ref):
+        if line.startswith(_COMMIT_MARKER) or line.startswith("diff --git "):
+            # a new commit or a new file: emit the change of the previous file
+            yield from changes()
+            path, lines = None, []
+            if line.startswith(_COMMIT_MARKER):
+                sha, timestamp = line[1:].split()
+                date = datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+        elif path is None and line.startswith("+++ "):
+            target = line[4:].rstrip("\n")
+            path = target[2:] if target.startswith("b/") else None
+        elif path is not None:
+            lines.append(line)
+
+    yield from changes()
+
+
+def _history_of_mirror(arguments) -> List[VersionChange]:
+    git_dir, search_string = arguments
+    try:
+        return list(schema_version_history(git_dir, search_string=search_string))
+    except subprocess.CalledProcessError as e:
+        # e.g. an empty mirror without HEAD: the other repositories are still read
+        print(f"Error: could not read the history of {git_dir}: {e}")
+        return []
+
+
+def rebuild_history(mirror_dir: str, subjects: Iterable[str] = None, search_string: str = "$schemaVersion", workers: int = None) -> Iterator[VersionChange]:
+    """
+    Read the version history of many mirrors in parallel, one process per repository.
+
+    Args:
+    mirror_dir (str): The directory of the mirrors.
+    subjects (iterable): The subjects to read. Every mirror of the directory if None.
+    search_string (str): The key whose value is tracked (e.g. "$schemaVersion").
+    workers (int): The number of processes. The number of CPUs if None.
+
+    Returns:
+    iterator: The VersionChange records of every repository, one repository after the other.
+    The subjects without a mirror (e.g. whose clone failed) and the repositories whose history
+    cannot be read are printed and skipped.
+    """
+    if subjects is None:
+        git_dirs = sorted(os.path.join(mirror_dir, name) for name in os.listdir(mirror_dir) if name.endswith(".git"))
+    else:
+        git_dirs = []
+        for subject in subjects:
+            git_dir = mirror_path(mirror_dir, subject)
+            if os.path.isdir(git_dir):
+                git_dirs.append(git_dir)
+            else:
+                print(f"Error: no mirror of {subject} in {mirror_dir}, skipped")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for changes in executor.map(_history_of_mirror, [(git_dir, search_string) for git_dir in git_dirs]):
+            yield from changes
+
+
+def latest_versions(changes: Iterable[VersionChange]) -> List[VersionChange]:
+    """
+    Keep the newest change of each (subject, datamodel), e.g. to reconcile it with the versions collection.
+    """
+    latest = {}
+    for change in changes:
+        key = (change.subject, change.datamodel)
+        if key not in latest or change.date > latest[key].date:
+            latest[key] = change
+    return list(latest.values())
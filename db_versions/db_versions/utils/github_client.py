@@ -0,0 +1,153 @@
+import functools
+
+from db_versions.utils import metrics
+from db_versions.utils.http_cache import cache_key, default_cache
+from db_versions.utils.ratelimit import _governed_adapter_class, default_governor
+
+
+GITHUB_API_URL = "https://api.github.com"
+
+# Passed as `cache` to use the process-wide cache (see http_cache.default_cache)
+DEFAULT_CACHE = "default"
+
+
+########################################################################
+#                         GitHub HTTP transports                       #
+########################################################################
+
+# Every GitHub call of the package goes through a requests HTTPAdapter built here, both for the raw
+# requests calls and for PyGithub, so that they all share the same rate-limit budget and cache.
+
+@functools.lru_cache(maxsize=None)
+def _github_adapter_class():
+    """
+    Build the adapter class on first use, since it subclasses a requests class.
+    """
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+
+    class GithubAdapter(_governed_adapter_class()):
+        """
+        The governed adapter plus the HTTP cache: GET requests are made conditional on the cached
+        ETag / Last-Modified, `304 Not Modified` answers are turned into the cached `200` response,
+        and responses of immutable URLs are served from the cache without any request.
+        """
+
+        def __init__(self, governor=None, cache=None, **kwargs):
+            self.cache = cache
+            super().__init__(governor, **kwargs)
+
+        @staticmethod
+        def _cached_response(request, cached) -> Response:
+            response = Response()
+            response.status_code = 200
+            response.reason = "OK"
+            response.headers = CaseInsensitiveDict(cached["headers"])
+            response.headers["X-From-Cache"] = "1"
+            response._content = cached["body"]
+            response.encoding = "utf-8"
+            response.url = request.url
+            response.request = request
+            return response
+
+        def send(self, request, **kwargs):
+            if self.cache is None or request.method != "GET" or kwargs.get("stream"):
+                return super().send(request, **kwargs)
+
+            key = cache_key(request.url, request.headers)
+            cached = self.cache.get(key)
+            if cached is not None:
+                if self.cache.is_immutable(request.url):
+                    metrics.inc("db_versions_http_cache_total", outcome="hit")
+                    return self._cached_response(request, cached)
+                if cached["etag"]:
+                    request.headers["If-None-Match"] = cached["etag"]
+                if cached["last_modified"]:
+                    request.headers["If-Modified-Since"] = cached["last_modified"]
+
+            response = super().send(request, **kwargs)
+
+            if response.status_code == 304 and cached is not None:
+                metrics.inc("db_versions_http_cache_total", outcome="revalidated")
+                response.close()
+                return self._cached_response(request, cached)
+            metrics.inc("db_versions_http_cache_total", outcome="miss")
+            if response.status_code == 200 and (
+                "ETag" in response.headers or "Last-Modified" in response.headers or self.cache.is_immutable(request.url)
+            ):
+                self.cache.put(key, response.headers, response.content)
+            return response
+
+    return GithubAdapter
+
+
+def _github_adapter(governor=None, pool_size=10, max_retries=0, cache=DEFAULT_CACHE):
+    """
+    Build the transport adapter used for the GitHub API.
+    """
+    if cache == DEFAULT_CACHE:
+        cache = default_cache()
+    return _github_adapter_class()(
+        governor or default_governor(), cache, pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries
+    )
+
+
+def github_session(access_token: str = None, governor=None, pool_size: int = 10, cache=DEFAULT_CACHE):
+    """
+    Create a requests session for the GitHub REST API.
+
+    Args:
+    access_token (str): The GitHub personal access token for authentication (None for anonymous calls).
+    governor (RateLimitGovernor): The rate-limit governor to use. The process-wide one if None.
+    pool_size (int): The number of pooled connections per host.
+    cache (HttpCache): The HTTP cache to use, the process-wide one by default, or None to disable it.
+
+    Returns:
+    requests.Session: A session whose requests are paced by the governor and served from the cache.
+    """
+    import requests
+
+    session = requests.Session()
+    adapter = _github_adapter(governor, pool_size, cache=cache)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept"] = "application/vnd.github+json"
+    if access_token:
+        session.headers["Authorization"] = f"token {access_token}"
+    return session
+
+
+def github_client(access_token: str = None, governor=None, base_url: str = GITHUB_API_URL, cache=DEFAULT_CACHE, **github_options):
+    """
+    Create a PyGithub client whose requests go through the same transport as github_session.
+
+    Args:
+    access_token (str): The GitHub personal access token for authentication (None for anonymous calls).
+    governor (RateLimitGovernor): The rate-limit governor to use. The process-wide one if None.
+    base_url (str): The base URL of the GitHub REST API.
+    cache (HttpCache): The HTTP cache to use, the process-wide one by default, or None to disable it.
+    **github_options: Extra options of github.Github (timeout, per_page, pool_size, ...).
+
+    Returns:
+    github.Github: The PyGithub client.
+    """
+    from github import Auth, Github
+    from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+
+    auth = Auth.Token(access_token) if access_token else None
+    g = Github(auth=auth, base_url=base_url, **github_options)
+
+    requester = g.requester
+    base_class = HTTPSRequestsConnectionClass if base_url.startswith("https") else HTTPRequestsConnectionClass
+
+    def connection_class(*args, **kwargs):
+        connection = base_class(*args, **kwargs)
+        # replace the default adapter of the PyGithub connection, keeping its retry and pool settings
+        adapter = _github_adapter(governor, connection.pool_size, connection.retry, cache)
+        connection.session.mount(f"{connection.protocol}://", adapter)
+        return connection
+
+    # PyGithub has no public hook for its transport: the connection class is a private attribute
+    # of the Requester, set per instance, so only this client is affected
+    requester._Requester__connectionClass = connection_class
+    return g
@@ -0,0 +1,188 @@
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Iterable, List, Set, Tuple, Union
+
+from db_versions.utils import metrics
+from db_versions.utils.crawler import GITHUB_ORG, CrawlResult, CrawlTarget, _parse_github_date
+from db_versions.utils.diff import key_pattern
+from db_versions.utils.github_client import GITHUB_API_URL, github_session
+
+
+########################################################################
+#                       GitHub GraphQL batch backend                   #
+########################################################################
+
+# The REST path needs one request to list the commits of every schema.json and one per commit to read
+# its patch. The GraphQL API can ask for `history(path:, first: 1)` of many paths of many
+# repositories in a single query, one alias per path, together with the current content of the
+# file. This backend packs the targets in size-bounded queries and returns, per path, the last
+# commit (date, sha, url, message) and the version read from the file at HEAD.
+#
+# Example of a query for one subject and one datamodel:
+#   query {
+#     r0: repository(owner: "smart-data-models", name: "dataModel.Environment") {
+#       head: object(expression: "HEAD") { ... on Commit {
+#         h0: history(path: "AirQualityObserved/schema.json", first: 1) { nodes { oid authoredDate url message } }
+#       } }
+#       b0: object(expression: "HEAD:AirQualityObserved/schema.json") { ... on Blob { text } }
+#     }
+#   }
+#
+# Unlike last_commit_date_url, which looks for the last commit whose patch touches the search string,
+# history(first: 1) is the last commit that touched the file at all: the GraphQL API does not expose
+# patches. The version is the one of the file at HEAD. Since the date of that commit is not the date
+# of the version, main.crawl_and_reconcile only compares the versions with this backend.
+
+GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+
+# Each path costs a history connection and a blob: GitHub limits the number of nodes and the
+# complexity of a query, and a large blob response is slow, so the queries are kept small
+MAX_PATHS_PER_QUERY = 50
+
+
+def _literal(value: str) -> str:
+    # GraphQL string literals use the JSON escapes
+    return json.dumps(value)
+
+
+def batch_targets(targets: Iterable[CrawlTarget], max_paths: int = MAX_PATHS_PER_QUERY) -> List[List[Tuple[str, List[CrawlTarget]]]]:
+    """
+    Group the targets by subject and pack them into batches of at most `max_paths` paths. A subject
+    with more paths than that is split over several batches.
+
+    Returns:
+    list: The batches, each a list of (subject, targets of the subject).
+    """
+    by_subject: Dict[str, List[CrawlTarget]] = {}
+    for target in targets:
+        by_subject.setdefault(target.subject, []).append(target)
+
+    batches, batch, size = [], [], 0
+    for subject, subject_targets in by_subject.items():
+        while subject_targets:
+            taken, subject_targets = subject_targets[:max_paths - size], subject_targets[max_paths - size:]
+            batch.append((subject, taken))
+            size += len(taken)
+            if size >= max_paths:
+                batches.append(batch)
+                batch, size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_query(batch: List[Tuple[str, List[CrawlTarget]]], with_version: bool = True) -> str:
+    """
+    Build the query of one batch: the repository of each subject is aliased r0, r1, ... and its
+    paths h0, h1, ... (history) and b0, b1, ... (content at HEAD).
+    """
+    parts = ["query {"]
+    for repository_index, (subject, targets) in enumerate(batch):
+        parts.append(f"  r{repository_index}: repository(owner: {_literal(GITHUB_ORG)}, name: {_literal(subject)}) {{")
+        parts.append('    head: object(expression: "HEAD") { ... on Commit {')
+        for path_index, target in enumerate(targets):
+            parts.append(
+                f"      h{path_index}: history(path: {_literal(target.file_path)}, first: 1)"
+                " { nodes { oid authoredDate url message } }"
+            )
+        parts.append("    } }")
+        if with_version:
+            for path_index, target in enumerate(targets):
+                parts.append(
+                    f"    b{path_index}: object(expression: {_literal('HEAD:' + target.file_path)}) {{ ... on Blob {{ text }} }}"
+                )
+        parts.append("  }")
+    parts.append("}")
+    return "\n".join(parts)
+
+
+def parse_response(batch: List[Tuple[str, List[CrawlTarget]]], data: dict, search_string: str) -> List[Tuple[CrawlTarget, Union[CrawlResult, None]]]:
+    """
+    Read the result of every target of a batch from the `data` of the GraphQL response.
+
+    Returns:
+    list: (target, CrawlResult or None) pairs, None when the repository, the file or its history is missing.
+    """
+    pattern = key_pattern(search_string)
+    results = []
+    for repository_index, (subject, targets) in enumerate(batch):
+        repository = (data or {}).get(f"r{repository_index}") or {}
+        head = repository.get("head") or {}
+        for path_index, target in enumerate(targets):
+            nodes = (head.get(f"h{path_index}") or {}).get("nodes") or []
+            if not nodes:
+                results.append((target, None))
+                continue
+            commit = nodes[0]
+            text = (repository.get(f"b{path_index}") or {}).get("text") or ""
+            match = pattern.search(text)
+            results.append((target, CrawlResult(
+                target,
+                _parse_github_date(commit["authoredDate"]),
+                commit["url"],
+                commit["oid"],
+                match.group(1) if match else None,
+                commit.get("message"),
+            )))
+    return results
+
+
+class GraphqlBackend:
+    """
+    Alternate backend of GithubCrawler.crawl: the last commit of many schema.json files from a few
+    GraphQL queries instead of two REST requests per file and commit.
+    """
+
+    def __init__(self, access_token: str, url: str = GRAPHQL_URL, max_paths: int = MAX_PATHS_PER_QUERY, session=None, governor=None):
+        """
+        Args:
+        access_token (str): The GitHub personal access token (the GraphQL API does not allow anonymous calls).
+        url (str): The GraphQL endpoint.
+        max_paths (int): The maximum number of schema.json paths per query.
+        session (requests.Session): The session to use. A github_session is created if None.
+        governor (RateLimitGovernor): The rate-limit governor of the created session. The process-wide one if None.
+        """
+        self.session = session if session is not None else github_session(access_token, governor=governor)
+        self.url = url
+        self.max_paths = max_paths
+        # (subject, schema.json path) of the targets whose query failed, see GithubCrawler.failed
+        self.failed: Set[Tuple[str, str]] = set()
+
+    def query(self, query: str) -> dict:
+        """
+        Run a query and return its `data`. GraphQL errors (e.g. a repository that does not exist)
+        come with partial data: they are printed and the partial data is returned.
+        """
+        response = self.session.post(self.url, json={"query": query})
+        response.raise_for_status()
+        payload = response.json()
+        for error in payload.get("errors") or []:
+            print(f"GraphQL error: {error.get('message')}")
+        return payload.get("data") or {}
+
+    @metrics.timed_stage("graphql")
+    def last_commits(self, targets: Iterable[CrawlTarget], search_string: str) -> List[Tuple[CrawlTarget, Union[CrawlResult, None]]]:
+        """
+        Blocking version of crawl: return the (target, result) pair of every target, in batch order.
+        """
+        import requests
+
+        results = []
+        for batch in batch_targets([CrawlTarget(*target) for target in targets], self.max_paths):
+            try:
+                data = self.query(build_query(batch))
+            except requests.exceptions.RequestException as e:
+                print(f"Error: GraphQL query of {', '.join(subject for subject, _ in batch)}: {e}")
+                self.failed.update((target.subject, target.file_path) for _, subject_targets in batch for target in subject_targets)
+                data = {}
+            results.extend(parse_response(batch, data, search_string))
+        return results
+
+    async def crawl(self, targets: Iterable[CrawlTarget], search_string: str) -> AsyncIterator[Tuple[CrawlTarget, Union[CrawlResult, None]]]:
+        """
+        Same interface as GithubCrawler.crawl: yield (target, result) pairs, one query at a time,
+        each in a worker thread.
+        """
+        for batch in batch_targets([CrawlTarget(*target) for target in targets], self.max_paths):
+            for pair in await asyncio.to_thread(self.last_commits, [target for _, subject_targets in batch for target in subject_targets], search_string):
+                yield pair
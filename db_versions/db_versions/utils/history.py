@@ -0,0 +1,229 @@
+import bisect
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from db_versions.utils import metrics
+from db_versions.utils.crawler import GITHUB_ORG, CrawlResult
+from db_versions.utils.diff import analyze_commit
+from db_versions.utils.git_mirror import GITHUB_URL, VersionChange
+from db_versions.utils.mongodb import connect_to_mongodb, to_datetime, version_fields
+
+
+########################################################################
+#                      version history of the datamodels               #
+########################################################################
+
+# The versions collection only keeps the current version of each datamodel. The history collection
+# keeps every transition, one document per commit that changed the version of a schema.json, so that
+# "which version was this datamodel at that date" can be answered:
+#
+#   {"subject": "dataModel.Environment", "dataModel": "AirQualityObserved", "date": datetime(2023, 10, 15, 8, 30),
+#    "version": "0.1.3", "previousVersion": "0.1.2", "versionKey": "000000.000001.000003~",
+#    "sha": "8f4639f0...", "url": "https://github.com/smart-data-models/dataModel.Environment/commit/8f4639f0..."}
+#
+# The (subject, dataModel, date) index makes `as_of` a single descending index seek, and
+# HistoryIndex answers it in memory with a binary search over the sorted dates of each datamodel.
+
+DEFAULT_HISTORY_COLLECTION_NAME = "versions_history"
+
+def history_collection(mongo_host, mongo_port, mongo_db_name, collection_name: str = None):
+    """
+    Get the history collection and create its indexes once per process.
+
+    Args:
+    mongo_host (str): The host address of the MongoDB instance.
+    mongo_port (int): The port number of the MongoDB instance.
+    mongo_db_name (str): The name of the database.
+    collection_name (str): The name of the collection, MONGO_HISTORY_COLLECTION_NAME or "versions_history" if None.
+
+    Returns:
+    pymongo.collection.Collection: The history collection.
+    """
+    collection_name = collection_name or os.getenv("MONGO_HISTORY_COLLECTION_NAME", DEFAULT_HISTORY_COLLECTION_NAME)
+    return connect_to_mongodb(mongo_host, mongo_port, mongo_db_name, collection_name, create_indexes=create_history_indexes)
+
+
+def create_history_indexes(collection):
+    """
+    Create the indexes of the history collection.
+    """
+    from pymongo import ASCENDING, DESCENDING
+
+    collection.create_index(
+        [("subject", ASCENDING), ("dataModel", ASCENDING), ("date", DESCENDING)], name="subject_1_dataModel_1_date_-1"
+    )
+    # one transition per datamodel and commit, so that recording the same history again is a no-op
+    collection.create_index(
+        [("subject", ASCENDING), ("dataModel", ASCENDING), ("sha", ASCENDING)], name="subject_1_dataModel_1_sha_1", unique=True
+    )
+
+
+########################################################################
+#                           recording transitions                      #
+########################################################################
+
+def changes_from_commit(commit_data: dict, subject: str, search_string: str = "$schemaVersion") -> List[VersionChange]:
+    """
+    Read the version transitions of a commit (raw data of the GitHub commits API, as parsed by
+    extract_commit_data), one per schema.json whose search string changed.
+
+    Args:
+    commit_data (dict): The commit, with its "files" and their "patch".
+    subject (str): The subject of the repository (e.g. "dataModel.Environment").
+    search_string (str): The key whose value is tracked (e.g. "$schemaVersion").
+
+    Returns:
+    list: The VersionChange records, in the same form as git_mirror.schema_version_history.
+    """
+    date = to_datetime(commit_data["commit"]["author"]["date"])
+    sha = commit_data["sha"]
+    url = commit_data.get("html_url") or f"{GITHUB_URL}/{GITHUB_ORG}/{subject}/commit/{sha}"
+    changes = []
+    for filename, keys in analyze_commit(commit_data, (search_string,)):
+        parts = filename.split("/")
+        if parts[-1] != "schema.json":
+            continue
+        change = keys[search_string]
+        datamodel = parts[-2] if len(parts) > 1 else subject
+        changes.append(VersionChange(subject, datamodel, filename, sha, date, url, change.old, change.new))
+    return changes
+
+
+def change_from_result(result: CrawlResult) -> VersionChange:
+    """
+    Turn the last version commit of a schema.json found by the crawler into a transition.
+    """
+    target = result.target
+    return VersionChange(
+        target.subject, target.datamodel, target.file_path, result.sha, result.date, result.url,
+        result.previous_version, result.version,
+    )
+
+
+def record_commit(collection, repository_name: str, commit_sha: str, access_token: str, search_string: str = "$schemaVersion") -> int:
+    """
+    Record the version transitions of one commit of a GitHub repository (e.g. a commit inspected
+    with extract_commit_data, whose response is then served by the HTTP cache).
+
+    Returns:
+    int: The number of new transitions.
+    """
+    from db_versions.utils.github_client import github_client
+
+    commit = github_client(access_token).get_repo(repository_name).get_commit(sha=commit_sha)
+    subject = repository_name.split("/")[-1]
+    return record_changes(collection, changes_from_commit(commit.raw_data, subject, search_string))
+
+
+@metrics.timed_stage("history")
+def record_changes(collection, changes: Iterable[VersionChange], batch_size: int = 1000) -> int:
+    """
+    Store version transitions with unordered bulk upserts keyed on (subject, dataModel, sha).
+    Transitions that remove the search string (no new version) are skipped.
+
+    Returns:
+    int: The number of new transitions.
+    """
+    from pymongo import UpdateOne
+
+    inserted = 0
+    operations = []
+    for change in changes:
+        if change.new_version is None:
+            continue
+        document = {
+            "date": to_datetime(change.date),
+            "version": change.new_version,
+            "previousVersion": change.old_version,
+            "path": change.path,
+            "url": change.url,
+            **version_fields(change.new_version),
+        }
+        operations.append(UpdateOne(
+            {"subject": change.subject, "dataModel": change.datamodel, "sha": change.sha}, {"$set": document}, upsert=True
+        ))
+        if len(operations) >= batch_size:
+            inserted += collection.bulk_write(operations, ordered=False).upserted_count
+            operations = []
+    if operations:
+        inserted += collection.bulk_write(operations, ordered=False).upserted_count
+    return inserted
+
+
+########################################################################
+#                          point-in-time queries                       #
+########################################################################
+
+def as_of(collection, subject: str, datamodel: str, timestamp) -> Union[dict, None]:
+    """
+    Return the transition in force at a date: the newest one on or before it (one index seek).
+
+    Args:
+    collection (pymongo.collection.Collection): The history collection.
+    subject (str): The subject of the datamodel.
+    datamodel (str): The name of the datamodel.
+    timestamp (str or datetime): The date, as a datetime or in ISO format.
+
+    Returns:
+    dict: The transition document, or None if the datamodel had no version yet at that date.
+    """
+    query = {"subject": subject, "dataModel": datamodel, "date": {"$lte": to_datetime(timestamp)}}
+    return collection.find_one(query, {"_id": 0}, sort=[("date", -1)])
+
+
+def version_history(collection, subject: str, datamodel: str) -> List[dict]:
+    """
+    Return every transition of a datamodel, oldest first.
+    """
+    return list(collection.find({"subject": subject, "dataModel": datamodel}, {"_id": 0}).sort("date", 1))
+
+
+class HistoryIndex:
+    """
+    An in-memory copy of the history collection for services that ask `as_of` for every entity:
+    the sorted dates and versions of each datamodel, searched with bisect.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._dates: Dict[Tuple[str, str], List[datetime]] = {}
+        self._versions: Dict[Tuple[str, str], List[str]] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> "HistoryIndex":
+        """
+        (Re)load every transition with one cursor, sorted on the server.
+        """
+        dates, versions = {}, {}
+        projection = {"_id": 0, "subject": 1, "dataModel": 1, "date": 1, "version": 1}
+        # the order of the (subject, dataModel, date descending) index, so the server does not sort in memory
+        for document in self.collection.find({}, projection).sort([("subject", 1), ("dataModel", 1), ("date", -1)]):
+            key = (document["subject"], document["dataModel"])
+            dates.setdefault(key, []).append(document["date"])
+            versions.setdefault(key, []).append(document["version"])
+        for key in dates:
+            dates[key].reverse()
+            versions[key].reverse()
+        with self._lock:
+            self._dates, self._versions = dates, versions
+        return self
+
+    def as_of(self, subject: str, datamodel: str, timestamp) -> Union[str, None]:
+        """
+        Return the version of a datamodel at a date, or None if it had no version yet.
+        """
+        key = (subject, datamodel)
+        dates = self._dates.get(key)
+        if not dates:
+            return None
+        position = bisect.bisect_right(dates, to_datetime(timestamp))
+        return self._versions[key][position - 1] if position else None
+
+    def history(self, subject: str, datamodel: str) -> Iterator[Tuple[datetime, str]]:
+        """
+        Yield the (date, version) transitions of a datamodel, oldest first.
+        """
+        key = (subject, datamodel)
+        return zip(self._dates.get(key, []), self._versions.get(key, []))
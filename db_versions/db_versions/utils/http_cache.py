@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Mapping, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from db_versions.utils import cache_path
+
+
+########################################################################
+#                      on-disk HTTP response cache                     #
+########################################################################
+
+# GitHub answers a request carrying If-None-Match / If-Modified-Since with `304 Not Modified` when
+# the resource did not change, and 304 responses do not count against the rate limit. The cache
+# keeps the body, ETag and Last-Modified of every GET response so that the next request for the
+# same URL can be made conditional, and serves objects addressed by their SHA (commits, trees,
+# blobs), which can never change, without any request at all.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# URLs of immutable objects, e.g. /repos/{owner}/{repo}/commits/{sha} or /git/trees/{sha}
+IMMUTABLE_URL = re.compile(r"/(?:commits|git/commits|git/trees|git/blobs)/[0-9a-f]{40}(?:[?#]|$)")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def cache_key(url: str, headers: Mapping[str, str] = None) -> str:
+    """
+    Return the key of a request in the cache.
+
+    The default port is dropped from the URL, since PyGithub sends https://api.github.com:443/...
+    where requests sends https://api.github.com/... A fingerprint of the Authorization header is
+    appended, so that a token is never served the responses fetched with another one.
+    """
+    parts = urlsplit(url)
+    netloc = parts.netloc
+    if parts.port is not None and parts.port == DEFAULT_PORTS.get(parts.scheme):
+        netloc = netloc.rsplit(":", 1)[0]
+    key = urlunsplit((parts.scheme, netloc, parts.path, parts.query, ""))
+
+    authorization = next((value for name, value in (headers or {}).items() if name.lower() == "authorization"), None)
+    if authorization:
+        key += " auth=" + hashlib.sha256(authorization.encode()).hexdigest()[:16]
+    return key
+
+
+class HttpCache:
+    """
+    A SQLite-backed store of HTTP responses with size-based LRU eviction.
+
+    The store can be used from several threads and, since SQLite handles the file locking,
+    from several processes at once.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+        path (str): The SQLite file of the cache (created if needed).
+        max_bytes (int): The maximum total size of the cached bodies. The least recently used
+            responses are evicted above it.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, headers TEXT NOT NULL,"
+            " body BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        # the total size of the bodies, kept up to date by triggers so that no put scans the table.
+        # The rows replaced by INSERT OR REPLACE only fire the delete trigger with recursive triggers.
+        self._connection.execute("PRAGMA recursive_triggers = ON")
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO total (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses"
+                " BEGIN UPDATE total SET size = size + NEW.size; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses"
+                " BEGIN UPDATE total SET size = size - OLD.size; END"
+            )
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def is_immutable(url: str) -> bool:
+        """
+        Check if a URL addresses an object by its SHA, so its cached response never expires.
+        """
+        return IMMUTABLE_URL.search(url.split(" ", 1)[0]) is not None
+
+    def get(self, url: str) -> Union[dict, None]:
+        """
+        Return the cached response of a URL (or of a key built by cache_key) as a dict with the keys
+        "etag", "last_modified", "headers" and "body", or None. The entry is marked as recently used.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified, headers, body FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+        etag, last_modified, headers, body = row
+        return {"etag": etag, "last_modified": last_modified, "headers": json.loads(headers), "body": body}
+
+    def put(self, url: str, headers: Mapping[str, str], body: bytes):
+        """
+        Store the response of a URL, then evict the least recently used responses if the cache is too big.
+        The rate-limit headers are not stored, since they only describe the moment of the response.
+        """
+        headers = {key: value for key, value in headers.items() if not key.lower().startswith("x-ratelimit-")}
+        lowered = {key.lower(): value for key, value in headers.items()}
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, headers, body, size, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, lowered.get("etag"), lowered.get("last-modified"), json.dumps(headers), body, len(body), time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._connection.execute("SELECT size FROM total").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop the oldest entries until the cache is back to 90% of its maximum size
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        urls = []
+        for url, size in self._connection.execute("SELECT url, size FROM responses ORDER BY accessed"):
+            urls.append((url,))
+            freed += size
+            if freed >= excess:
+                break
+        self._connection.executemany("DELETE FROM responses WHERE url = ?", urls)
+
+    def size(self) -> int:
+        """
+        Return the total size of the cached bodies, in bytes.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT size FROM total").fetchone()[0]
+
+    def clear(self):
+        """
+        Remove every cached response.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+########################################################################
+#                             default cache                            #
+########################################################################
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def _reset_default_cache_after_fork():
+    # a SQLite connection must not be used across a fork: the child opens its own
+    global _default_cache
+    _default_cache = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_default_cache_after_fork)
+
+
+def default_cache_path() -> Union[str, None]:
+    """
+    Return the path of the default cache: the env variable GITHUB_HTTP_CACHE if set ("" or "off"
+    disables the cache), else db-versions/github-http.sqlite in the user cache directory.
+    """
+    path = os.getenv("GITHUB_HTTP_CACHE")
+    if path is not None:
+        return None if path in ("", "off") else path
+    return cache_path("github-http.sqlite")
+
+
+def default_cache() -> Union[HttpCache, None]:
+    """
+    Return the cache shared by the whole process, or None if the cache is disabled.
+    """
+    global _default_cache
+    if _default_cache is None:
+        path = default_cache_path()
+        if path is None:
+            return None
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = HttpCache(path)
+    return _default_cache
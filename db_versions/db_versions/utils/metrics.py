@@ -0,0 +1,346 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Tuple, Union
+
+
+########################################################################
+#                        hot-path instrumentation                      #
+########################################################################
+
+# Counters and latency histograms of the GitHub calls (every transport adapter of github_client),
+# the rate-limit waits, the HTTP cache and the MongoDB commands, labelled with the stage of the
+# pipeline that made them (crawl, last_commit, commit_data, diff_parse, reconcile, load, ...).
+# Instrumentation is off until enable() is called: every hook then costs one global lookup.
+# Stages nest, the calls are counted in the innermost one. They follow asyncio tasks and
+# asyncio.to_thread, but not plain threads or processes of a pool.
+
+# Upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS_HELP = {
+    "db_versions_stage_seconds": "Duration of the stages of the pipeline.",
+    "db_versions_http_requests_total": "HTTP requests sent to GitHub.",
+    "db_versions_http_request_seconds": "Latency of the HTTP requests sent to GitHub, without the rate-limit wait.",
+    "db_versions_http_response_bytes_total": "Bytes received from GitHub.",
+    "db_versions_http_cache_total": "GitHub GET requests by cache outcome (hit, revalidated, miss).",
+    "db_versions_rate_limit_wait_seconds_total": "Time spent waiting for the rate-limit governor.",
+    "db_versions_rate_limit_waits_total": "Requests delayed by the rate-limit governor.",
+    "db_versions_mongo_commands_total": "MongoDB commands by outcome.",
+    "db_versions_mongo_command_seconds": "Latency of the MongoDB commands.",
+    "db_versions_mongo_documents_total": "Documents returned, inserted, updated or deleted by the MongoDB commands.",
+}
+
+_stage = contextvars.ContextVar("db_versions_stage", default="none")
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by name and labels, safe to update from several threads.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Args:
+        buckets (tuple): The sorted upper bounds of the histogram buckets, in seconds.
+        """
+        self.buckets = tuple(buckets)
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        # name -> labels -> [count per bucket..., +Inf count, sum]
+        self._histograms: Dict[str, Dict[tuple, list]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def value(self, name: str, **labels) -> float:
+        """
+        Return the value of a counter, or the number of observations of a histogram (0 if unknown).
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if name in self._histograms:
+                return sum(self._histograms[name].get(key, [0.0])[:-1])
+            return self._counters.get(name, {}).get(key, 0)
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.extend(_header(name, "counter"))
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+            for name in sorted(self._histograms):
+                lines.extend(_header(name, "histogram"))
+                for key, counts in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"),), counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else _number(bound)
+                        lines.append(f"{name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(counts[-1])}")
+                    lines.append(f"{name}_count{_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _header(name: str, kind: str) -> list:
+    lines = [f"# HELP {name} {METRICS_HELP[name]}"] if name in METRICS_HELP else []
+    return lines + [f"# TYPE {name} {kind}"]
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    escaped = (
+        f'{label}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for label, value in key
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+########################################################################
+#                         process-wide registry                        #
+########################################################################
+
+_registry: Union[MetricsRegistry, None] = None
+_mongo_listener_registered = False
+
+
+def enable(registry: MetricsRegistry = None) -> MetricsRegistry:
+    """
+    Start recording into a registry (a new one if None) and return it.
+
+    The MongoDB commands are only seen by the clients created afterwards (pymongo reads its global
+    listeners when a client is created), so call it before the first connect_to_mongodb.
+    """
+    global _registry
+    _registry = registry or MetricsRegistry()
+    _register_mongo_listener()
+    return _registry
+
+
+def disable():
+    """
+    Stop recording. The hooks go back to a single lookup.
+    """
+    global _registry
+    _registry = None
+
+
+def registry() -> Union[MetricsRegistry, None]:
+    """
+    Return the registry being recorded into, or None when instrumentation is off.
+    """
+    return _registry
+
+
+def current_stage() -> str:
+    return _stage.get()
+
+
+def inc(name: str, value: float = 1, **labels):
+    """
+    Add to a counter, labelled with the current stage. Does nothing when instrumentation is off.
+    """
+    registry = _registry
+    if registry is not None:
+        registry.inc(name, value, stage=_stage.get(), **labels)
+
+
+def observe(name: str, value: float, **labels):
+    """
+    Add an observation to a histogram, labelled with the current stage. Does nothing when instrumentation is off.
+    """
+    registry = _registry
+    if registry is not None:
+        registry.observe(name, value, stage=_stage.get(), **labels)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block as a stage of the pipeline and label the calls it makes with the stage name.
+    """
+    registry = _registry
+    if registry is None:
+        yield
+        return
+    token = _stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("db_versions_stage_seconds", time.perf_counter() - start, stage=name)
+        _stage.reset(token)
+
+
+def timed_stage(name: str):
+    """
+    Decorator running a function (or a coroutine function) as a stage, see stage().
+    """
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if _registry is None:
+                    return await function(*args, **kwargs)
+                with stage(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _registry is None:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+########################################################################
+#                           MongoDB commands                           #
+########################################################################
+
+# Commands whose reply counts the documents written
+_WRITE_COMMANDS = ("insert", "update", "delete")
+
+
+def _reply_documents(command_name: str, reply) -> int:
+    if command_name in _WRITE_COMMANDS:
+        return int(reply.get("n", 0))
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    return 0
+
+
+def _register_mongo_listener():
+    global _mongo_listener_registered
+    if _mongo_listener_registered:
+        return
+    try:
+        from pymongo import monitoring
+    except ImportError:
+        return
+
+    class CommandMetrics(monitoring.CommandListener):
+        """
+        Count and time every command of the MongoDB clients, as long as instrumentation is on.
+        """
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            if _registry is None:
+                return
+            inc("db_versions_mongo_commands_total", command=event.command_name, outcome="success")
+            observe("db_versions_mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+            documents = _reply_documents(event.command_name, event.reply)
+            if documents:
+                inc("db_versions_mongo_documents_total", documents, command=event.command_name)
+
+        def failed(self, event):
+            if _registry is None:
+                return
+            inc("db_versions_mongo_commands_total", command=event.command_name, outcome="failure")
+            observe("db_versions_mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    monitoring.register(CommandMetrics())
+    _mongo_listener_registered = True
+
+
+########################################################################
+#                                export                                #
+########################################################################
+
+def write_prometheus(path: str, registry: MetricsRegistry = None):
+    """
+    Write the metrics to a Prometheus text file (e.g. for the node_exporter textfile collector).
+
+    The file is replaced atomically, so a scraper never reads it half written.
+    """
+    registry = registry or _registry or MetricsRegistry()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as file:
+        file.write(registry.render())
+    os.replace(temporary, path)
+
+
+def serve(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = None):
+    """
+    Serve the metrics on http://host:port/metrics from a background thread.
+
+    Returns:
+    http.server.ThreadingHTTPServer: The server, to stop with shutdown().
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = (registry or _registry or MetricsRegistry()).render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def profile(path: str):
+    """
+    Run a block under cProfile and dump the statistics to a file (read them with pstats or snakeviz).
+    """
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path)
@@ -1,33 +1,145 @@
 import os
 import json
-from dotenv import load_dotenv
-from github import Github
-from pymongo import MongoClient
+import atexit
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Union
 
+from db_versions.utils import metrics
 
-# Load environment variables from .env file
-load_dotenv()
+
+########################################################################
+#                        MongoDB client registry                       #
+########################################################################
+
+# One MongoClient per (host, port, options) for the whole process. A MongoClient owns its own
+# connection pool and monitor threads, so creating one per call makes every lookup pay for a new
+# server handshake. The registry is reset in forked children, because pymongo clients must not be
+# shared across a fork.
+_mongo_clients = {}
+_mongo_clients_lock = threading.Lock()
+_mongo_clients_pid = os.getpid()
+
+# Default pool and timeout settings, overridable through env variables
+MONGO_CLIENT_DEFAULTS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", 50),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", 0),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", 60000),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", 5000),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+}
+
+
+def _client_options(options: dict) -> dict:
+    """
+    Merge the given MongoClient options with the defaults read from the environment.
+    """
+    merged = {}
+    for option, (env_name, default) in MONGO_CLIENT_DEFAULTS.items():
+        value = os.getenv(env_name)
+        merged[option] = int(value) if value else default
+    merged.update(options)
+    return merged
+
+
+def _reset_mongo_clients_after_fork():
+    """
+    Forget the clients inherited from the parent process.
+
+    The inherited clients are not closed: their sockets and monitor threads belong to the parent.
+    """
+    global _mongo_clients_lock, _mongo_clients_pid, _indexed_collections_lock
+    _mongo_clients.clear()
+    _mongo_clients_lock = threading.Lock()
+    _indexed_collections_lock = threading.Lock()
+    _mongo_clients_pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_mongo_clients_after_fork)
+
+
+def get_mongo_client(mongo_host, mongo_port, **client_options):
+    """
+    Return the shared MongoClient for a host, port and set of client options, creating it on first use.
+
+    Args:
+    mongo_host (str): The host address of the MongoDB instance.
+    mongo_port (int): The port number of the MongoDB instance.
+    **client_options: Extra MongoClient options (e.g. maxPoolSize=100, serverSelectionTimeoutMS=2000).
+
+    Returns:
+    pymongo.MongoClient: A client that is reused by every caller asking for the same connection.
+    """
+    if os.getpid() != _mongo_clients_pid:
+        # fork happened on a platform without register_at_fork
+        _reset_mongo_clients_after_fork()
+
+    options = _client_options(client_options)
+    key = (mongo_host, int(mongo_port), tuple(sorted(options.items())))
+
+    client = _mongo_clients.get(key)
+    if client is None:
+        with _mongo_clients_lock:
+            client = _mongo_clients.get(key)
+            if client is None:
+                from pymongo import MongoClient
+
+                client = MongoClient(mongo_host, int(mongo_port), **options)
+                _mongo_clients[key] = client
+    return client
+
+
+def register_mongo_client(mongo_host, mongo_port, client, **client_options):
+    """
+    Put a client in the registry, so that every caller asking for this host, port and set of options
+    gets it (e.g. an in-process stand-in of MongoDB for the benchmarks).
+    """
+    key = (mongo_host, int(mongo_port), tuple(sorted(_client_options(client_options).items())))
+    with _mongo_clients_lock:
+        _mongo_clients[key] = client
+
+
+def close_mongo_clients():
+    """
+    Close every client in the registry. Called automatically when the interpreter exits.
+    """
+    with _mongo_clients_lock:
+        clients = list(_mongo_clients.values())
+        _mongo_clients.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_mongo_clients)
 
 
 ########################################################################
 #                            connect to MongoDB                        #
 ########################################################################
 
-def connect_to_mongodb(mongo_host, mongo_port, mongo_db_name, mongo_collection_name):
+def connect_to_mongodb(mongo_host, mongo_port, mongo_db_name, mongo_collection_name, create_indexes=False, **client_options):
     """
     Connects to a MongoDB instance and retrieves a specific collection.
 
+    The underlying client comes from the process-wide registry, so repeated calls share one
+    connection pool instead of opening a new one each time.
+
     Args:
     mongo_host (str): The host address of the MongoDB instance.
     mongo_port (int): The port number of the MongoDB instance.
     mongo_db_name (str): The name of the database to connect to.
     mongo_collection_name (str): The name of the collection to retrieve.
+    create_indexes (bool or callable): Create the versions collection indexes (True), or call this
+        function with the collection (e.g. the indexes of another collection), once per process.
+    **client_options: Extra MongoClient options passed to get_mongo_client.
 
     Returns:
     pymongo.collection.Collection: The specified collection from the MongoDB database.
     """
-    # Create a MongoDB client
-    client = MongoClient(mongo_host, mongo_port)
+    # Get the shared MongoDB client
+    client = get_mongo_client(mongo_host, mongo_port, **client_options)
 
     # get the database
     db = client[mongo_db_name]
@@ -35,41 +147,469 @@ def connect_to_mongodb(mongo_host, mongo_port, mongo_db_name, mongo_collection_n
     # get the collection
     collection = db[mongo_collection_name]
 
+    if create_indexes:
+        create = create_versions_indexes if create_indexes is True else create_indexes
+        ensure_indexes(collection, (mongo_host, int(mongo_port), mongo_db_name, mongo_collection_name), create)
+
     return collection
 
+
+# (host, port, database, collection, function) of the collections whose indexes were already created by this process
+_indexed_collections = set()
+_indexed_collections_lock = threading.Lock()
+
+
+def ensure_indexes(collection, key: tuple, create_indexes):
+    """
+    Call `create_indexes(collection)` the first time this process sees `key`, so that the index
+    builds are not repeated on every connect.
+
+    Args:
+    collection (pymongo.collection.Collection): The collection.
+    key (tuple): What identifies the collection, e.g. (host, port, database, collection).
+    create_indexes (callable): The function creating the indexes of the collection.
+    """
+    key = key + (create_indexes,)
+    if key in _indexed_collections:
+        return
+    with _indexed_collections_lock:
+        if key not in _indexed_collections:
+            create_indexes(collection)
+            _indexed_collections.add(key)
+
+########################################################################
+#                        versions collection indexes                   #
+########################################################################
+
+VERSIONS_UNIQUE_INDEX = "subject_1_dataModel_1"
+
+
+def find_duplicate_datamodels(collection) -> list:
+    """
+    Find the (subject, dataModel) pairs stored more than once, which block the unique index.
+
+    Args:
+    collection (pymongo.collection.Collection): The versions collection.
+
+    Returns:
+    list: One dict per duplicated pair with the keys "subject", "dataModel", "count" and "ids".
+    """
+    pipeline = [
+        {"$group": {
+            "_id": {"subject": "$subject", "dataModel": "$dataModel"},
+            "count": {"$sum": 1},
+            "ids": {"$push": "$_id"},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    return [
+        {"subject": group["_id"].get("subject"), "dataModel": group["_id"].get("dataModel"),
+         "count": group["count"], "ids": group["ids"]}
+        for group in collection.aggregate(pipeline, allowDiskUse=True)
+    ]
+
+
+def create_versions_indexes(collection) -> bool:
+    """
+    Create the indexes of the versions collection. Safe to run any number of times.
+
+    A compound unique index on (subject, dataModel) backs every per-datamodel lookup, and the
+    `date`, `version`, `versionKey` and (`versionMajor`, `date` descending) indexes back sorting and
+    range queries. If duplicate documents prevent the unique index from being built, they are reported
+    and the other indexes are still created.
+
+    Args:
+    collection (pymongo.collection.Collection): The versions collection.
+
+    Returns:
+    bool: True if the unique index exists, False if duplicates blocked it.
+    """
+    from pymongo import ASCENDING, DESCENDING
+    from pymongo.errors import DuplicateKeyError, OperationFailure
+
+    collection.create_index([("date", ASCENDING)], name="date_1")
+    collection.create_index([("version", ASCENDING)], name="version_1")
+    collection.create_index([("versionKey", ASCENDING)], name="versionKey_1")
+    collection.create_index([("versionMajor", ASCENDING), ("date", DESCENDING)], name="versionMajor_1_date_-1")
+
+    try:
+        collection.create_index(
+            [("subject", ASCENDING), ("dataModel", ASCENDING)], name=VERSIONS_UNIQUE_INDEX, unique=True
+        )
+    except (DuplicateKeyError, OperationFailure):
+        duplicates = find_duplicate_datamodels(collection)
+        if not duplicates:
+            raise
+        print(f"Unique index on (subject, dataModel) not created: {len(duplicates)} duplicated datamodels")
+        for duplicate in duplicates:
+            print(f"  {duplicate['subject']} / {duplicate['dataModel']}: {duplicate['count']} documents")
+        return False
+
+    return True
+
+########################################################################
+#                             dates in MongoDB                         #
+########################################################################
+
+# Dates are stored as BSON datetimes (UTC), not as ISO strings, so that they compare and sort
+# correctly on the server and "changed since" queries are range scans on the date index.
+
+DATE_FIELDS = ("date",)
+
+
+def to_datetime(value):
+    """
+    Normalize a date to a naive UTC datetime, the way pymongo returns BSON datetimes.
+
+    Args:
+    value (str or datetime): An ISO date (e.g. '2023-10-15T08:30:00Z', '2023-12-20T16:53:54+00:00'
+        or '2023-10-15T08:30:00') or a datetime (naive datetimes are taken as UTC).
+
+    Returns:
+    datetime: The naive UTC datetime, or None if the value is None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.endswith("Z"):
+            value = value[:-1] + "+00:00"
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@metrics.timed_stage("migrate")
+def migrate_dates(collection, batch_size: int = 1000) -> int:
+    """
+    Convert the string dates of the collection into BSON datetimes. Safe to run any number of times.
+
+    Args:
+    collection (pymongo.collection.Collection): The versions collection.
+    batch_size (int): The number of documents updated per bulk write.
+
+    Returns:
+    int: The number of documents converted.
+    """
+    from pymongo import UpdateOne
+
+    converted = 0
+    for field in DATE_FIELDS:
+        operations = []
+        for document in collection.find({field: {"$type": "string"}}, {field: 1}):
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {field: to_datetime(document[field])}}))
+            if len(operations) >= batch_size:
+                converted += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+    return converted
+
+
+def changed_since(collection, since, projection: dict = None) -> list:
+    """
+    Return the datamodels whose date is on or after `since`, oldest first (a range scan on the date index).
+    """
+    return list(collection.find({"date": {"$gte": to_datetime(since)}}, projection).sort("date", 1))
+
+
+def latest_updates(collection, limit: int = 10, projection: dict = None) -> list:
+    """
+    Return the `limit` most recently updated datamodels, newest first (read backwards on the date index).
+    """
+    return list(collection.find({"date": {"$type": "date"}}, projection).sort("date", -1).limit(limit))
+
+
+########################################################################
+#                           sortable version keys                      #
+########################################################################
+
+# `version` is a string, so MongoDB sorts it lexically ("0.10.0" < "0.9.0"). Every write also stores
+# `versionKey`, a zero-padded string that sorts like the version numbers ("000000.000010.000000.000000"),
+# and `versionMajor`, the first number as an int, so that "latest version" and version range
+# questions are answered by the indexes instead of in Python.
+
+VERSION_KEY_WIDTH = 6
+
+# Every key has this many numbers, so that "1.0.0" (1.0.0.0) sorts below "1.0.0.1"
+VERSION_KEY_PARTS = 4
+
+_VERSION_PATTERN = re.compile(r"^\s*v?(\d+(?:\.\d+)*)(?:[-.]?(\S*))?\s*$")
+
+
+def version_key(version: str) -> Union[str, None]:
+    """
+    Return the sortable key of a version, e.g. "0.1.3" -> "000000.000001.000003.000000~".
+
+    Versions are padded to VERSION_KEY_PARTS numbers ("1.2" and "1.2.0" have the same key). A
+    pre-release suffix sorts before the release ("1.0.0-rc1" < "1.0.0"), which ends with "~".
+    Build metadata is ignored ("1.0.0+build" has the key of "1.0.0").
+
+    Returns:
+    str: The key, or None if the version does not start with a number.
+    """
+    if isinstance(version, str):
+        version = version.split("+", 1)[0]
+    match = _VERSION_PATTERN.match(version) if isinstance(version, str) else None
+    if match is None:
+        return None
+    numbers = [int(number) for number in match.group(1).split(".")]
+    numbers += [0] * (VERSION_KEY_PARTS - len(numbers))
+    key = ".".join(str(number).zfill(VERSION_KEY_WIDTH) for number in numbers)
+    return key + ("-" + match.group(2) if match.group(2) else "~")
+
+
+def version_fields(version: str) -> dict:
+    """
+    Return the `versionKey` and `versionMajor` fields stored next to a version (empty if it cannot be parsed).
+    """
+    key = version_key(version)
+    if key is None:
+        return {}
+    return {"versionKey": key, "versionMajor": int(key[:VERSION_KEY_WIDTH])}
+
+
+@metrics.timed_stage("migrate")
+def migrate_version_keys(collection, batch_size: int = 1000) -> int:
+    """
+    Add or refresh the version keys of every document. Safe to run any number of times.
+
+    Returns:
+    int: The number of documents changed.
+    """
+    from pymongo import UpdateOne
+
+    changed = 0
+    operations = []
+    for document in collection.find({"version": {"$type": "string"}}, {"version": 1, "versionKey": 1, "versionMajor": 1}):
+        fields = version_fields(document["version"])
+        if fields and any(document.get(name) != value for name, value in fields.items()):
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": fields}))
+        if len(operations) >= batch_size:
+            changed += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        changed += collection.bulk_write(operations, ordered=False).modified_count
+    return changed
+
+
+def latest_version_per_model(collection, subject: str = None) -> list:
+    """
+    Return the document with the highest version of each dataModel name (a datamodel can be
+    published in several subjects), walking the versionKey index from the highest key.
+
+    Args:
+    collection (pymongo.collection.Collection): The versions collection.
+    subject (str): Only look at the datamodels of this subject if set.
+
+    Returns:
+    list: The documents, sorted by dataModel.
+    """
+    match = {"versionKey": {"$type": "string"}}
+    if subject is not None:
+        match["subject"] = subject
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"versionKey": -1}},
+        {"$group": {"_id": "$dataModel", "document": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$document"}},
+        {"$sort": {"dataModel": 1}},
+    ]
+    return list(collection.aggregate(pipeline))
+
+
+def versions_between(collection, lowest: str = None, highest: str = None, projection: dict = None) -> list:
+    """
+    Return the datamodels whose version is in [lowest, highest] (either bound can be None), lowest version first.
+
+    Raises:
+    ValueError: If a bound is not a version.
+    """
+    bounds = {"$gte": lowest, "$lte": highest}
+    query = {}
+    for operator, bound in bounds.items():
+        if bound is None:
+            continue
+        key = version_key(bound)
+        if key is None:
+            raise ValueError(f"{bound!r} is not a version")
+        # the upper bound includes the pre-releases and the release itself
+        query[operator] = key if operator == "$gte" else key.rstrip("~") + "~"
+    return list(collection.find({"versionKey": query or {"$type": "string"}}, projection).sort("versionKey", 1))
+
+
+def major_bumps(collection, major: int = 1, since=None, projection: dict = None) -> list:
+    """
+    Return the datamodels that are at major version `major` or above, optionally only those updated
+    since a date, newest first (the versionMajor, date descending index).
+    """
+    query = {"versionMajor": {"$gte": major}}
+    if since is not None:
+        query["date"] = {"$gte": to_datetime(since)}
+    return list(collection.find(query, projection).sort([("versionMajor", 1), ("date", -1)]))
+
+
 ########################################################################
 #                          insert data in MongoDB                      #
 ########################################################################
 
-def insert_data_mongodb(path_to_data: str, collection):
+def iter_json_documents(path_to_data: str, buffer_size: int = 1 << 16):
+    """
+    Parse a JSON export incrementally and yield its documents one by one.
+
+    The file is either an array of documents (e.g. versions.json) or a single document. Only one
+    buffer of `buffer_size` characters and the document being parsed are held in memory, whatever
+    the size of the file.
+
+    Parameters:
+    - path_to_data (str): The path to the JSON file.
+    - buffer_size (int): The number of characters read at once.
+
+    Returns:
+    - iterator: The documents (dicts) of the file.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = " \t\n\r,"
+
+    with open(path_to_data, "r", encoding="utf-8") as file:
+        buffer = file.read(buffer_size)
+        eof = len(buffer) < buffer_size
+        position = len(buffer) - len(buffer.lstrip())
+
+        if buffer[position:position + 1] != "[":
+            # a single document
+            document = json.loads(buffer + file.read())
+            if document:
+                yield document
+            return
+        position += 1
+
+        while True:
+            while position < len(buffer) and buffer[position] in whitespace:
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            try:
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Buffer exhausted", buffer, position)
+                document, end = decoder.raw_decode(buffer, position)
+                # a value ending exactly at the end of the buffer could be truncated (e.g. a number)
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                # read more and parse the same document again
+                chunk = file.read(buffer_size)
+                eof = len(chunk) < buffer_size
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+
+            yield document
+            position = end
+            if position > buffer_size:
+                buffer, position = buffer[position:], 0
+
+
+def clean_document(document: dict, keep_ids: bool = False) -> dict:
+    """
+    Strip the exported `_id` of a document, or convert it (and any other extended JSON such as $oid
+    or $date) to BSON types if the ids are kept. String dates are converted to datetimes and the
+    version keys are added.
+    """
+    if keep_ids:
+        from bson import json_util
+
+        document = json_util.loads(json.dumps(document))
+    else:
+        document.pop("_id", None)
+    for field in DATE_FIELDS:
+        if isinstance(document.get(field), (str, datetime)):
+            document[field] = to_datetime(document[field])
+    document.update(version_fields(document.get("version")))
+    return document
+
+
+@metrics.timed_stage("load")
+def load_versions(path_to_data: str, collection, chunk_size: int = 1000, keep_ids: bool = False) -> dict:
+    """
+    Stream a versions export into the collection with idempotent upserts.
+
+    The documents are parsed one by one and written in chunks of `chunk_size` unordered bulk upserts
+    keyed on (subject, dataModel), so a reload updates the existing documents instead of duplicating
+    them, and the memory use does not depend on the size of the file.
+
+    Parameters:
+    - path_to_data (str): The path to the JSON file (e.g. versions.json, with or without `_id`).
+    - collection (object): The MongoDB collection to load the data into.
+    - chunk_size (int): The number of documents sent per bulk write.
+    - keep_ids (bool): Keep the exported `_id` (converted from `{"$oid": ...}`) for new documents.
+
+    Returns:
+    - dict: The counts of "read", "inserted", "updated", "unchanged" and "skipped" documents.
+    """
+    from pymongo import UpdateOne
+
+    counts = {"read": 0, "inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    operations = []
+
+    def flush():
+        result = collection.bulk_write(operations, ordered=False)
+        counts["inserted"] += result.upserted_count
+        counts["updated"] += result.modified_count
+        counts["unchanged"] += result.matched_count - result.modified_count
+        operations.clear()
+
+    for document in iter_json_documents(path_to_data):
+        counts["read"] += 1
+        if not isinstance(document, dict) or "subject" not in document or "dataModel" not in document:
+            counts["skipped"] += 1
+            continue
+
+        document = clean_document(document, keep_ids)
+        update = {"$set": {key: value for key, value in document.items() if key != "_id"}}
+        if "_id" in document:
+            update["$setOnInsert"] = {"_id": document["_id"]}
+        operations.append(UpdateOne({"subject": document["subject"], "dataModel": document["dataModel"]}, update, upsert=True))
+
+        if len(operations) >= chunk_size:
+            flush()
+
+    if operations:
+        flush()
+
+    return counts
+
+
+def insert_data_mongodb(path_to_data: str, collection, chunk_size: int = 1000):
     """
     Insert data in MongoDB collection.
 
-    This function takes a JSON file path and a MongoDB collection as input and inserts the data into the collection. 
-    If the data is a single document, it uses the `insert_one` method; otherwise, it uses the `insert_many` method.
+    This function takes a JSON file path and a MongoDB collection as input and loads the data into the collection 
+    with load_versions: the file is streamed and the documents are upserted on (subject, dataModel), so running it 
+    twice does not duplicate the collection.
 
     Parameters:
     - path_to_data (str): The path to the JSON file containing the data to be inserted.
     - collection (object): The MongoDB collection to insert the data into.
+    - chunk_size (int): The number of documents sent per bulk write.
 
     Returns:
-    - None
-    """
-    # Load data from versions.json
-    with open(path_to_data, "r") as file:
-        data = json.load(file)
-
-    # Check if the data is a list and not empty
-    if isinstance(data, list) and data:
-        # Insert data into the MongoDB collection
-        if len(data) == 1:
-            result = collection.insert_one(data[0])
-            print("Document inserted with the following ID:", result.inserted_id)
-        else:
-            result = collection.insert_many(data)
-            print("Documents inserted with the following IDs:", result.inserted_ids)
-    else:
+    - dict: The counts returned by load_versions.
+    """
+    counts = load_versions(path_to_data, collection, chunk_size=chunk_size)
+    if counts["read"] == 0:
         print("Data is not a non-empty list")
+    else:
+        print(
+            f"Documents read: {counts['read']}, inserted: {counts['inserted']}, updated: {counts['updated']}, "
+            f"unchanged: {counts['unchanged']}, skipped: {counts['skipped']}"
+        )
+    return counts
 
 
 ########################################################################
@@ -97,7 +637,9 @@ def repopulate_database(repo_name, data_path, access_token):
     Returns:
     None
     """
-    g = Github(access_token)
+    from db_versions.utils.github_client import github_client
+
+    g = github_client(access_token)
 
     # Get the repository
     repo = g.get_repo(repo_name)
@@ -141,25 +683,3 @@ def repopulate_database(repo_name, data_path, access_token):
 #personal_access_token = os.getenv("PAT")
 
 #repopulate_database(repo_name, data_path, personal_access_token)
-
-
-########################################################################
-#                             running code                             #
-########################################################################
-
-# Connection parameters
-# MongoDB connection parameters - env variables 
-mongo_host = os.getenv("MONGO_HOST")
-mongo_port = int(os.getenv("MONGO_PORT"))
-
-# Database and collection names
-mongo_db_name = os.getenv("MONGO_DB_NAME")
-mongo_collection_name = os.getenv("MONGO_COLLECTION_NAME")
-
-# Connect to Mongodb and get the collection to insert the data to
-collection = connect_to_mongodb(mongo_host, mongo_port, mongo_db_name, mongo_collection_name)
-
-# Path to the json file that will be inserted in the mongodb collection  
-data_path = "db_versions/db_versions/data/versions_db.json"
-
-insert_data_mongodb(path_to_data=data_path, collection=collection)
@@ -0,0 +1,333 @@
+import asyncio
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Mapping, Union
+from urllib.parse import urlsplit
+
+from db_versions.utils import metrics
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows, the budget is then per process
+    fcntl = None
+
+
+########################################################################
+#                        GitHub rate-limit governor                    #
+########################################################################
+
+# GitHub reports the state of the rate limit on every API response:
+#   X-RateLimit-Limit / X-RateLimit-Remaining / X-RateLimit-Reset  (primary limit, 5,000 requests/hour)
+#   Retry-After                                                    (secondary limits, on 403/429)
+# The governor reads these headers from the responses that were made anyway, instead of probing
+# /rate_limit before every call. Requests go out as fast as they are made while the remaining budget
+# covers what the current request rate would spend over the next `horizon` seconds (or until the
+# reset, if sooner). Once it does not, the following requests of the window are spaced so that the
+# rest of the budget lasts until the reset, instead of being spent at once and then waiting for the
+# whole window.
+# Conditional requests (If-None-Match / If-Modified-Since, see github_client) reserve no budget:
+# a `304 Not Modified` answer does not count against the limit. Neither do the GraphQL queries
+# (see graphql), which are charged to a budget of points of their own.
+
+# The request rate is averaged over a fraction of the horizon, so that a burst shows in it quickly
+RATE_WINDOWS = 6
+
+
+class RateLimitGovernor:
+    """
+    A rate-limit budget shared by every thread and asyncio task of the process, and by every process
+    using the same `state_path`.
+
+    The request rate is an exponentially weighted average over the last seconds. When the budget
+    would not cover the projected spend, requests are paced with a generic cell rate algorithm: the
+    interval between two requests is the time left until the reset divided by the remaining budget,
+    and up to `burst` requests may go out back to back before pacing kicks in.
+    """
+
+    def __init__(self, state_path: str = None, security_margin: int = 2, burst: int = 10, horizon: float = 60.0):
+        """
+        Args:
+        state_path (str): A file in which the budget is shared between processes. Process-local if None.
+        security_margin (int): The number of requests that are never spent before the reset.
+        burst (int): The number of requests allowed back to back once pacing kicked in.
+        horizon (float): The time over which the spend is projected at the current rate, in seconds.
+        """
+        self.state_path = state_path
+        self.security_margin = security_margin
+        self.burst = burst
+        self.horizon = horizon
+        self._lock = threading.Lock()
+        self._state = self._empty_state()
+
+    @staticmethod
+    def _empty_state() -> dict:
+        # remaining/limit/reset as last reported by GitHub (None until the first response),
+        # tat: the theoretical arrival time of the next request, blocked_until: secondary limit end,
+        # rate: the recent requests per second, as of rate_at, paced_until: the reset of the window
+        # in which pacing kicked in
+        return {
+            "remaining": None, "limit": None, "reset": 0.0, "tat": 0.0, "blocked_until": 0.0,
+            "rate": 0.0, "rate_at": 0.0, "paced_until": 0.0,
+        }
+
+    ########################################################################
+    #                              shared state                            #
+    ########################################################################
+
+    @contextmanager
+    def _locked_state(self):
+        """
+        Hold the budget for reading and updating, across threads and (with a state file) processes.
+        """
+        with self._lock:
+            if self.state_path is None or fcntl is None:
+                yield self._state
+                return
+
+            with open(self.state_path, "a+") as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    file.seek(0)
+                    content = file.read()
+                    state = self._empty_state()
+                    if content:
+                        state.update(json.loads(content))
+                    yield state
+                    file.seek(0)
+                    file.truncate()
+                    file.write(json.dumps(state))
+                    file.flush()
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    ########################################################################
+    #                        reading response headers                      #
+    ########################################################################
+
+    def observe(self, headers: Mapping[str, str], status_code: int = None):
+        """
+        Update the budget from the headers of a GitHub API response.
+
+        Args:
+        headers (Mapping): The response headers (case-insensitive mapping or lower-case keys).
+        status_code (int): The status code of the response, used to detect secondary limits.
+        """
+        headers = {key.lower(): value for key, value in headers.items()}
+        now = time.time()
+        if headers.get("x-ratelimit-resource", "core") != "core":
+            # the GraphQL and search APIs have budgets of their own, which must not overwrite this one
+            headers = {key: value for key, value in headers.items() if not key.startswith("x-ratelimit-")}
+
+        with self._locked_state() as state:
+            if "x-ratelimit-remaining" in headers and "x-ratelimit-reset" in headers:
+                remaining = int(headers["x-ratelimit-remaining"])
+                reset = float(headers["x-ratelimit-reset"])
+                if reset > state["reset"] or state["remaining"] is None:
+                    # a new window started
+                    state["remaining"], state["reset"] = remaining, reset
+                elif reset == state["reset"]:
+                    # responses of concurrent requests can arrive out of order
+                    state["remaining"] = min(state["remaining"], remaining)
+                if "x-ratelimit-limit" in headers:
+                    state["limit"] = int(headers["x-ratelimit-limit"])
+
+            if status_code in (403, 429):
+                retry_at = _retry_after(headers.get("retry-after"), now)
+                if retry_at is not None:
+                    state["blocked_until"] = max(state["blocked_until"], retry_at)
+                elif state["remaining"] == 0:
+                    state["blocked_until"] = max(state["blocked_until"], state["reset"] + 1)
+
+    ########################################################################
+    #                            pacing requests                           #
+    ########################################################################
+
+    def _count_request(self, state: dict, at: float):
+        """
+        Add one request to the recent rate (requests per second, decayed over horizon / RATE_WINDOWS).
+        """
+        elapsed = max(0.0, at - state["rate_at"])
+        tau = self.horizon / RATE_WINDOWS
+        state["rate"] = state["rate"] * math.exp(-elapsed / tau) + 1 / tau
+        state["rate_at"] = at
+
+    def _reserve(self, reserve: bool = True) -> float:
+        """
+        Reserve the budget for one request and return how long to wait before sending it.
+        With reserve=False (a conditional request or a GraphQL query), only a secondary limit delays it.
+        """
+        now = time.time()
+        with self._locked_state() as state:
+            start = max(now, state["blocked_until"])
+            if not reserve:
+                return start - now
+
+            self._count_request(state, start)
+            if state["remaining"] is None or state["reset"] <= start:
+                # nothing known about the current window yet
+                return start - now
+
+            usable = state["remaining"] - self.security_margin
+            if usable <= 0:
+                # the budget is spent: the next request goes out after the reset (+1 second as a buffer)
+                state["tat"] = state["reset"] + 1
+                return state["reset"] + 1 - now
+            state["remaining"] -= 1
+
+            left = state["reset"] - start
+            if state["paced_until"] != state["reset"]:
+                if usable > state["rate"] * min(left, self.horizon):
+                    # the budget outlasts the projected spend: no pacing
+                    state["tat"] = start
+                    return start - now
+                # paced requests lower the rate, so pacing lasts until the reset once it kicked in
+                state["paced_until"] = state["reset"]
+
+            interval = left / usable
+            tat = max(state["tat"], start)
+            wait = max(start, tat - self.burst * interval) - now
+            state["tat"] = tat + interval
+            return max(0.0, wait)
+
+    def acquire(self, reserve: bool = True):
+        """
+        Block the current thread until a request can be sent.
+
+        Args:
+        reserve (bool): Spend one request of the budget. False for conditional requests, whose
+            `304 Not Modified` answers are free, and for GraphQL queries.
+        """
+        wait = self._reserve(reserve)
+        if wait > 0:
+            metrics.inc("db_versions_rate_limit_waits_total")
+            metrics.inc("db_versions_rate_limit_wait_seconds_total", wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, reserve: bool = True):
+        """
+        Wait, without blocking the event loop, until a request can be sent (see acquire).
+        """
+        wait = self._reserve(reserve)
+        if wait > 0:
+            metrics.inc("db_versions_rate_limit_waits_total")
+            metrics.inc("db_versions_rate_limit_wait_seconds_total", wait)
+            await asyncio.sleep(wait)
+
+    def status(self) -> dict:
+        """
+        Return a copy of the current budget (remaining, limit, reset, ...).
+        """
+        with self._locked_state() as state:
+            return dict(state)
+
+
+def _uses_core_budget(request) -> bool:
+    """
+    Check if a request is charged to the REST budget: not a conditional request, whose
+    `304 Not Modified` answer is free, nor a GraphQL query.
+    """
+    if "If-None-Match" in request.headers or "If-Modified-Since" in request.headers:
+        return False
+    return not urlsplit(request.url).path.rstrip("/").endswith("/graphql")
+
+
+def _retry_after(value: Union[str, None], now: float) -> Union[float, None]:
+    """
+    Return the time until which a Retry-After header (seconds or an HTTP date) blocks the requests.
+    """
+    if not value:
+        return None
+    try:
+        return now + float(value)
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+########################################################################
+#                           default governor                           #
+########################################################################
+
+_default_governor = None
+_default_governor_lock = threading.Lock()
+
+
+def default_governor() -> RateLimitGovernor:
+    """
+    Return the governor shared by the whole process. Set the env variable GITHUB_RATE_STATE to a file
+    path to also share the budget with other processes.
+    """
+    global _default_governor
+    if _default_governor is None:
+        with _default_governor_lock:
+            if _default_governor is None:
+                _default_governor = RateLimitGovernor(state_path=os.getenv("GITHUB_RATE_STATE"))
+    return _default_governor
+
+
+@functools.lru_cache(maxsize=None)
+def _governed_adapter_class():
+    """
+    Build the requests adapter class on first use, since it subclasses a requests class.
+    """
+    from requests.adapters import HTTPAdapter
+
+    class GovernedAdapter(HTTPAdapter):
+        """
+        A requests transport adapter that waits for the governor before each request, feeds it the
+        rate-limit headers of each response and retries once after a secondary limit.
+        """
+
+        def __init__(self, governor: Union[RateLimitGovernor, None] = None, **kwargs):
+            self.governor = governor or default_governor()
+            super().__init__(**kwargs)
+
+        def send(self, request, **kwargs):
+            reserve = _uses_core_budget(request)
+            for attempt in range(2):
+                self.governor.acquire(reserve=reserve)
+                if metrics.registry() is None:
+                    response = super().send(request, **kwargs)
+                else:
+                    response = self._instrumented_send(request, **kwargs)
+                self.governor.observe(response.headers, response.status_code)
+                if response.status_code not in (403, 429) or "Retry-After" not in response.headers or attempt:
+                    return response
+                response.close()
+            return response
+
+        def _instrumented_send(self, request, **kwargs):
+            start = time.perf_counter()
+            response = super().send(request, **kwargs)
+            metrics.observe("db_versions_http_request_seconds", time.perf_counter() - start, method=request.method)
+            metrics.inc("db_versions_http_requests_total", method=request.method, status=response.status_code)
+            if kwargs.get("stream"):
+                size = int(response.headers.get("Content-Length") or 0)
+            else:
+                # the body is read here instead of by the session, it is not read twice
+                size = len(response.content)
+            metrics.inc("db_versions_http_response_bytes_total", size)
+            return response
+
+    return GovernedAdapter
+
+
+def governed_adapter(governor: RateLimitGovernor = None, **adapter_options):
+    """
+    Create a requests HTTPAdapter that paces its requests with a governor (the default one if None).
+
+    Args:
+    governor (RateLimitGovernor): The governor to use.
+    **adapter_options: Options of requests.adapters.HTTPAdapter (pool_connections, pool_maxsize, max_retries).
+    """
+    return _governed_adapter_class()(governor, **adapter_options)
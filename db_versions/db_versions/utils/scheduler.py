@@ -0,0 +1,318 @@
+import heapq
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from db_versions.utils import cache_path
+from db_versions.utils.crawler import GITHUB_ORG
+
+
+########################################################################
+#                     checkpointed full-sweep scheduler                #
+########################################################################
+
+# A full sweep runs last_commit_date_url, extract_commit_data and check_version_and_update for every
+# datamodel and takes hours. The scheduler splits it into tasks (one per datamodel, or one per
+# subject), runs them on a thread or process pool, retries the failed ones with an exponential
+# backoff, and writes the state of every task (pending, done, failed) to a SQLite file or a MongoDB
+# collection as soon as it finishes. A run started again with `resume` only does the remaining work.
+#
+# A task is identified by its run name, subject and datamodel ("*" for a whole subject).
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+SUBJECT_TASK = "*"
+
+DEFAULT_RUN_NAME = "sweep"
+
+
+########################################################################
+#                              task stores                             #
+########################################################################
+
+class SqliteTaskStore:
+    """
+    The task states of the sweeps in a local SQLite file.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " run TEXT NOT NULL, subject TEXT NOT NULL, datamodel TEXT NOT NULL, state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, status TEXT, error TEXT, updated REAL NOT NULL,"
+            " PRIMARY KEY (run, subject, datamodel))"
+        )
+
+    def add(self, run: str, keys: Iterable[Tuple[str, str]], resume: bool = False):
+        """
+        Register the tasks of a run as pending. With resume, the tasks that are already done stay
+        done and the failed ones are tried again; without it every task starts over.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN")
+            if not resume:
+                self._connection.execute("DELETE FROM tasks WHERE run = ?", (run,))
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO tasks (run, subject, datamodel, state, updated) VALUES (?, ?, ?, ?, ?)",
+                [(run, subject, datamodel, PENDING, now) for subject, datamodel in keys],
+            )
+            self._connection.execute(
+                "UPDATE tasks SET state = ?, attempts = 0 WHERE run = ? AND state = ?", (PENDING, run, FAILED)
+            )
+            self._connection.execute("COMMIT")
+
+    def pending(self, run: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT subject, datamodel FROM tasks WHERE run = ? AND state = ? ORDER BY subject, datamodel", (run, PENDING)
+            ).fetchall()
+
+    def update(self, run: str, key: Tuple[str, str], state: str, attempts: int, status: str = None, error: str = None):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE tasks SET state = ?, attempts = ?, status = ?, error = ?, updated = ?"
+                " WHERE run = ? AND subject = ? AND datamodel = ?",
+                (state, attempts, status, error, time.time(), run, key[0], key[1]),
+            )
+
+    def counts(self, run: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute("SELECT state, COUNT(*) FROM tasks WHERE run = ? GROUP BY state", (run,))
+            return {PENDING: 0, DONE: 0, FAILED: 0, **dict(rows.fetchall())}
+
+    def failures(self, run: str) -> List[Tuple[str, str, str]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT subject, datamodel, error FROM tasks WHERE run = ? AND state = ?", (run, FAILED)
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class MongoTaskStore:
+    """
+    The task states of the sweeps in a MongoDB collection, e.g. to share them between machines.
+    """
+
+    def __init__(self, collection):
+        from pymongo import ASCENDING
+
+        self.collection = collection
+        collection.create_index(
+            [("run", ASCENDING), ("subject", ASCENDING), ("datamodel", ASCENDING)], name="run_1_subject_1_datamodel_1", unique=True
+        )
+
+    def add(self, run: str, keys: Iterable[Tuple[str, str]], resume: bool = False):
+        from pymongo import UpdateOne
+
+        now = datetime.now(timezone.utc)
+        if not resume:
+            self.collection.delete_many({"run": run})
+        operations = [
+            UpdateOne(
+                {"run": run, "subject": subject, "datamodel": datamodel},
+                {"$setOnInsert": {"state": PENDING, "attempts": 0, "updated": now}},
+                upsert=True,
+            )
+            for subject, datamodel in keys
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self.collection.update_many({"run": run, "state": FAILED}, {"$set": {"state": PENDING, "attempts": 0}})
+
+    def pending(self, run: str) -> List[Tuple[str, str]]:
+        cursor = self.collection.find({"run": run, "state": PENDING}, {"_id": 0, "subject": 1, "datamodel": 1})
+        return sorted((doc["subject"], doc["datamodel"]) for doc in cursor)
+
+    def update(self, run: str, key: Tuple[str, str], state: str, attempts: int, status: str = None, error: str = None):
+        self.collection.update_one(
+            {"run": run, "subject": key[0], "datamodel": key[1]},
+            {"$set": {"state": state, "attempts": attempts, "status": status, "error": error, "updated": datetime.now(timezone.utc)}},
+        )
+
+    def counts(self, run: str) -> Dict[str, int]:
+        pipeline = [{"$match": {"run": run}}, {"$group": {"_id": "$state", "count": {"$sum": 1}}}]
+        return {PENDING: 0, DONE: 0, FAILED: 0, **{group["_id"]: group["count"] for group in self.collection.aggregate(pipeline)}}
+
+    def failures(self, run: str) -> List[Tuple[str, str, str]]:
+        cursor = self.collection.find({"run": run, "state": FAILED}, {"_id": 0, "subject": 1, "datamodel": 1, "error": 1})
+        return [(doc["subject"], doc["datamodel"], doc.get("error")) for doc in cursor]
+
+    def close(self):
+        pass
+
+
+def default_state_path() -> str:
+    """
+    Return the SQLite file of the task states: the env variable SWEEP_STATE if set, else
+    db-versions/sweep.sqlite in the user cache directory.
+    """
+    path = os.getenv("SWEEP_STATE")
+    if path:
+        return path
+    return cache_path("sweep.sqlite")
+
+
+########################################################################
+#                               scheduler                              #
+########################################################################
+
+class SweepScheduler:
+    """
+    Run the tasks of a sweep on a pool, with retries, recording the state of each task in a store.
+
+    The work function is called as work(subject, datamodel) in a worker and returns a status string;
+    any exception counts as a failure. A failed task is submitted again after
+    backoff * 2 ** (attempts - 1) seconds (with jitter, at most max_backoff) while the other tasks
+    keep the workers busy, and is marked failed after max_attempts.
+    """
+
+    def __init__(self, store, work: Callable[[str, str], str], workers: int = 4, executor: str = "thread",
+                 max_attempts: int = 3, backoff: float = 2.0, max_backoff: float = 300.0):
+        """
+        Args:
+        store (SqliteTaskStore or MongoTaskStore): Where the task states are kept.
+        work (callable): The function run for each task. It must be picklable (a module-level
+            function or a functools.partial of one) with the process executor.
+        workers (int): The size of the pool.
+        executor (str): "thread" (the work is mostly I/O) or "process".
+        max_attempts (int): The number of attempts of a task before it is marked failed.
+        backoff (float): The delay before the first retry, in seconds.
+        max_backoff (float): The maximum delay before a retry, in seconds.
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+        self.store = store
+        self.work = work
+        self.workers = workers
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def _delay(self, attempts: int) -> float:
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def run(self, keys: Sequence[Tuple[str, str]], run: str = DEFAULT_RUN_NAME, resume: bool = False,
+            report: Callable[[str, str, str], None] = None) -> Dict[str, int]:
+        """
+        Run every task of a sweep that is not done yet.
+
+        Args:
+        keys (sequence): The (subject, datamodel) pairs of the tasks.
+        run (str): The name of the run in the store.
+        resume (bool): Keep the tasks already done by a previous run of the same name.
+        report (callable): Called as report(subject, datamodel, status) after each finished task.
+
+        Returns:
+        dict: The number of tasks by state at the end of the run.
+        """
+        self.store.add(run, keys, resume=resume)
+        queue = list(self.store.pending(run))
+        attempts = {key: 0 for key in queue}
+        delayed = []  # heap of (time of the retry, key)
+        running = {}
+
+        pool_class = ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor
+        with pool_class(max_workers=self.workers) as pool:
+            while queue or delayed or running:
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now:
+                    queue.append(heapq.heappop(delayed)[1])
+                while queue and len(running) < self.workers:
+                    key = queue.pop(0)
+                    attempts[key] += 1
+                    running[pool.submit(self.work, *key)] = key
+                if not running:
+                    time.sleep(max(0.0, delayed[0][0] - time.monotonic()))
+                    continue
+
+                timeout = max(0.0, delayed[0][0] - time.monotonic()) if delayed else None
+                finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                        if attempts[key] < self.max_attempts:
+                            self.store.update(run, key, PENDING, attempts[key], error=error)
+                            heapq.heappush(delayed, (time.monotonic() + self._delay(attempts[key]), key))
+                        else:
+                            self.store.update(run, key, FAILED, attempts[key], error=error)
+                            if report:
+                                report(key[0], key[1], f"failed after {attempts[key]} attempts: {error}")
+                        continue
+                    self.store.update(run, key, DONE, attempts[key], status=status)
+                    if report:
+                        report(key[0], key[1], status)
+
+        return self.store.counts(run)
+
+
+########################################################################
+#                             sweep tasks                              #
+########################################################################
+
+def sweep_datamodel(
+    mongo_host, mongo_port, db_name, collection_name, access_token, search_string, subject, datamodel, history_collection_name=None
+) -> str:
+    """
+    The task of one datamodel: find the last version commit of its schema.json, read the new
+    version from the commit and reconcile it with the database, and record the commit in the
+    history collection (see utils.history). Request errors are raised so that the task is retried.
+    """
+    from db_versions.main import _record_history, check_version_and_update
+    from db_versions.utils.git_mirror import VersionChange
+    from db_versions.utils.utils import extract_commit_data, last_commit_date_url
+
+    repo_name, file_path = f"{GITHUB_ORG}/{subject}", f"{datamodel}/schema.json"
+    result = last_commit_date_url(file_path, repo_name, access_token, search_string, raise_errors=True)
+    if result is None:
+        return "No commit data found in schema.json"
+    commit_date, commit_url, sha = result
+
+    change = extract_commit_data(repo_name, sha, access_token, search_string, file_path)
+    key = search_string.lstrip("$")
+    version = change[2].get(key) if change else None
+    if version is None:
+        return "No version change found in the commit"
+
+    status = check_version_and_update(
+        mongo_host, mongo_port, db_name, collection_name, subject, datamodel, version, commit_date
+    )
+    transition = VersionChange(subject, datamodel, file_path, sha, commit_date, commit_url, change[1].get(key), version)
+    _record_history(mongo_host, mongo_port, db_name, [transition], history_collection_name)
+    return status
+
+
+def sweep_subject(
+    mongo_host, mongo_port, db_name, collection_name, access_token, search_string, subject, _=SUBJECT_TASK, history_collection_name=None
+) -> str:
+    """
+    The task of a whole subject: sweep_datamodel for each of its datamodels in the collection.
+    """
+    from db_versions.utils.mongodb import connect_to_mongodb
+
+    collection = connect_to_mongodb(mongo_host, mongo_port, db_name, collection_name)
+    statuses = {}
+    for datamodel in sorted(collection.distinct("dataModel", {"subject": subject})):
+        status = sweep_datamodel(
+            mongo_host, mongo_port, db_name, collection_name, access_token, search_string, subject, datamodel, history_collection_name
+        )
+        statuses[status] = statuses.get(status, 0) + 1
+    return ", ".join(f"{count} x {status}" for status, count in sorted(statuses.items()))
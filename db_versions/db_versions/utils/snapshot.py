@@ -0,0 +1,175 @@
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple, Union
+
+from db_versions.utils import metrics
+
+
+########################################################################
+#                    in-memory snapshot of the versions                #
+########################################################################
+
+# A reconcile or a report over every datamodel needs the stored version and date of each of them.
+# The snapshot reads them all with one projected cursor and keeps them in a dict keyed by
+# (subject, dataModel), so that the lookups that follow are made in memory. It is refreshed
+# incrementally from the newest `date` it holds (a range scan on the date index) and the keys
+# written by this process are invalidated explicitly, then read again in one query.
+
+SNAPSHOT_FIELDS = ("subject", "dataModel", "version", "date", "versionKey")
+
+
+class VersionRecord:
+    """
+    The stored version of one datamodel. The subject and dataModel strings are interned, since the
+    same few subjects are repeated across thousands of records.
+    """
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, subject: str, dataModel: str, version: str = None, date: datetime = None, versionKey: str = None):
+        self.subject = sys.intern(subject)
+        self.dataModel = sys.intern(dataModel)
+        self.version = version
+        self.date = date
+        self.versionKey = versionKey
+
+    @classmethod
+    def from_document(cls, document: dict) -> "VersionRecord":
+        return cls(**{field: document.get(field) for field in SNAPSHOT_FIELDS})
+
+    def as_document(self) -> dict:
+        """
+        Return the record as the projected document find_one would return.
+        """
+        return {field: getattr(self, field) for field in SNAPSHOT_FIELDS}
+
+    def __repr__(self):
+        return f"VersionRecord({self.subject!r}, {self.dataModel!r}, {self.version!r}, {self.date!r})"
+
+
+class VersionsSnapshot:
+    """
+    A read-through copy of the versions collection, safe to share between threads.
+    """
+
+    def __init__(self, collection, max_records: int = None):
+        """
+        Args:
+        collection (pymongo.collection.Collection): The versions collection.
+        max_records (int): The maximum number of records kept in memory. Past it, the lookups of the
+            records that were not kept go to the database. Unbounded if None.
+        """
+        self.collection = collection
+        self.max_records = max_records
+        self._records: Dict[Tuple[str, str], VersionRecord] = {}
+        self._stale = set()
+        self._newest = None
+        self._complete = False
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _projection(self) -> dict:
+        projection = {field: 1 for field in SNAPSHOT_FIELDS}
+        projection["_id"] = 0
+        return projection
+
+    def _add(self, documents: Iterable[dict]) -> int:
+        added = 0
+        for document in documents:
+            if "subject" not in document or "dataModel" not in document:
+                continue
+            key = (document["subject"], document["dataModel"])
+            if key not in self._records and self.max_records is not None and len(self._records) >= self.max_records:
+                self._complete = False
+                continue
+            self._records[key] = VersionRecord.from_document(document)
+            date = document.get("date")
+            if isinstance(date, datetime) and (self._newest is None or date > self._newest):
+                self._newest = date
+            added += 1
+        return added
+
+    @metrics.timed_stage("snapshot")
+    def load(self) -> "VersionsSnapshot":
+        """
+        (Re)load every record with one cursor.
+        """
+        with self._lock:
+            self._records, self._stale, self._newest, self._complete = {}, set(), None, True
+            self._add(self.collection.find({}, self._projection()))
+            self._loaded = True
+        return self
+
+    @metrics.timed_stage("snapshot")
+    def refresh(self) -> int:
+        """
+        Read the records dated on or after the newest date of the snapshot, and the invalidated ones,
+        with at most two queries.
+
+        Returns:
+        int: The number of records read.
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+                return len(self._records)
+            read = 0
+            if self._newest is not None:
+                read += self._add(self.collection.find({"date": {"$gte": self._newest}}, self._projection()))
+            if self._stale:
+                stale, self._stale = self._stale, set()
+                for key in stale:
+                    self._records.pop(key, None)
+                query = {"$or": [{"subject": subject, "dataModel": datamodel} for subject, datamodel in stale]}
+                read += self._add(self.collection.find(query, self._projection()))
+            return read
+
+    def invalidate(self, keys: Iterable[Tuple[str, str]] = None):
+        """
+        Mark records as changed in the database (after a write) so that they are read again before
+        their next lookup. Every record is dropped, and reloaded on the next lookup, if keys is None.
+        """
+        with self._lock:
+            if keys is None:
+                self._records, self._stale, self._newest, self._loaded = {}, set(), None, False
+            else:
+                self._stale.update(keys)
+
+    def get(self, subject: str, datamodel: str) -> Union[VersionRecord, None]:
+        """
+        Return the record of a datamodel, or None if it is not in the collection.
+        """
+        return self.documents([(subject, datamodel)]).get((subject, datamodel))
+
+    def documents(self, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], VersionRecord]:
+        """
+        Return the records of many datamodels by (subject, dataModel), leaving out the ones not in
+        the collection. Only the invalidated records, and the ones past max_records, are read from
+        the database, in one query.
+        """
+        keys = set(keys)
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            if self._stale & keys:
+                self.refresh()
+            found = {key: self._records[key] for key in keys if key in self._records}
+            missing = keys - set(found)
+            if missing and not self._complete:
+                query = {"$or": [{"subject": subject, "dataModel": datamodel} for subject, datamodel in missing]}
+                for document in self.collection.find(query, self._projection()):
+                    record = VersionRecord.from_document(document)
+                    found[(record.subject, record.dataModel)] = record
+            return found
+
+    def records(self) -> List[VersionRecord]:
+        """
+        Return every record of the snapshot, e.g. for a report.
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            return list(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
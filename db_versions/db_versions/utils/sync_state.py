@@ -0,0 +1,174 @@
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, NamedTuple, Tuple, Union
+
+from db_versions.utils.mongodb import connect_to_mongodb
+
+
+########################################################################
+#                      per-repository sync watermarks                  #
+########################################################################
+
+# The sync-state collection remembers, per subject and per schema.json path, the newest commit
+# that was already processed. The next run only asks GitHub for the commits after it (`since=`),
+# so a daily run costs as much as the day's changes instead of the whole history of the repository.
+#
+# Example of a document:
+#   {"subject": "dataModel.Environment", "path": "AirQualityObserved/schema.json",
+#    "sha": "8f4639f0...", "date": datetime(2023, 10, 15, 8, 30), "updated": datetime(...),
+#    "blob": "3b18e512..."}
+#
+# `blob` is the blob SHA of the file in the repository tree at the last run (see utils.tree_diff);
+# a document can hold a watermark, a blob or both.
+
+DEFAULT_SYNC_COLLECTION_NAME = "sync_state"
+
+
+class Watermark(NamedTuple):
+    """
+    The newest processed commit of a file: its sha and its committer date (what `since=` filters on).
+    """
+    sha: str
+    date: datetime
+
+
+def sync_state_collection(mongo_host, mongo_port, mongo_db_name, collection_name: str = None):
+    """
+    Get the sync-state collection and create its unique (subject, path) index once per process.
+
+    Args:
+    mongo_host (str): The host address of the MongoDB instance.
+    mongo_port (int): The port number of the MongoDB instance.
+    mongo_db_name (str): The name of the database.
+    collection_name (str): The name of the collection, MONGO_SYNC_COLLECTION_NAME or "sync_state" if None.
+
+    Returns:
+    pymongo.collection.Collection: The sync-state collection.
+    """
+    collection_name = collection_name or os.getenv("MONGO_SYNC_COLLECTION_NAME", DEFAULT_SYNC_COLLECTION_NAME)
+    return connect_to_mongodb(mongo_host, mongo_port, mongo_db_name, collection_name, create_indexes=create_sync_state_indexes)
+
+
+def create_sync_state_indexes(collection):
+    """
+    Create the unique (subject, path) index of the sync-state collection.
+    """
+    from pymongo import ASCENDING
+
+    collection.create_index([("subject", ASCENDING), ("path", ASCENDING)], name="subject_1_path_1", unique=True)
+
+
+def _as_utc(date: datetime) -> datetime:
+    # pymongo returns naive datetimes in UTC
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def get_watermarks(collection, subject: str = None) -> Dict[Tuple[str, str], Watermark]:
+    """
+    Load the watermarks of every file (or of every file of one subject) with one query.
+
+    Returns:
+    dict: Watermark by (subject, path).
+    """
+    query = {"sha": {"$exists": True}}
+    if subject is not None:
+        query["subject"] = subject
+    projection = {"_id": 0, "subject": 1, "path": 1, "sha": 1, "date": 1}
+    return {
+        (doc["subject"], doc["path"]): Watermark(doc["sha"], _as_utc(doc["date"]))
+        for doc in collection.find(query, projection)
+    }
+
+
+def get_watermark(collection, subject: str, path: str) -> Union[Watermark, None]:
+    """
+    Return the watermark of one file, or None if it was never synced.
+    """
+    doc = collection.find_one({"subject": subject, "path": path, "sha": {"$exists": True}}, {"_id": 0, "sha": 1, "date": 1})
+    return Watermark(doc["sha"], _as_utc(doc["date"])) if doc else None
+
+
+def set_watermarks(collection, watermarks: Iterable[Tuple[str, str, Watermark]]) -> int:
+    """
+    Store new watermarks with one unordered bulk upsert.
+
+    Args:
+    collection (pymongo.collection.Collection): The sync-state collection.
+    watermarks (iterable): (subject, path, Watermark) tuples.
+
+    Returns:
+    int: The number of watermarks written.
+    """
+    from pymongo import UpdateOne
+
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {"subject": subject, "path": path},
+            {"$set": {"sha": watermark.sha, "date": watermark.date, "updated": now}},
+            upsert=True,
+        )
+        for subject, path, watermark in watermarks
+    ]
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def get_blobs(collection, subject: str = None) -> Dict[Tuple[str, str], str]:
+    """
+    Load the blob SHAs seen at the last run, of every file or of every file of one subject.
+
+    Returns:
+    dict: Blob SHA by (subject, path).
+    """
+    query = {"blob": {"$exists": True}}
+    if subject is not None:
+        query["subject"] = subject
+    return {
+        (doc["subject"], doc["path"]): doc["blob"]
+        for doc in collection.find(query, {"_id": 0, "subject": 1, "path": 1, "blob": 1})
+    }
+
+
+def set_blobs(collection, subject: str, blobs: Dict[str, str], removed: Iterable[str] = ()) -> int:
+    """
+    Store the blob SHAs of the files of a subject and forget the ones of the removed files, with one
+    unordered bulk write.
+
+    Args:
+    collection (pymongo.collection.Collection): The sync-state collection.
+    subject (str): The subject of the files.
+    blobs (dict): Blob SHA by path.
+    removed (iterable): The paths that are no longer in the repository.
+
+    Returns:
+    int: The number of files written.
+    """
+    from pymongo import UpdateOne
+
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne({"subject": subject, "path": path}, {"$set": {"blob": blob, "updated": now}}, upsert=True)
+        for path, blob in blobs.items()
+    ]
+    operations += [
+        UpdateOne({"subject": subject, "path": path}, {"$unset": {"blob": ""}})
+        for path in removed
+    ]
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def new_commits(commits: Iterable, watermark: Union[Watermark, None], sha=lambda commit: commit["sha"]):
+    """
+    Yield the commits (newest first) that come after a watermark.
+
+    GitHub's `since=` is inclusive, so the watermark commit itself comes back and is dropped here.
+    The walk also stops at the watermark in case the listing was not filtered by date.
+    """
+    for commit in commits:
+        if watermark is not None and sha(commit) == watermark.sha:
+            return
+        yield commit
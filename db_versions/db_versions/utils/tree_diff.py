@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, NamedTuple, Set, Tuple
+
+
+########################################################################
+#                     tree-SHA change detection                        #
+########################################################################
+
+# GitHub's recursive git-tree endpoint (/repos/{owner}/{repo}/git/trees/{ref}?recursive=1) lists
+# every path of a repository with the SHA of its blob in one request. The blob SHA of a file only
+# changes when its content changes, so comparing the blob SHAs of the */schema.json files with the
+# ones seen at the previous run tells which datamodels changed without walking any commit history:
+# one call per repository, and only the changed files go on to the commit and version extraction.
+
+
+class TreeChanges(NamedTuple):
+    """
+    The schema.json paths of a repository that were added, modified or removed since the previous
+    run, and the blob SHA of every current schema.json (path -> sha), to be stored for the next run.
+    """
+    added: Set[str]
+    modified: Set[str]
+    removed: Set[str]
+    blobs: Dict[str, str]
+
+    @property
+    def changed(self) -> Set[str]:
+        """
+        The paths whose commits have to be looked at (added or modified).
+        """
+        return self.added | self.modified
+
+
+def is_schema_path(path: str) -> bool:
+    """
+    Check if a path is the schema.json of a datamodel folder, e.g. "AirQualityObserved/schema.json".
+    """
+    parts = path.split("/")
+    return len(parts) == 2 and parts[1] == "schema.json"
+
+
+def schema_blobs(tree: dict) -> Tuple[Dict[str, str], bool]:
+    """
+    Read the schema.json blobs of a recursive tree (raw data of the git trees API).
+
+    Returns:
+    tuple: The blob SHA by path, and whether GitHub truncated the listing (very large repositories).
+    """
+    blobs = {
+        entry["path"]: entry["sha"]
+        for entry in tree.get("tree", [])
+        if entry.get("type") == "blob" and is_schema_path(entry.get("path", ""))
+    }
+    return blobs, bool(tree.get("truncated"))
+
+
+def compare_blobs(previous: Dict[str, str], current: Dict[str, str], truncated: bool = False) -> TreeChanges:
+    """
+    Compare the blob SHAs of the previous run with the current ones.
+
+    Args:
+    previous (dict): The stored blob SHA by path (empty for a repository never seen before).
+    current (dict): The current blob SHA by path, as returned by schema_blobs.
+    truncated (bool): The current listing is incomplete, so a path missing from it is not taken as removed.
+
+    Returns:
+    TreeChanges: The added, modified and removed paths.
+    """
+    previous_paths, current_paths = set(previous), set(current)
+    common = previous_paths & current_paths
+    return TreeChanges(
+        added=current_paths - previous_paths,
+        modified={path for path in common if previous[path] != current[path]},
+        removed=set() if truncated else previous_paths - current_paths,
+        blobs=current,
+    )
+
+
+def changed_datamodels(changes: TreeChanges, datamodels: Iterable[str] = None) -> Set[str]:
+    """
+    Return the datamodel folders of the changed schema.json paths, optionally only those in `datamodels`.
+    """
+    found = {path.split("/")[0] for path in changes.changed}
+    return found if datamodels is None else found & set(datamodels)
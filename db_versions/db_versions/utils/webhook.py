@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import hmac
+import json
+from collections import OrderedDict
+from http import HTTPStatus
+from typing import Callable, Dict, List, Tuple, Union
+from urllib.parse import parse_qs
+
+from db_versions.utils.crawler import GITHUB_ORG
+from db_versions.utils.tree_diff import is_schema_path
+
+
+########################################################################
+#                         GitHub push webhooks                         #
+########################################################################
+
+# A push event lists every commit of the push with the paths it added, modified and removed, so the
+# datamodels whose schema.json changed are known without any API call. Only these commits are then
+# fetched to read the new $schemaVersion (see main.reconcile_commits). Every delivery is signed with
+# the secret of the webhook: X-Hub-Signature-256 is "sha256=" + the HMAC-SHA256 of the raw body.
+#
+# Pushes come in bursts (a merge, a script updating many repositories), so the touched datamodels
+# are queued and deduplicated, and processed together once no push came for `debounce` seconds
+# (or at the latest `max_delay` seconds after the first one).
+
+SIGNATURE_HEADER = "x-hub-signature-256"
+
+# GitHub caps the payloads at 25 MB
+MAX_BODY_BYTES = 25 * 1024 * 1024
+
+# The deliveries remembered to ignore redeliveries of the same event
+MAX_DELIVERIES = 1000
+
+
+def verify_signature(secret: Union[str, bytes], body: bytes, signature: str) -> bool:
+    """
+    Check the X-Hub-Signature-256 header of a webhook delivery against its raw body.
+    """
+    if not signature or not signature.startswith("sha256="):
+        return False
+    if isinstance(secret, str):
+        secret = secret.encode()
+    expected = "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def push_commits(payload: dict, org: str = GITHUB_ORG) -> Dict[Tuple[str, str], List[str]]:
+    """
+    Read the datamodels whose schema.json was added or modified by a push to the default branch.
+
+    Args:
+    payload (dict): The payload of a `push` event.
+    org (str): Only the pushes to the repositories of this organization are read.
+
+    Returns:
+    dict: The SHAs of the commits that touched each (subject, datamodel), newest first.
+    """
+    repository = payload.get("repository") or {}
+    owner = (repository.get("owner") or {}).get("login") or (repository.get("owner") or {}).get("name")
+    if owner != org or payload.get("deleted"):
+        return {}
+    default_branch = repository.get("default_branch")
+    if default_branch and payload.get("ref") != f"refs/heads/{default_branch}":
+        return {}
+
+    subject = repository.get("name")
+    commits = {}
+    # the commits of a push are listed oldest first
+    for commit in reversed(payload.get("commits") or []):
+        for path in (commit.get("added") or []) + (commit.get("modified") or []):
+            if is_schema_path(path):
+                commits.setdefault((subject, path.split("/")[0]), []).append(commit["id"])
+    return commits
+
+
+class PushQueue:
+    """
+    The datamodels waiting to be processed, deduplicated across pushes and processed in one batch
+    once the pushes stop for `debounce` seconds.
+    """
+
+    def __init__(self, process: Callable[[Dict[Tuple[str, str], List[str]]], list], debounce: float = 5.0, max_delay: float = 60.0):
+        """
+        Args:
+        process (callable): Called in a worker thread with the queued {(subject, datamodel): shas}
+            (e.g. main.reconcile_commits), returns the (subject, datamodel, status) results.
+        debounce (float): The quiet period after a push before the queue is processed, in seconds.
+        max_delay (float): The maximum time a datamodel waits in the queue, in seconds.
+        """
+        self.process = process
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._pending: Dict[Tuple[str, str], List[str]] = {}
+        self._first = None
+        self._deadline = None
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, commits: Dict[Tuple[str, str], List[str]], newer: bool = True):
+        """
+        Queue the commits of a push (as returned by push_commits). Must be called from the event loop.
+
+        Args:
+        commits (dict): The SHAs of the commits of each (subject, datamodel), newest first.
+        newer (bool): The commits are newer than the queued ones (False for a batch put back in the queue).
+        """
+        if not commits:
+            return
+        for key, shas in commits.items():
+            # the newest commits come first
+            queued = self._pending.get(key, [])
+            if newer:
+                self._pending[key] = shas + [sha for sha in queued if sha not in shas]
+            else:
+                self._pending[key] = queued + [sha for sha in shas if sha not in queued]
+
+        now = asyncio.get_running_loop().time()
+        if self._first is None:
+            self._first = now
+        self._deadline = min(now + self.debounce, self._first + self.max_delay)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> list:
+        """
+        Process the queued datamodels now. Returns the results of the process function.
+
+        If the processing fails, the batch is put back in the queue to be processed with the next one.
+        """
+        batch, self._pending, self._first, self._deadline = self._pending, {}, None, None
+        if not batch:
+            return []
+        try:
+            results = await asyncio.to_thread(self.process, batch)
+        except Exception as e:
+            print(f"Error: processing {len(batch)} datamodels: {e}")
+            self.add(batch, newer=False)
+            return []
+        for subject, datamodel, status in results:
+            print(f"{subject} / {datamodel}: {status}")
+        return results
+
+    async def run(self):
+        """
+        Process the queue whenever its deadline passes, until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            await self._wakeup.wait()
+            # every push moves the deadline, so it is read again after each sleep
+            while self._deadline is not None and self._deadline > loop.time():
+                await asyncio.sleep(self._deadline - loop.time())
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> "asyncio.Task":
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        """
+        Stop the background task and process what is still queued.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class WebhookReceiver:
+    """
+    A minimal asyncio HTTP server receiving the GitHub webhook deliveries on one path.
+    """
+
+    def __init__(self, secret: Union[str, bytes], queue: PushQueue, path: str = "/webhook", org: str = GITHUB_ORG, timeout: float = 10.0):
+        """
+        Args:
+        secret (str): The secret of the webhook, used to check the signature of every delivery.
+        queue (PushQueue): The queue the touched datamodels are added to.
+        path (str): The path the deliveries are posted to.
+        org (str): The organization whose pushes are read.
+        timeout (float): The time allowed to a client to send its request, in seconds.
+        """
+        if not secret:
+            raise ValueError("A webhook secret is needed to verify the deliveries")
+        self.secret = secret
+        self.queue = queue
+        self.path = path
+        self.org = org
+        self.timeout = timeout
+        self._deliveries = OrderedDict()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            status, message = await asyncio.wait_for(self._receive(reader), self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, KeyError, ValueError, UnicodeDecodeError):
+            status, message = HTTPStatus.BAD_REQUEST, "malformed request"
+
+        body = json.dumps({"message": message}).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _receive(self, reader: asyncio.StreamReader) -> Tuple[HTTPStatus, str]:
+        method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if target.split("?")[0] != self.path:
+            return HTTPStatus.NOT_FOUND, "not found"
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, "only POST is accepted"
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "payload too large"
+        body = await reader.readexactly(length)
+
+        if not verify_signature(self.secret, body, headers.get(SIGNATURE_HEADER)):
+            return HTTPStatus.UNAUTHORIZED, "invalid signature"
+        return self.receive(headers.get("x-github-event"), headers.get("x-github-delivery"), body, headers.get("content-type", ""))
+
+    def receive(self, event: str, delivery: str, body: bytes, content_type: str = "application/json") -> Tuple[HTTPStatus, str]:
+        """
+        Handle a delivery whose signature was checked. Returns the status and message of the answer.
+        """
+        if event == "ping":
+            return HTTPStatus.OK, "pong"
+        if event != "push":
+            return HTTPStatus.OK, f"{event} events are ignored"
+        if delivery and delivery in self._deliveries:
+            return HTTPStatus.OK, "already received"
+
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            body = parse_qs(body.decode()).get("payload", [None])[0]
+            if body is None:
+                return HTTPStatus.BAD_REQUEST, "no payload field in the form"
+        payload = json.loads(body)
+
+        commits = push_commits(payload, self.org)
+        self.queue.add(commits)
+        # only a queued delivery is remembered: a redelivery of a malformed one is handled again.
+        # A queued batch whose processing fails is kept in the queue (see PushQueue.flush).
+        if delivery:
+            self._deliveries[delivery] = True
+            while len(self._deliveries) > MAX_DELIVERIES:
+                self._deliveries.popitem(last=False)
+        return HTTPStatus.ACCEPTED, f"{len(commits)} datamodels queued"
+
+
+def serve_webhooks(secret: str, process: Callable, host: str = "127.0.0.1", port: int = 8080, path: str = "/webhook", debounce: float = 5.0, max_delay: float = 60.0):
+    """
+    Receive the push events until interrupted (Ctrl+C), processing the queue one last time on exit.
+
+    Args:
+    secret (str): The secret of the webhook.
+    process (callable): The function processing the queued datamodels, see PushQueue.
+    host (str): The address to listen on.
+    port (int): The port to listen on.
+    path (str): The path the deliveries are posted to.
+    debounce (float): The quiet period after a push before the queue is processed, in seconds.
+    max_delay (float): The maximum time a datamodel waits in the queue, in seconds.
+    """
+    async def run():
+        queue = PushQueue(process, debounce, max_delay)
+        receiver = WebhookReceiver(secret, queue, path)
+        server = await receiver.start(host, port)
+        queue.start()
+        print(f"Listening for GitHub push events on http://{host}:{port}{path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await queue.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,56 @@
+import itertools
+
+import pytest
+
+from benchmarks import mongo_standin
+from benchmarks.mock_github import MockGithub
+from db_versions.utils import crawler, graphql
+from db_versions.utils.github_client import github_session
+from db_versions.utils.mongodb import connect_to_mongodb
+from db_versions.utils.ratelimit import RateLimitGovernor
+
+_hosts = itertools.count()
+
+
+class Mongo:
+    """
+    The connection arguments of an in-process stand-in of MongoDB (see benchmarks.mongo_standin).
+    """
+
+    def __init__(self):
+        self.host, self.port, self.db = f"test-{next(_hosts)}", 27017, "smartdatamodels"
+        mongo_standin.install(self.host, self.port)
+
+    def args(self, collection_name: str = "versions") -> tuple:
+        return self.host, self.port, self.db, collection_name
+
+    def collection(self, name: str = "versions"):
+        return connect_to_mongodb(self.host, self.port, self.db, name, create_indexes=True)
+
+
+@pytest.fixture
+def mongo():
+    return Mongo()
+
+
+@pytest.fixture
+def mock_github(monkeypatch):
+    """
+    Start a MockGithub and point every GithubCrawler and GraphqlBackend created by the code under
+    test to it, without the on-disk HTTP cache. Set the `datamodels` and `errors` of the mock
+    before crawling.
+    """
+    with MockGithub() as mock:
+        crawler_init, graphql_init = crawler.GithubCrawler.__init__, graphql.GraphqlBackend.__init__
+
+        def crawler_with_mock(self, access_token, max_per_host=8, **kwargs):
+            session = github_session(None, governor=RateLimitGovernor(), pool_size=max_per_host, cache=None)
+            crawler_init(self, access_token, max_per_host, api_url=mock.url, session=session)
+
+        def graphql_with_mock(self, access_token, **kwargs):
+            session = github_session(None, governor=RateLimitGovernor(), cache=None)
+            graphql_init(self, access_token, url=f"{mock.url}/graphql", session=session)
+
+        monkeypatch.setattr(crawler.GithubCrawler, "__init__", crawler_with_mock)
+        monkeypatch.setattr(graphql.GraphqlBackend, "__init__", graphql_with_mock)
+        yield mock
@@ -0,0 +1,85 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from db_versions.utils.columnar import ColumnarSnapshot, export_columnar, export_documents
+from db_versions.utils.git_mirror import VersionChange
+from db_versions.utils.history import history_collection, record_changes
+from db_versions.utils.mongodb import clean_document, iter_json_documents
+
+SUBJECT = "dataModel.ParksAndGardens"
+
+VERSIONS = [
+    {"subject": SUBJECT, "dataModel": "Garden", "version": "0.0.4", "date": datetime(2023, 11, 16, 14, 3, 41),
+     "link": "https://example.com/Garden", "commitMessage": "Update schema.json"},
+    {"subject": SUBJECT, "dataModel": "Park", "version": "0.10.0", "date": datetime(2022, 1, 1)},
+    {"subject": "dataModel.Weather", "dataModel": "WeatherForecast", "version": "0.9.1", "date": datetime(2024, 3, 1)},
+]
+
+
+def _change(datamodel: str, sha: str, date: datetime, old: str, new: str) -> VersionChange:
+    return VersionChange(SUBJECT, datamodel, f"{datamodel}/schema.json", sha, date, f"https://example.com/{sha}", old, new)
+
+
+@pytest.fixture
+def collections(mongo):
+    versions = mongo.collection()
+    versions.insert_many([clean_document(dict(document)) for document in VERSIONS])
+    history = history_collection(mongo.host, mongo.port, mongo.db, "history")
+    record_changes(history, [
+        _change("Garden", "a1", datetime(2023, 1, 1), None, "0.0.3"),
+        _change("Garden", "a2", datetime(2023, 11, 16), "0.0.3", "0.0.4"),
+    ])
+    return versions, history
+
+
+def test_round_trip(tmp_path, collections):
+    versions, history = collections
+    path = str(tmp_path / "versions.cols")
+
+    assert export_columnar(path, versions, history) == {"versions": (3, "full"), "history": (2, "full")}
+
+    with ColumnarSnapshot(path) as snapshot:
+        table = snapshot["versions"]
+        garden = table.find(subject=SUBJECT, datamodel="Garden")[0]
+        assert {key: garden[key] for key in VERSIONS[0]} == VERSIONS[0]
+        assert [document["dataModel"] for document in table.find(subject=SUBJECT)] == ["Garden", "Park"]
+        assert [document["dataModel"] for document in table.find(min_version="0.9.0")] == ["Park", "WeatherForecast"]
+        assert [document["dataModel"] for document in table.find(since="2023-06-01T00:00:00Z")] == ["Garden", "WeatherForecast"]
+        assert table.find(subject="dataModel.Unknown") == []
+        assert [document["version"] for document in snapshot["history"].find(datamodel="Garden")] == ["0.0.3", "0.0.4"]
+
+
+def test_incremental_history_and_updated_versions(tmp_path, collections):
+    versions, history = collections
+    path = str(tmp_path / "versions.cols")
+    export_columnar(path, versions, history)
+
+    record_changes(history, [_change("Park", "b1", datetime(2022, 1, 1), "0.9.0", "0.10.0")])
+    # a version change that moves the date back, e.g. a load of an older export
+    versions.update_one({"subject": SUBJECT, "dataModel": "Garden"}, {"$set": {"version": "0.0.2", "date": datetime(2020, 1, 1)}})
+
+    assert export_columnar(path, versions, history) == {"versions": (3, "full"), "history": (3, "incremental")}
+    with ColumnarSnapshot(path) as snapshot:
+        garden = snapshot["versions"].find(subject=SUBJECT, datamodel="Garden")[0]
+        assert (garden["version"], garden["date"]) == ("0.0.2", datetime(2020, 1, 1))
+        assert [document["sha"] for document in snapshot["history"].find(subject=SUBJECT)] == ["a1", "a2", "b1"]
+
+    history.delete_many({"sha": "a1"})
+    assert export_columnar(path, versions, history)["history"] == (2, "full")
+    assert export_columnar(path, versions, history, incremental=False)["history"] == (2, "full")
+
+
+def test_export_documents_from_json(tmp_path):
+    source = tmp_path / "versions.json"
+    source.write_text(json.dumps([
+        {"_id": {"$oid": "65a5a0f1c2d3e4f5a6b7c8d9"}, "subject": SUBJECT, "dataModel": "Garden", "version": "0.0.4",
+         "date": "2023-11-16T14:03:41Z"},
+    ]))
+    path = str(tmp_path / "versions.cols")
+
+    documents = (clean_document(document) for document in iter_json_documents(str(source)))
+    assert export_documents(path, documents) == {"versions": (1, "full")}
+    with ColumnarSnapshot(path) as snapshot:
+        assert snapshot["versions"].find(version="0.0.4")[0]["date"] == datetime(2023, 11, 16, 14, 3, 41)
@@ -0,0 +1,42 @@
+import asyncio
+
+from db_versions.utils.crawler import CrawlTarget, GithubCrawler
+from db_versions.utils.utils import _commit_changes_string, _version_change
+
+PATH = "Garden/schema.json"
+
+# a commit changing "modelTags", with "$schemaVersion" as a context line
+CONTEXT_ONLY = {"files": [{"filename": PATH, "patch": (
+    '@@ -1,4 +1,4 @@\n'
+    ' {\n'
+    '   "$schemaVersion": "0.1.3",\n'
+    '-  "modelTags": "",\n'
+    '+  "modelTags": "GSMA",\n'
+)}]}
+
+VERSION_BUMP = {"files": [{"filename": PATH, "patch": (
+    '@@ -1,3 +1,3 @@\n'
+    ' {\n'
+    '-  "$schemaVersion": "0.1.2",\n'
+    '+  "$schemaVersion": "0.1.3",\n'
+)}]}
+
+
+def test_context_lines_are_not_a_version_change():
+    assert not _commit_changes_string(CONTEXT_ONLY, PATH, "$schemaVersion")
+    assert _version_change(CONTEXT_ONLY, PATH, "$schemaVersion") is None
+
+
+def test_version_change():
+    assert _commit_changes_string(VERSION_BUMP, PATH, "$schemaVersion")
+    assert _version_change(VERSION_BUMP, PATH, "$schemaVersion") == ("0.1.2", "0.1.3")
+    assert _version_change(VERSION_BUMP, "Park/schema.json", "$schemaVersion") is None
+
+
+def test_last_commit_walks_past_context_only_commits(mock_github):
+    # the newer commits of the mock only show "$schemaVersion" as a context line
+    mock_github.commits_per_file = 3
+    result = asyncio.run(GithubCrawler(None).last_commit(CrawlTarget("dataModel.Test", "Garden"), "$schemaVersion"))
+
+    assert result.sha == mock_github._sha("smart-data-models/dataModel.Test", PATH, 2)
+    assert (result.previous_version, result.version) == ("0.0.3", "0.0.4")
@@ -0,0 +1,49 @@
+import json
+import os
+
+from db_versions.utils.diff import KeyChange, analyze_commit, analyze_commits, analyze_lines, iter_changed_lines
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "db_versions", "utils", "github_commit_data.json")
+
+PATCH = """@@ -1,5 +1,5 @@
+ {
+-  "$schemaVersion": "0.1.2",
++  "$schemaVersion": "0.1.3",
+   "title": "Smart Data Models - Air quality observed",
+--  "modelTags": "",
++  "modelTags": "GSMA",
+"""
+
+
+def _fixture() -> dict:
+    with open(FIXTURE_PATH, "r") as file:
+        return json.load(file)
+
+
+def test_iter_changed_lines_skips_file_headers():
+    lines = ["diff --git a/x b/x", "index 1..2", "--- a/x", "+++ b/x"] + PATCH.splitlines()
+
+    assert list(iter_changed_lines(lines))[:2] == [("-", '  "$schemaVersion": "0.1.2",'), ("+", '  "$schemaVersion": "0.1.3",')]
+    # a removed line starting with "--" is not a header once the hunk started
+    assert ("-", '-  "modelTags": "",') in list(iter_changed_lines(PATCH))
+
+
+def test_analyze_lines():
+    changes = analyze_lines(PATCH, ("$schemaVersion", "modelTags", "title"))
+
+    assert changes == {"$schemaVersion": KeyChange("0.1.2", "0.1.3"), "modelTags": KeyChange("", "GSMA")}
+
+
+def test_analyze_commit_of_the_fixture():
+    commit = _fixture()
+
+    assert analyze_commit(commit, ("$schemaVersion",)) == [("Garden/schema.json", {"$schemaVersion": KeyChange("0.0.3", "0.0.4")})]
+    assert analyze_commit(commit, ("$schemaVersion",), file_path="Park/schema.json") == []
+
+
+def test_analyze_commits_in_order():
+    commits = [_fixture(), {"files": [{"filename": "README.md"}]}, _fixture()]
+
+    results = list(analyze_commits(commits, ("$schemaVersion",), workers=1))
+
+    assert [len(result) for result in results] == [1, 0, 1]
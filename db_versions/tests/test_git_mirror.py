@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from db_versions.utils.git_mirror import latest_versions, rebuild_history, schema_version_history, update_mirror
+
+
+def _commit_schema(repository, datamodel, version, date):
+    os.makedirs(os.path.join(repository, datamodel), exist_ok=True)
+    with open(os.path.join(repository, datamodel, "schema.json"), "w") as file:
+        json.dump({"$schema": "http://json-schema.org/schema#", "$schemaVersion": version, "title": datamodel}, file, indent=2)
+    environment = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    subprocess.run(["git", "-C", repository, "add", "-A"], check=True)
+    subprocess.run(
+        ["git", "-C", repository, "-c", "user.name=test", "-c", "user.email=test@example.com",
+         "commit", "--quiet", "-m", f"{datamodel} {version}"],
+        check=True, env=environment,
+    )
+
+
+@pytest.fixture
+def mirror_dir(tmp_path):
+    """
+    A mirror directory with the mirror of a fixture repository, dataModel.Test, in which
+    Garden went 0.0.1 -> 0.0.2 -> 0.0.3 and Park was added at 0.1.0.
+    """
+    repository = str(tmp_path / "dataModel.Test")
+    subprocess.run(["git", "init", "--quiet", repository], check=True)
+    _commit_schema(repository, "Garden", "0.0.1", "2023-01-01T00:00:00Z")
+    _commit_schema(repository, "Garden", "0.0.2", "2023-02-01T00:00:00Z")
+    _commit_schema(repository, "Park", "0.1.0", "2023-03-01T00:00:00Z")
+    _commit_schema(repository, "Garden", "0.0.3", "2023-04-01T00:00:00Z")
+
+    mirrors = str(tmp_path / "mirrors")
+    update_mirror("dataModel.Test", mirrors, remote_url=repository)
+    return mirrors
+
+
+def test_schema_version_history(mirror_dir):
+    changes = list(schema_version_history(os.path.join(mirror_dir, "dataModel.Test.git")))
+
+    assert [(change.datamodel, change.old_version, change.new_version) for change in changes] == [
+        ("Garden", "0.0.2", "0.0.3"),
+        ("Park", None, "0.1.0"),
+        ("Garden", "0.0.1", "0.0.2"),
+        ("Garden", None, "0.0.1"),
+    ]
+    assert all(change.subject == "dataModel.Test" for change in changes)
+    assert changes[0].path == "Garden/schema.json"
+    assert changes[0].date.isoformat() == "2023-04-01T00:00:00+00:00"
+    assert changes[0].url.endswith(f"/dataModel.Test/commit/{changes[0].sha}")
+
+
+def test_rebuild_history_skips_missing_mirrors(mirror_dir, capsys):
+    changes = list(rebuild_history(mirror_dir, ["dataModel.Missing", "dataModel.Test"], workers=1))
+
+    latest = {change.datamodel: change.new_version for change in latest_versions(changes)}
+    assert latest == {"Garden": "0.0.3", "Park": "0.1.0"}
+    assert "dataModel.Missing" in capsys.readouterr().out
+
+
+def test_rebuild_history_skips_unreadable_mirrors(mirror_dir):
+    # a mirror without any commit: `git log HEAD` fails
+    subprocess.run(["git", "init", "--quiet", "--bare", os.path.join(mirror_dir, "dataModel.Empty.git")], check=True)
+
+    changes = list(rebuild_history(mirror_dir, workers=1))
+
+    assert {change.subject for change in changes} == {"dataModel.Test"}
+    assert len(changes) == 4
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from db_versions.main import crawl_and_reconcile
+from db_versions.utils.crawler import CrawlTarget
+from db_versions.utils.graphql import GraphqlBackend, batch_targets, build_query
+
+SUBJECT = "dataModel.ParksAndGardens"
+
+
+def test_batch_targets_splits_large_subjects():
+    targets = [CrawlTarget(SUBJECT, f"Model{index}") for index in range(5)] + [CrawlTarget("dataModel.Weather", "Weather")]
+
+    batches = batch_targets(targets, max_paths=3)
+
+    assert [[(subject, len(subject_targets)) for subject, subject_targets in batch] for batch in batches] == [
+        [(SUBJECT, 3)], [(SUBJECT, 2), ("dataModel.Weather", 1)],
+    ]
+    assert 'h1: history(path: "Model4/schema.json", first: 1)' in build_query(batches[1])
+
+
+def test_last_commits_from_the_stub_server(mock_github):
+    backend = GraphqlBackend(None)
+
+    results = backend.last_commits([(SUBJECT, "Garden"), (SUBJECT, "Park")], "$schemaVersion")
+
+    assert [(target.datamodel, result.version) for target, result in results] == [("Garden", "0.0.4"), ("Park", "0.0.4")]
+    garden = results[0][1]
+    assert garden.date.replace(tzinfo=None) == datetime(2023, 11, 16, 14, 3, 41)
+    assert garden.url == f"https://github.com/smart-data-models/{SUBJECT}/commit/{garden.sha}"
+    assert backend.failed == set()
+
+
+def test_graphql_sweep_leaves_the_dates_unchanged(mongo, mock_github):
+    versions = mongo.collection()
+    versions.insert_many([
+        {"subject": SUBJECT, "dataModel": "Garden", "version": "0.0.4", "date": datetime(2023, 1, 1)},
+        {"subject": SUBJECT, "dataModel": "Park", "version": "0.0.3", "date": datetime(2023, 1, 1)},
+    ])
+
+    results = crawl_and_reconcile(*mongo.args(), "token", "$schemaVersion", backend="graphql")
+
+    assert sorted(results) == [
+        (SUBJECT, "Garden", "Database is already up to date"),
+        (SUBJECT, "Park", "Input version does not match the actual version in the database"),
+    ]
+    assert {document["date"] for document in versions.find({})} == {datetime(2023, 1, 1)}
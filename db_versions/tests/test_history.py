@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pytest
+
+from db_versions.utils.git_mirror import VersionChange
+from db_versions.utils.history import HistoryIndex, as_of, history_collection, record_changes, version_history
+
+SUBJECT = "dataModel.ParksAndGardens"
+
+CHANGES = [
+    VersionChange(SUBJECT, "Garden", "Garden/schema.json", "c2", datetime(2023, 6, 1), "url", "0.0.2", "0.0.3"),
+    VersionChange(SUBJECT, "Garden", "Garden/schema.json", "c1", datetime(2023, 1, 1), "url", None, "0.0.2"),
+    VersionChange(SUBJECT, "Garden", "Garden/schema.json", "c3", datetime(2024, 1, 1), "url", "0.0.3", "0.0.4"),
+    VersionChange(SUBJECT, "Park", "Park/schema.json", "c4", datetime(2022, 1, 1), "url", None, "0.1.0"),
+]
+
+
+@pytest.fixture
+def history(mongo):
+    collection = history_collection(mongo.host, mongo.port, mongo.db, "history")
+    assert record_changes(collection, CHANGES) == 4
+    assert record_changes(collection, CHANGES) == 0
+    return collection
+
+
+def test_history_index_matches_the_queries(history):
+    index = HistoryIndex(history).load()
+
+    assert list(index.history(SUBJECT, "Garden")) == [
+        (datetime(2023, 1, 1), "0.0.2"), (datetime(2023, 6, 1), "0.0.3"), (datetime(2024, 1, 1), "0.0.4"),
+    ]
+    assert list(index.history(SUBJECT, "Garden")) == [
+        (document["date"], document["version"]) for document in version_history(history, SUBJECT, "Garden")
+    ]
+    for timestamp in ("2022-06-01T00:00:00Z", "2023-01-01T00:00:00Z", "2023-12-31T00:00:00Z", "2025-01-01T00:00:00Z"):
+        document = as_of(history, SUBJECT, "Garden", timestamp)
+        assert index.as_of(SUBJECT, "Garden", timestamp) == (document and document["version"])
+    assert index.as_of(SUBJECT, "Park", "2023-01-01T00:00:00Z") == "0.1.0"
+    assert index.as_of(SUBJECT, "Pond", "2023-01-01T00:00:00Z") is None
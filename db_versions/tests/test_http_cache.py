@@ -0,0 +1,90 @@
+import pytest
+
+from benchmarks.mock_github import MockGithub
+from db_versions.utils.github_client import github_session
+from db_versions.utils.http_cache import HttpCache, cache_key
+from db_versions.utils.ratelimit import RateLimitGovernor
+
+SHA = "2032625b0b6cb59b1a54b4f2ea29a3c2a3ad4ae0"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = HttpCache(str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_cache_key():
+    assert cache_key("https://api.github.com:443/repos/a/b") == cache_key("https://api.github.com/repos/a/b")
+    assert cache_key("http://127.0.0.1:8080/repos/a/b") == "http://127.0.0.1:8080/repos/a/b"
+    first = cache_key("https://api.github.com/repos/a/b", {"Authorization": "token first"})
+    second = cache_key("https://api.github.com/repos/a/b", {"authorization": "token second"})
+    assert len({first, second, cache_key("https://api.github.com/repos/a/b")}) == 3
+    assert "first" not in first
+    assert HttpCache.is_immutable(cache_key(f"https://api.github.com:443/repos/a/b/commits/{SHA}", {"Authorization": "token x"}))
+    assert not HttpCache.is_immutable("https://api.github.com/repos/a/b/commits?path=Garden/schema.json")
+
+
+def test_put_get_and_eviction(tmp_path):
+    cache = HttpCache(str(tmp_path / "cache.sqlite"), max_bytes=250)
+    cache.put("a", {"ETag": '"1"', "X-RateLimit-Remaining": "10"}, b"x" * 100)
+    cache.put("b", {"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}, b"y" * 100)
+    assert cache.get("a")["etag"] == '"1"'
+    assert "X-RateLimit-Remaining" not in cache.get("a")["headers"]
+
+    # "b" is now the least recently used response
+    cache.put("c", {}, b"z" * 100)
+
+    assert cache.get("b") is None
+    assert cache.get("a")["body"] == b"x" * 100 and cache.get("c") is not None
+    cache.close()
+
+
+def test_size_follows_every_write(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = HttpCache(path, max_bytes=250)
+    cache.put("a", {}, b"x" * 100)
+    cache.put("a", {}, b"x" * 50)
+    cache.put("b", {}, b"y" * 100)
+    assert cache.size() == 150
+
+    cache.put("c", {}, b"z" * 120)
+    assert cache.size() == 220
+    cache.close()
+
+    # the total is read back, not recomputed, when the cache is opened again
+    cache = HttpCache(path, max_bytes=250)
+    assert cache.size() == 220
+    cache.clear()
+    assert cache.size() == 0
+    cache.close()
+
+
+def test_size_of_a_cache_created_without_a_total(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = HttpCache(path)
+    cache.put("a", {}, b"x" * 100)
+    cache._connection.execute("DROP TABLE total")
+    cache.close()
+
+    cache = HttpCache(path)
+    assert cache.size() == 100
+    cache.close()
+
+
+def test_session_revalidates_and_serves_immutable_urls(cache):
+    with MockGithub(datamodels={"dataModel.ParksAndGardens": ["Garden"]}) as mock:
+        session = github_session(None, governor=RateLimitGovernor(), cache=cache)
+        listing = f"{mock.url}/repos/smart-data-models/dataModel.ParksAndGardens/commits?path=Garden/schema.json"
+
+        first = session.get(listing)
+        second = session.get(listing)
+        assert first.json() == second.json()
+        assert second.headers["X-From-Cache"] == "1"
+        assert (mock.requests, mock.not_modified) == (2, 1)
+
+        commit = first.json()[-1]["url"]
+        assert session.get(commit).json()["sha"] == session.get(commit).json()["sha"]
+        # the commit is addressed by its SHA: the second read makes no request
+        assert mock.requests == 3
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import pytest
+
+from db_versions.main import check_version_and_update, crawl_and_reconcile, reconcile_versions
+from db_versions.utils.history import history_collection
+from db_versions.utils.sync_state import get_blobs, sync_state_collection
+
+SUBJECT = "dataModel.ParksAndGardens"
+
+# the date of the commit replayed by the mock (utils/github_commit_data.json)
+COMMIT_DATE = datetime(2023, 11, 16, 14, 3, 41)
+
+
+@pytest.fixture
+def versions(mongo):
+    collection = mongo.collection()
+    collection.insert_many([
+        {"subject": SUBJECT, "dataModel": datamodel, "version": "0.0.4", "date": datetime(2023, 1, 1)}
+        for datamodel in ("Garden", "Park")
+    ])
+    return collection
+
+
+def _dates(collection) -> dict:
+    return {document["dataModel"]: document["date"].replace(tzinfo=None) for document in collection.find({})}
+
+
+def test_changed_only_keeps_the_blobs_of_failed_crawls(mongo, versions, mock_github):
+    mock_github.datamodels = {SUBJECT: ["Garden", "Park"]}
+    mock_github.errors = {"Park/schema.json"}
+
+    results = crawl_and_reconcile(*mongo.args(), None, "$schemaVersion", changed_only=True, sync_collection_name="sync")
+
+    assert [(datamodel, status) for _, datamodel, status in results] == [("Garden", "Database updated with the latest commit date")]
+    sync = sync_state_collection(mongo.host, mongo.port, mongo.db, "sync")
+    assert set(get_blobs(sync)) == {(SUBJECT, "Garden/schema.json")}
+
+    # the next run crawls the datamodel that failed, and only that one
+    mock_github.errors = set()
+    results = crawl_and_reconcile(*mongo.args(), None, "$schemaVersion", changed_only=True, sync_collection_name="sync")
+
+    assert [datamodel for _, datamodel, _ in results] == ["Park"]
+    assert set(get_blobs(sync)) == {(SUBJECT, "Garden/schema.json"), (SUBJECT, "Park/schema.json")}
+    assert _dates(versions) == {"Garden": COMMIT_DATE, "Park": COMMIT_DATE}
+
+
+def test_sweep_records_the_version_commits(mongo, versions, mock_github):
+    crawl_and_reconcile(*mongo.args(), None, "$schemaVersion", targets=[(SUBJECT, "Garden")], history_collection_name="history")
+
+    history = history_collection(mongo.host, mongo.port, mongo.db, "history")
+    transitions = list(history.find({}, {"_id": 0}))
+    assert [(document["dataModel"], document["previousVersion"], document["version"]) for document in transitions] == [
+        ("Garden", "0.0.3", "0.0.4"),
+    ]
+    assert transitions[0]["date"].replace(tzinfo=None) == COMMIT_DATE
+
+    # the same commit is recorded once
+    crawl_and_reconcile(*mongo.args(), None, "$schemaVersion", targets=[(SUBJECT, "Garden")], history_collection_name="history")
+    assert history.count_documents({}) == 1
+
+
+def test_reconcile_versions_statuses(mongo, versions):
+    records = [
+        (SUBJECT, "Garden", "0.0.4", "2023-11-16T14:03:41Z", "Update schema.json"),
+        (SUBJECT, "Park", "0.0.4", "2022-06-01T00:00:00Z"),
+        (SUBJECT, "Park", "0.0.5", "2024-01-01T00:00:00Z"),
+        (SUBJECT, "Pond", "0.0.1", "2024-01-01T00:00:00Z"),
+    ]
+
+    results = reconcile_versions(*mongo.args(), records)
+
+    assert [status for _, _, status in results] == [
+        "Database updated with the latest commit date",
+        "Database is already up to date",
+        "Input version does not match the actual version in the database",
+        "Datamodel not found in the database",
+    ]
+    garden = versions.find_one({"subject": SUBJECT, "dataModel": "Garden"})
+    assert garden["date"] == COMMIT_DATE and garden["commitMessage"] == "Update schema.json"
+    assert versions.find_one({"subject": SUBJECT, "dataModel": "Park"})["date"] == datetime(2023, 1, 1)
+
+
+def test_check_version_and_update(mongo, versions):
+    args = (*mongo.args(), SUBJECT, "Park", "0.0.4")
+
+    assert check_version_and_update(*args, "2023-11-16T14:03:41Z") == "Database updated with the latest commit date"
+    assert check_version_and_update(*args, "2023-11-16T14:03:41Z") == "Database is already up to date"
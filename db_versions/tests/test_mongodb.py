@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from db_versions.utils.mongodb import iter_json_documents, load_versions, migrate_dates, version_key
+
+DOCUMENTS = [
+    {"_id": {"$oid": "65a5a0f1c2d3e4f5a6b7c8d9"}, "subject": "dataModel.Environment", "dataModel": "AirQualityObserved",
+     "version": "0.1.3", "date": "2023-10-15T08:30:00Z", "link": "https://example.com/1"},
+    {"subject": "dataModel.Weather", "dataModel": "WeatherForecast", "version": "0.10.0", "date": "2022-01-01T00:00:00Z"},
+    {"name": "not a versions document"},
+]
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / "versions.json"
+    path.write_text(json.dumps(DOCUMENTS, indent=2))
+    return str(path)
+
+
+@pytest.mark.parametrize("buffer_size", [7, 64, 1 << 16])
+def test_iter_json_documents_streams_any_buffer_size(export, buffer_size):
+    assert list(iter_json_documents(export, buffer_size=buffer_size)) == DOCUMENTS
+
+
+def test_iter_json_documents_single_document(tmp_path):
+    path = tmp_path / "document.json"
+    path.write_text(json.dumps(DOCUMENTS[1]))
+
+    assert list(iter_json_documents(str(path))) == [DOCUMENTS[1]]
+
+
+def test_load_versions_is_idempotent(export, mongo):
+    collection = mongo.collection()
+
+    first = load_versions(export, collection, chunk_size=1)
+    second = load_versions(export, collection)
+
+    assert first == {"read": 3, "inserted": 2, "updated": 0, "unchanged": 0, "skipped": 1}
+    assert second == {"read": 3, "inserted": 0, "updated": 0, "unchanged": 2, "skipped": 1}
+    document = collection.find_one({"subject": "dataModel.Environment", "dataModel": "AirQualityObserved"})
+    assert document["date"] == datetime(2023, 10, 15, 8, 30)
+    assert document["versionKey"] == version_key("0.1.3") and document["versionMajor"] == 0
+    assert document["_id"] != DOCUMENTS[0]["_id"]
+
+
+def test_migrate_dates(mongo):
+    collection = mongo.collection()
+    collection.insert_many([
+        {"subject": "s", "dataModel": "A", "date": "2023-10-15T08:30:00Z"},
+        {"subject": "s", "dataModel": "B", "date": datetime(2023, 1, 1)},
+    ])
+
+    assert migrate_dates(collection) == 1
+    assert migrate_dates(collection) == 0
+    assert {document["dataModel"]: document["date"] for document in collection.find({})} == {
+        "A": datetime(2023, 10, 15, 8, 30), "B": datetime(2023, 1, 1),
+    }
@@ -0,0 +1,128 @@
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from db_versions.utils.github_client import github_session
+from db_versions.utils.ratelimit import RateLimitGovernor
+
+
+def budget(remaining: int, reset_in: float = 100.0, **headers) -> dict:
+    return {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(time.time() + reset_in), **headers}
+
+
+def test_no_pacing_while_the_budget_outlasts_the_rate():
+    governor = RateLimitGovernor()
+    governor.observe(budget(5000))
+
+    assert [governor._reserve() for _ in range(50)] == [0.0] * 50
+    assert governor.status()["remaining"] == 4950
+
+
+def test_pacing_spreads_the_rest_of_the_budget_until_the_reset():
+    governor = RateLimitGovernor(security_margin=2, burst=0)
+    governor.observe(budget(4))
+
+    first, second, third = (governor._reserve() for _ in range(3))
+
+    # 2 usable requests over 100 seconds: one now, one half-way, then nothing until the reset
+    assert first == 0.0
+    assert 49 < second <= 50
+    assert 100 < third <= 101
+
+
+def test_conditional_requests_reserve_no_budget():
+    governor = RateLimitGovernor()
+    governor.observe(budget(10))
+
+    assert governor._reserve(reserve=False) == 0.0
+    assert governor.status()["remaining"] == 10
+
+
+def test_other_resources_keep_the_core_budget():
+    governor = RateLimitGovernor()
+    governor.observe(budget(4000))
+    governor.observe(budget(10, **{"X-RateLimit-Resource": "graphql"}))
+
+    assert governor.status()["remaining"] == 4000
+
+
+@pytest.mark.parametrize("http_date", [False, True])
+def test_retry_after_blocks_every_request(http_date):
+    # an HTTP date has a resolution of one second
+    retry_after = formatdate(time.time() + 30.5, usegmt=True) if http_date else "30"
+    governor = RateLimitGovernor()
+    governor.observe({"Retry-After": retry_after}, 429)
+
+    assert 28 < governor._reserve() <= 31
+    assert 28 < governor._reserve(reserve=False) <= 31
+
+
+def test_state_file_shares_the_budget(tmp_path):
+    path = str(tmp_path / "rate.json")
+    first, second = RateLimitGovernor(state_path=path), RateLimitGovernor(state_path=path)
+
+    first.observe(budget(100))
+    second._reserve()
+
+    assert first.status()["remaining"] == 99
+    assert second.status()["remaining"] == 99
+
+
+@pytest.fixture
+def server():
+    """
+    A server answering the first request with a secondary limit, then 200, and recording the paths.
+    """
+    paths = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _answer(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            paths.append(self.path)
+            limited = len(paths) == 1
+            self.send_response(429 if limited else 200)
+            if limited:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        do_GET = do_POST = _answer
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", paths
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_adapter_retries_after_a_secondary_limit(server):
+    url, paths = server
+    response = github_session(None, governor=RateLimitGovernor(), cache=None).get(f"{url}/repos/o/r")
+
+    assert response.status_code == 200
+    assert paths == ["/repos/o/r", "/repos/o/r"]
+
+
+def test_adapter_reserves_no_core_budget_for_graphql(server, monkeypatch):
+    url, _ = server
+    governor = RateLimitGovernor()
+    reserved = []
+    monkeypatch.setattr(governor, "acquire", lambda reserve=True: reserved.append(reserve))
+    session = github_session(None, governor=governor, cache=None)
+
+    session.post(f"{url}/graphql", json={"query": "{}"})
+    session.get(f"{url}/repos/o/r")
+    session.get(f"{url}/repos/o/r", headers={"If-None-Match": '"etag"'})
+
+    # the first POST is retried after the secondary limit
+    assert reserved == [False, False, True, False]
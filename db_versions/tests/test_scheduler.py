@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from db_versions.utils.scheduler import DONE, FAILED, PENDING, SqliteTaskStore, SweepScheduler, default_state_path
+
+KEYS = [("dataModel.A", "One"), ("dataModel.A", "Two"), ("dataModel.B", "Three")]
+
+
+class FlakyWork:
+    """
+    A work function failing the first `failures` attempts of each task of `flaky`.
+    """
+
+    def __init__(self, flaky: dict):
+        self.flaky = dict(flaky)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, subject, datamodel):
+        with self._lock:
+            self.calls.append((subject, datamodel))
+            if self.flaky.get((subject, datamodel), 0) > 0:
+                self.flaky[(subject, datamodel)] -= 1
+                raise RuntimeError("rate limited")
+        return f"{datamodel} done"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteTaskStore(str(tmp_path / "sweep.sqlite"))
+    yield store
+    store.close()
+
+
+def test_failed_tasks_are_retried(store):
+    work = FlakyWork({KEYS[0]: 1, KEYS[2]: 5})
+    reports = []
+
+    counts = SweepScheduler(store, work, workers=2, max_attempts=3, backoff=0.01).run(
+        KEYS, report=lambda *report: reports.append(report)
+    )
+
+    assert counts == {PENDING: 0, DONE: 2, FAILED: 1}
+    assert work.calls.count(KEYS[0]) == 2 and work.calls.count(KEYS[2]) == 3
+    assert (KEYS[0][0], KEYS[0][1], "One done") in reports
+    assert store.failures("sweep") == [(KEYS[2][0], KEYS[2][1], "RuntimeError: rate limited")]
+
+
+def test_resume_only_runs_the_remaining_tasks(store):
+    SweepScheduler(store, FlakyWork({KEYS[2]: 1}), max_attempts=1).run(KEYS)
+
+    work = FlakyWork({})
+    counts = SweepScheduler(store, work, max_attempts=1).run(KEYS, resume=True)
+
+    assert work.calls == [KEYS[2]]
+    assert counts[DONE] == 3
+
+    # without resume every task starts over
+    work = FlakyWork({})
+    SweepScheduler(store, work).run(KEYS)
+    assert sorted(work.calls) == sorted(KEYS)
+
+
+def test_default_state_path(monkeypatch, tmp_path):
+    monkeypatch.delenv("SWEEP_STATE", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_state_path() == str(tmp_path / "db-versions" / "sweep.sqlite")
+
+    monkeypatch.setenv("SWEEP_STATE", "/data/sweep.sqlite")
+    assert default_state_path() == "/data/sweep.sqlite"
@@ -0,0 +1,49 @@
+import pytest
+
+from benchmarks.mongo_standin import MemoryCollection
+from db_versions.utils.mongodb import major_bumps, version_fields, version_key, versions_between
+
+
+@pytest.mark.parametrize("lower, higher", [
+    ("0.9.0", "0.10.0"),
+    ("1.0.0-rc1", "1.0.0"),
+    ("1.0.0", "1.0.0.1"),
+    ("1.0.0.1", "1.0.1"),
+    ("1.2", "1.2.1"),
+])
+def test_version_key_order(lower, higher):
+    assert version_key(lower) < version_key(higher)
+
+
+def test_version_key_equivalences():
+    assert version_key("1.2") == version_key("1.2.0") == version_key("v1.2.0.0")
+    assert version_key("1.0.0+build.5") == version_key("1.0.0")
+    assert version_key("1.0.0-rc1+build") == version_key("1.0.0-rc1")
+    assert version_key("latest") is None
+    assert version_fields("2.1.0") == {"versionKey": version_key("2.1.0"), "versionMajor": 2}
+
+
+@pytest.fixture
+def collection():
+    collection = MemoryCollection()
+    versions = {"A": "0.9.0", "B": "0.10.0", "C": "1.0.0-rc1", "D": "1.0.0", "E": "1.0.0.1", "F": "2.0.0"}
+    collection.insert_many(
+        [{"subject": "s", "dataModel": name, "version": version, "date": f"2024-01-0{index + 1}", **version_fields(version)}
+         for index, (name, version) in enumerate(versions.items())]
+    )
+    return collection
+
+
+def test_versions_between(collection):
+    assert [document["dataModel"] for document in versions_between(collection, "0.10", "1.0.0")] == ["B", "C", "D"]
+    assert [document["dataModel"] for document in versions_between(collection, lowest="1.0.0")] == ["D", "E", "F"]
+
+
+@pytest.mark.parametrize("bounds", [{"lowest": "latest"}, {"highest": "next"}])
+def test_versions_between_rejects_invalid_bounds(collection, bounds):
+    with pytest.raises(ValueError):
+        versions_between(collection, **bounds)
+
+
+def test_major_bumps_newest_first(collection):
+    assert [document["dataModel"] for document in major_bumps(collection, 1)] == ["E", "D", "C", "F"]
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import urllib.error
+import urllib.request
+from datetime import datetime
+from urllib.parse import urlencode
+
+import pytest
+
+from db_versions.main import reconcile_commits
+from db_versions.utils.history import history_collection
+from db_versions.utils.webhook import PushQueue, WebhookReceiver, push_commits, verify_signature
+
+PAYLOAD_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "db_versions", "utils", "github_push_payload.json")
+SECRET = "s3cret"
+SUBJECT = "dataModel.ParksAndGardens"
+
+
+@pytest.fixture
+def body():
+    with open(PAYLOAD_PATH, "rb") as file:
+        return file.read()
+
+
+def _sign(body: bytes, secret: str = SECRET) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _post(port: int, body: bytes, delivery: str, event: str = "push", signature: str = None, content_type: str = "application/json"):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/webhook", data=body, method="POST",
+        headers={
+            "X-Hub-Signature-256": signature or _sign(body), "X-GitHub-Event": event,
+            "X-GitHub-Delivery": delivery, "Content-Type": content_type,
+        },
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())["message"]
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())["message"]
+
+
+def _serve(process, deliveries, debounce: float = 60.0):
+    """
+    Post (body, delivery, options) deliveries one after the other to a receiver, then flush its queue.
+    Returns the (status, message) answers and the results of the flush.
+    """
+    async def run():
+        queue = PushQueue(process, debounce=debounce)
+        server = await WebhookReceiver(SECRET, queue).start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            answers = [await asyncio.to_thread(_post, port, body, delivery, **options) for body, delivery, options in deliveries]
+            return answers, await queue.flush()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(run())
+
+
+def test_push_commits(body):
+    commits = push_commits(json.loads(body))
+
+    assert list(commits) == [(SUBJECT, "Garden")]
+    assert commits[(SUBJECT, "Garden")][0].startswith("2032625b")
+    assert push_commits(json.loads(body), org="another-org") == {}
+
+
+def test_verify_signature(body):
+    assert verify_signature(SECRET, body, _sign(body))
+    assert not verify_signature("other", body, _sign(body))
+    assert not verify_signature(SECRET, body, None)
+
+
+def test_receiver_answers(body):
+    batches = []
+
+    def process(batch):
+        batches.append(batch)
+        return []
+
+    form = urlencode({"payload": body.decode()}).encode()
+    no_payload = urlencode({"other": "x"}).encode()
+    answers, _ = _serve(process, [
+        (body, "1", {}),
+        (body, "1", {}),
+        (body, "2", {"signature": _sign(body, "wrong")}),
+        (body, "3", {"event": "ping"}),
+        (form, "4", {"content_type": "application/x-www-form-urlencoded"}),
+        (no_payload, "5", {"content_type": "application/x-www-form-urlencoded"}),
+        (b"{not json", "6", {}),
+    ])
+
+    assert [status for status, _ in answers] == [202, 200, 401, 200, 202, 400, 400]
+    assert answers[1][1] == "already received"
+    # the pushes are deduplicated in one batch
+    assert len(batches) == 1 and list(batches[0]) == [(SUBJECT, "Garden")]
+
+
+def test_failed_batch_stays_queued(body):
+    attempts = []
+
+    def process(batch):
+        attempts.append(batch)
+        if len(attempts) == 1:
+            raise RuntimeError("GitHub is down")
+        return [(subject, datamodel, "processed") for subject, datamodel in batch]
+
+    async def run():
+        queue = PushQueue(process, debounce=60.0)
+        receiver = WebhookReceiver(SECRET, queue)
+        status, _ = receiver.receive("push", "1", body)
+        assert status == 202
+        assert await queue.flush() == []
+        assert len(queue) == 1
+        return await queue.flush()
+
+    assert asyncio.run(run()) == [(SUBJECT, "Garden", "processed")]
+    assert attempts[0] == attempts[1]
+
+
+def test_pushes_are_reconciled(body, mongo, mock_github):
+    versions = mongo.collection()
+    versions.insert_many([{"subject": SUBJECT, "dataModel": "Garden", "version": "0.0.4", "date": datetime(2023, 1, 1)}])
+
+    def process(batch):
+        # the mock only serves the commits it listed: replay the one that changes the version
+        repo = f"smart-data-models/{SUBJECT}"
+        mapped = {key: [mock_github._sha(repo, f"{key[1]}/schema.json", mock_github.commits_per_file - 1)] for key in batch}
+        return reconcile_commits(*mongo.args(), None, "$schemaVersion", mapped, history_collection_name="history")
+
+    answers, results = _serve(process, [(body, "1", {})])
+
+    assert answers == [(202, "1 datamodels queued")]
+    assert results == [(SUBJECT, "Garden", "Database updated with the latest commit date")]
+    assert versions.find_one({})["date"].replace(tzinfo=None) == datetime(2023, 11, 16, 14, 3, 41)
+    assert history_collection(mongo.host, mongo.port, mongo.db, "history").count_documents({}) == 1